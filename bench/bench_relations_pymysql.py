@@ -0,0 +1,400 @@
+"""
+Benchmarks for the Source CRUD hot paths, run against the MySQL from mysql.sh
+
+    python bench/bench_relations_pymysql.py --rows 1000 --repeat 5 --output bench.json
+    python bench/bench_relations_pymysql.py --compare bench.json --tolerance 0.2
+    python bench/bench_relations_pymysql.py --driver pymysql --driver mysqldb
+
+Prints JSON results, and with --compare exits non zero if any benchmark got slower than the
+tolerance allows against an earlier run. Given more than one driver, runs them all and adds how
+many times faster each is than the first.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+
+import pymysql
+
+import relations
+import relations_pymysql
+
+SCHEMA = "bench_source"
+
+class BenchModel(relations.Model):
+    SOURCE = "PyMySQLBench"
+
+class Simple(BenchModel):
+    id = int
+    name = str
+
+class Meta(BenchModel):
+    id = int
+    name = str
+    flag = bool
+    spend = float
+    people = set
+    stuff = list
+    things = dict, {"extract": "for__0____1"}
+
+class Unit(BenchModel):
+    id = int
+    name = str
+
+class Test(BenchModel):
+    id = int
+    unit_id = int
+    name = str
+
+relations.OneToMany(Unit, Test)
+
+class Sis(BenchModel):
+    id = int
+    name = str
+    bro_id = set
+
+class Bro(BenchModel):
+    id = int
+    name = str
+    sis_id = set
+
+class SisBro(BenchModel):
+    ID = None
+    bro_id = int
+    sis_id = int
+
+relations.ManyToMany(Sis, Bro, SisBro)
+
+MODELS = [Simple, Meta, Unit, Test, Sis, Bro, SisBro]
+
+
+def fresh(source, rows):
+    """
+    Nothing to set up, the benchmark creates its own rows
+    """
+
+def bulk_create(rows):
+    """
+    Creates rows in one bulk insert
+    """
+
+    simples = Simple.bulk()
+
+    for index in range(rows):
+        simples.add(f"simple-{index}")
+
+    simples.create()
+
+def auto_id_create(rows):
+    """
+    Creates rows one at a time, reading back each auto increment id
+    """
+
+    for index in range(rows):
+        Simple(f"simple-{index}").create()
+
+def json_setup(source, rows):
+    """
+    Rows with JSON fields to retrieve
+    """
+
+    metas = Meta.bulk()
+
+    for index in range(rows):
+        metas.add(f"meta-{index}", index % 2 == 0, index / 10, {"tom", "dick"}, [index, None], {"a": {"b": index}})
+
+    metas.create()
+
+def json_retrieve(rows):
+    """
+    Retrieves rows, decoding their JSON fields
+    """
+
+    assert len(Meta.many().retrieve()) == rows
+
+def ties_setup(source, rows):
+    """
+    Sisters each tied to a few brothers
+    """
+
+    bros = Bro.bulk()
+
+    for index in range(10):
+        bros.add(f"bro-{index}")
+
+    bros.create()
+
+    ids = Bro.many().id
+    chooser = random.Random(rows)
+
+    for index in range(rows):
+        Sis(f"sis-{index}", bro_id=chooser.sample(ids, 3)).create()
+
+def ties_retrieve_update(rows):
+    """
+    Retrieves sisters with their ties, then moves them all to different brothers
+    """
+
+    sises = Sis.many().retrieve()
+
+    assert len(sises) == rows
+
+    ids = Bro.many().id
+
+    for index, sis in enumerate(sises):
+        sis.bro_id = [ids[index % len(ids)]]
+
+    sises.update()
+
+def like_setup(source, rows):
+    """
+    Units and tests to search, half matching
+    """
+
+    for index in range(rows // 10 or 1):
+
+        unit = Unit(f"{'people' if index % 2 else 'stuff'}-{index}")
+
+        for test in range(10):
+            unit.test.add(f"{'persons' if test % 2 else 'things'}-{test}")
+
+        unit.create()
+
+def like(rows):
+    """
+    Searches tests by their own titles and their units'
+    """
+
+    assert Test.many(like="p").count()
+
+def delete_setup(source, rows):
+    """
+    Rows to delete
+    """
+
+    bulk_create(rows)
+
+def mass_delete(rows):
+    """
+    Deletes everything in one go
+    """
+
+    Simple.many().delete()
+
+BENCHMARKS = {
+    "bulk_create": (fresh, bulk_create),
+    "auto_id_create": (fresh, auto_id_create),
+    "json_retrieve": (json_setup, json_retrieve),
+    "ties_retrieve_update": (ties_setup, ties_retrieve_update),
+    "like": (like_setup, like),
+    "mass_delete": (delete_setup, mass_delete)
+}
+
+
+def reset(source):
+    """
+    Drops and creates the benchmark schema and tables
+    """
+
+    cursor = source.connection.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{SCHEMA}`")
+    cursor.execute(f"CREATE DATABASE `{SCHEMA}`")
+    cursor.close()
+
+    for model in MODELS:
+        source.execute(model.define())
+
+def version(source):
+    """
+    The MySQL server version
+    """
+
+    cursor = source.connection.cursor()
+    cursor.execute("SELECT VERSION() AS version")
+    server = cursor.fetchone()["version"]
+    cursor.close()
+
+    return server
+
+def commit():
+    """
+    The git commit benchmarked, if it can be found
+    """
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(source, names, rows, repeat, warmup):
+    """
+    Runs each benchmark on a fresh schema, timing only the benchmark itself
+    """
+
+    results = {}
+
+    for name in names:
+
+        setup, benchmark = BENCHMARKS[name]
+        seconds = []
+
+        for attempt in range(warmup + repeat):
+
+            random.seed(attempt)
+            reset(source)
+            setup(source, rows)
+
+            start = time.perf_counter()
+            benchmark(rows)
+            took = time.perf_counter() - start
+
+            if attempt >= warmup:
+                seconds.append(took)
+
+        median = statistics.median(seconds)
+
+        results[name] = {
+            "seconds": seconds,
+            "min": min(seconds),
+            "median": median,
+            "rows_per_second": rows / median if median else None
+        }
+
+    return results
+
+def compare(results, previous, tolerance):
+    """
+    Benchmarks whose median got slower than the tolerance allows
+    """
+
+    slower = {}
+
+    for name, result in results["results"].items():
+
+        before = previous.get("results", {}).get(name)
+
+        if before is None or not before["median"]:
+            continue
+
+        change = result["median"] / before["median"] - 1
+
+        if change > tolerance:
+            slower[name] = {"before": before["median"], "after": result["median"], "change": change}
+
+    return slower
+
+def bench(driver, args):
+    """
+    Runs the benchmarks on a driver
+    """
+
+    source = relations_pymysql.Source(
+        "PyMySQLBench", SCHEMA, host=os.environ["MYSQL_HOST"], port=int(os.environ.get("MYSQL_PORT", 3306)),
+        driver=driver
+    )
+
+    try:
+
+        results = {
+            "commit": commit(),
+            "python": platform.python_version(),
+            "driver": driver,
+            "pymysql": pymysql.__version__,
+            "mysql": version(source),
+            "rows": args.rows,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "results": run(source, args.only or list(BENCHMARKS), args.rows, args.repeat, args.warmup)
+        }
+
+        cursor = source.connection.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{SCHEMA}`")
+        cursor.close()
+
+    finally:
+
+        source.close()
+
+    return results
+
+def speedup(drivers):
+    """
+    How many times faster each driver's median is than the first driver's
+    """
+
+    names = list(drivers)
+    first = drivers[names[0]]["results"]
+
+    return {
+        name: {
+            driver: first[name]["median"] / drivers[driver]["results"][name]["median"]
+            for driver in names[1:] if drivers[driver]["results"][name]["median"]
+        }
+        for name in first
+    }
+
+def main(argv=None):
+    """
+    Runs the benchmarks and prints the JSON results
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark relations-pymysql")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per benchmark")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="benchmarks to run, all by default")
+    parser.add_argument(
+        "--driver", action="append", choices=sorted(relations_pymysql.Source.DRIVERS),
+        help="driver to run on, more than once to compare them, pymysql by default"
+    )
+    parser.add_argument("--output", help="file to write the JSON results to as well")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction slower that counts as a regression")
+    args = parser.parse_args(argv)
+
+    drivers = args.driver or ["pymysql"]
+
+    if len(drivers) == 1:
+        results = bench(drivers[0], args)
+    else:
+        results = {"drivers": {driver: bench(driver, args) for driver in drivers}}
+        results["speedup"] = speedup(results["drivers"])
+
+    status = 0
+
+    if args.compare:
+
+        with open(args.compare, "r") as previous_file:
+            previous = json.load(previous_file)
+
+        if "drivers" in results:
+            results["slower"] = {
+                driver: compare(results["drivers"][driver], previous.get("drivers", {}).get(driver, {}), args.tolerance)
+                for driver in drivers
+            }
+            status = 1 if any(results["slower"].values()) else 0
+        else:
+            results["slower"] = compare(results, previous, args.tolerance)
+            status = 1 if results["slower"] else 0
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+
+    print(text)
+
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
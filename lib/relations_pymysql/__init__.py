@@ -0,0 +1,12 @@
+"""
+Module for intersting with PyMySQL
+"""
+
+from relations_pymysql.batch import Batch, Buffer
+from relations_pymysql.cache import Cache
+from relations_pymysql.metrics import Metrics
+from relations_pymysql.compact import Row, Compact, CompactRow, Titled, Column
+from relations_pymysql.splitter import Splitter
+from relations_pymysql.driver import Driver, PyMySQLDriver, MySQLdbDriver
+from relations_pymysql.source import Source
+from relations_pymysql.sharded import ShardedSource
@@ -0,0 +1,252 @@
+"""
+Index advice from the shapes of queries, and query budgets
+"""
+
+import logging
+import contextlib
+import collections
+
+import relations
+
+
+class AdviceMixin:
+    """
+    Counts query shapes to suggest indexes for a Source, and checks its query budgets
+    """
+
+    EQUALS = ["eq", "in", "null"]               # Operators an index can seek to
+    RANGES = ["gt", "gte", "lt", "lte", "start"] # Operators an index can scan a range of
+
+    @classmethod
+    def shape(cls, model, sort=True):
+        """
+        The columns a model filters by with equality, then by range, then sorts by (if sorting),
+        using names like index declarations do. Operators and JSON paths an index can't help with
+        are left out.
+        """
+
+        equals = set()
+        ranges = set()
+        sorts = []
+
+        for field in model._record._order:
+
+            for criterion in (field.criteria or {}):
+
+                path, operator = criterion.rsplit("__", 1) if "__" in criterion else (None, criterion)
+
+                if operator.startswith("not_") or (path is not None and path not in (field.extract or {})):
+                    continue
+
+                column = field.name if path is None else f"{field.name}__{path}"
+
+                if operator in cls.EQUALS:
+                    equals.add(column)
+                elif operator in cls.RANGES:
+                    ranges.add(column)
+
+        for order in ((model._sort or model._order or []) if sort else []):
+
+            name, path = (order[1:].split("__", 1) + [None])[:2]
+
+            if name not in model._fields._names or (path is not None and path not in (model._fields._names[name].extract or {})):
+                break
+
+            # Sorting by a column filtered to one value is free
+
+            if order[1:] not in equals:
+                sorts.append(order[1:])
+
+        return tuple(sorted(equals)), tuple(sorted(ranges - equals)), tuple(sorts)
+
+    def advise_record(self, model, sort=True):
+        """
+        Counts the shape of a count or retrieve
+        """
+
+        if self.shapes is None:
+            return
+
+        table = (model.SCHEMA or self.schema, model.STORE)
+        equals, ranges, sorts = self.shape(model, sort)
+
+        if not equals and not ranges and not sorts:
+            return
+
+        with self.lock:
+
+            if table not in self.definitions:
+                self.definitions[table] = model.thy().define()
+
+            self.shapes[(table, equals, ranges, sorts)] += 1
+
+    def indexed(self, definition):
+        """
+        The columns of every index a definition has or define() would add, with the id that
+        InnoDB keeps at the end of every other index
+        """
+
+        indexes = []
+
+        for index in ["index", "unique"]:
+            indexes.extend(list(columns) for columns in definition.get(index, {}).values())
+
+        if self.extract_index:
+            indexes.extend([column] for column in self.extract_columns(definition.get("fields", [])))
+
+        if definition.get("id") is None:
+            return indexes
+
+        return [[definition["id"]]] + [
+            columns + [definition["id"]] if definition["id"] not in columns else columns for columns in indexes
+        ]
+
+    @staticmethod
+    def covers(index, equals, rest):
+        """
+        Whether an index can seek by all the equals, then use the rest in order
+        """
+
+        if len(index) < len(equals) + len(rest):
+            return False
+
+        return set(index[:len(equals)]) == set(equals) and list(index[len(equals):len(equals) + len(rest)]) == list(rest)
+
+    def advice(self, threshold=1):
+        """
+        Composite indexes that would cover the most counted shapes not covered already, busiest
+        first. Equality columns lead, then either the range column or the sort columns, as an index
+        can't serve a sort after a range.
+        """
+
+        if self.shapes is None:
+            return []
+
+        with self.lock:
+            shapes = list(self.shapes.items())
+            definitions = dict(self.definitions)
+
+        candidates = self.advice_fold(self.advice_candidates(shapes, definitions))
+
+        advice = []
+
+        for ((schema, store), equals, rest), candidate in candidates.items():
+
+            if not candidate["queries"] or candidate["queries"] < threshold:
+                continue
+
+            columns = list(equals) + list(rest)
+
+            advice.append({
+                "schema": schema,
+                "store": store,
+                "name": "-".join(columns)[:64],
+                "columns": columns,
+                "queries": candidate["queries"],
+                "shapes": candidate["shapes"]
+            })
+
+        return sorted(advice, key=lambda index: (-index["queries"], index["schema"] or "", index["store"], index["columns"]))
+
+    def advice_candidates(self, shapes, definitions):
+        """
+        The indexes that would cover each counted shape not covered already, with how many queries
+        and shapes each would cover
+        """
+
+        candidates = {}
+
+        for (table, equals, ranges, sorts), times in shapes:
+
+            rest = ranges[:1] if ranges else sorts
+
+            if any(self.covers(index, equals, rest) for index in self.indexed(definitions[table])):
+                continue
+
+            candidate = candidates.setdefault((table, equals, rest), {"queries": 0, "shapes": 0})
+            candidate["queries"] += times
+            candidate["shapes"] += 1
+
+        return candidates
+
+    @staticmethod
+    def advice_fold(candidates):
+        """
+        Folds candidates into longer candidates that cover them too, zeroing their queries
+        """
+
+        for (table, equals, rest), candidate in sorted(candidates.items(), key=lambda item: len(item[0][2])):
+
+            longer = [
+                other for (other_table, other_equals, other_rest), other in candidates.items()
+                if other_table == table and other_equals == equals and len(other_rest) > len(rest) and other_rest[:len(rest)] == rest
+            ]
+
+            if longer:
+                other = max(longer, key=lambda other: other["queries"])
+                other["queries"] += candidate["queries"]
+                other["shapes"] += candidate["shapes"]
+                candidate["queries"] = 0
+
+        return candidates
+
+    def advice_migration(self, threshold=1):
+        """
+        The advice as a migration, to save alongside those Migrations generates
+        """
+
+        migration = {}
+
+        with self.lock:
+            definitions = dict(self.definitions or {})
+
+        for index in self.advice(threshold):
+
+            definition = definitions[(index["schema"], index["store"])]
+
+            change = migration.setdefault("change", {}).setdefault(definition["name"], {
+                "definition": definition,
+                "migration": {"index": {"add": {}}}
+            })
+
+            change["migration"]["index"]["add"][index["name"]] = index["columns"]
+
+        return migration
+
+    @contextlib.contextmanager
+    def budget(self, model, operation):
+        """
+        Counts the statements a top level operation runs, including those of nested operations,
+        and checks them against the budget once it's done
+        """
+
+        if self.query_budget is None or getattr(self.local, "budget", None) is not None:
+            yield
+            return
+
+        self.local.budget = {"statements": 0, "shapes": collections.Counter()}
+
+        try:
+            yield
+            budget = self.local.budget
+        finally:
+            self.local.budget = None
+
+        over = []
+
+        if budget["statements"] > self.query_budget:
+            over.append(f"{budget['statements']} statements over budget of {self.query_budget}")
+
+        for sql, times in budget["shapes"].items():
+            if times > self.query_budget_repeats:
+                over.append(f"{times} times over {self.query_budget_repeats} running {sql}")
+
+        if not over:
+            return
+
+        message = f"{operation} {'; '.join(over)}"
+
+        if self.query_budget_raise:
+            raise relations.ModelError(model, message)
+
+        logging.getLogger(__name__).warning("%s: %s", model.__class__.__name__, message)
@@ -0,0 +1,128 @@
+"""
+Units of work and write behind buffers, writes coalesced into multi-row statements
+"""
+
+import threading
+
+
+class Batch:
+    """
+    Writes pending in a unit of work, coalesced into as few statements as ordering allows
+    """
+
+    def __init__(self):
+
+        self.writes = []
+
+    def __len__(self):
+
+        return len(self.writes)
+
+    def tables(self):
+        """
+        Tables with pending writes
+        """
+
+        return {write["table"] for write in self.writes}
+
+    def insert(self, table, query, rows, owner=None):
+        """
+        Queues an INSERT, merging into an earlier one with the same columns if nothing in
+        between on the same table would delete these rows, noting who it's for
+        """
+
+        query.generate()
+        prefix, values = query.sql.split(" VALUES ", 1)
+
+        for write in reversed(self.writes):
+
+            if write["table"] != table:
+                continue
+
+            if write["kind"] == "insert" and write["prefix"] == prefix:
+                write["values"].append((values, list(query.args), len(rows), owner))
+                write["rows"].extend(rows)
+                return
+
+            if write["kind"] == "delete" and any(row.get(write["column"]) in write["ids"] for row in rows):
+                break
+
+        self.writes.append({
+            "kind": "insert",
+            "table": table,
+            "prefix": prefix,
+            "values": [(values, list(query.args), len(rows), owner)],
+            "rows": list(rows)
+        })
+
+    def delete(self, table, column, ids):
+        """
+        Queues a DELETE by column values, merging into an earlier one on the same column if
+        nothing in between on the same table inserted rows it would match
+        """
+
+        ids = set(ids)
+
+        for write in reversed(self.writes):
+
+            if write["table"] != table:
+                continue
+
+            if write["kind"] == "delete" and write["column"] == column:
+                write["ids"].update(ids)
+                return
+
+            if write["kind"] == "insert" and any(row.get(column) in ids for row in write["rows"]):
+                break
+
+        self.writes.append({
+            "kind": "delete",
+            "table": table,
+            "column": column,
+            "ids": ids
+        })
+
+
+class Buffer(Batch):
+    """
+    Creates written behind, shared by all threads and flushed on a connection of its own
+    """
+
+    def __init__(self):
+
+        super().__init__()
+
+        self.rows = 0               # Rows waiting
+        self.since = None           # When the oldest row waiting was written
+        self.flushing = False       # Whether a flush is underway
+        self.closed = False         # Whether to stop flushing in the background
+        self.condition = threading.Condition()
+        self.flusher = None         # Thread flushing in the background
+        self.connection = None      # Connection flushes run on
+        self.failed = []            # Rows that wouldn't insert, with why, for whoever handles them
+        self.errors = {}            # Why, by the thread that wrote them, None for background failures
+
+    def fail(self, owner, error, failed=None):
+        """
+        Notes an error for the thread whose rows failed, and the rows if any
+        """
+
+        with self.condition:
+
+            if failed is not None:
+                self.failed.append({**failed, "error": error})
+
+            self.errors[owner] = error
+
+    def error(self, owner=None, everyone=False):
+        """
+        Takes the error for a thread, or one from flushing in the background, or anyone's
+        """
+
+        with self.condition:
+
+            for key in ([owner, None] if not everyone else list(self.errors)):
+                if key in self.errors:
+                    return self.errors.pop(key)
+
+        return None
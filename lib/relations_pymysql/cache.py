@@ -0,0 +1,129 @@
+"""
+Caches of results, by statement, invalidated by the tables they read
+"""
+
+import sys
+import time
+import collections
+
+import threading
+
+
+class Cache:
+    """
+    LRU cache of query results, bounded by count, memory and age, invalidated by table
+    """
+
+    def __init__(self, ttl=60, size=1000, memory=64 * 1024 * 1024):
+
+        self.ttl = ttl
+        self.size = size
+        self.memory = memory
+        self.bytes = 0
+        self.entries = collections.OrderedDict()
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def __len__(self):
+
+        return len(self.entries)
+
+    @staticmethod
+    def sizeof(value):
+        """
+        Rough memory used by a cached value
+        """
+
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value.values())
+
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(Cache.sizeof(item) for item in value)
+
+        return sys.getsizeof(value)
+
+    def drop(self, key):
+        """
+        Removes an entry, lock held
+        """
+
+        _, tables, _, size = self.entries.pop(key)
+
+        for table in tables:
+            self.tables[table].discard(key)
+            if not self.tables[table]:
+                del self.tables[table]
+
+        self.bytes -= size
+
+    def get(self, key):
+        """
+        Returns whether found and the value
+        """
+
+        with self.lock:
+
+            if key not in self.entries:
+                self.stats["misses"] += 1
+                return False, None
+
+            expires, _, value, _ = self.entries[key]
+
+            if expires < time.time():
+                self.drop(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+
+            return True, value
+
+    def set(self, key, tables, value):
+        """
+        Stores a value read from the tables
+        """
+
+        size = self.sizeof(value)
+
+        if size > self.memory:
+            return
+
+        with self.lock:
+
+            if key in self.entries:
+                self.drop(key)
+
+            self.entries[key] = (time.time() + self.ttl, tables, value, size)
+            self.bytes += size
+
+            for table in tables:
+                self.tables.setdefault(table, set()).add(key)
+
+            while len(self.entries) > self.size or self.bytes > self.memory:
+                self.drop(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate(self, table=None):
+        """
+        Drops everything read from a table, or everything
+        """
+
+        with self.lock:
+
+            keys = list(self.entries) if table is None else list(self.tables.get(table, []))
+
+            for key in keys:
+                self.drop(key)
+
+            self.stats["invalidations"] += len(keys)
+
+    def statistics(self):
+        """
+        Hits, misses, and the like
+        """
+
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "bytes": self.bytes}
@@ -0,0 +1,277 @@
+"""
+Rows and columns read without building a model per row
+"""
+
+import copy
+import json
+import array
+
+
+class Row:
+    """
+    A tuple row that reads like a dict, sharing one column index with every row of its query
+    """
+
+    __slots__ = ("index", "values")
+
+    def __init__(self, index, values):
+
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, key):
+
+        return self.values[self.index[key]]
+
+    def __contains__(self, key):
+
+        return key in self.index
+
+    def __len__(self):
+
+        return len(self.index)
+
+    def __iter__(self):
+
+        return iter(self.index)
+
+    def get(self, key, default=None):
+        """
+        Value of a column, or the default if there's no such column
+        """
+
+        position = self.index.get(key)
+
+        return default if position is None else self.values[position]
+
+    def keys(self):
+        """
+        Column names
+        """
+
+        return self.index.keys()
+
+
+class Compact:
+    """
+    Read only rows stored by column, for big results that don't need a model per row
+    """
+
+    def __init__(self, names, columns):
+
+        self._names = names
+        self._columns = columns
+        self._size = len(columns[names[0]]) if names else 0
+
+    def __len__(self):
+
+        return self._size
+
+    def __iter__(self):
+
+        return (CompactRow(self, position) for position in range(self._size))
+
+    def __getitem__(self, key):
+
+        if isinstance(key, str):
+            return list(self._columns[key])
+
+        if isinstance(key, slice):
+            return [CompactRow(self, position) for position in range(self._size)[key]]
+
+        if key < 0:
+            key += self._size
+
+        if not 0 <= key < self._size:
+            raise IndexError("compact index out of range")
+
+        return CompactRow(self, key)
+
+    def __getattr__(self, name):
+
+        if not name.startswith("_") and name in self._columns:
+            return list(self._columns[name])
+
+        raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
+    def keys(self):
+        """
+        Field names
+        """
+
+        return list(self._names)
+
+    def export(self):
+        """
+        Every row as a dict
+        """
+
+        return [row.export() for row in self]
+
+
+class CompactRow:
+    """
+    One read only row of a Compact, reading fields by attribute or key
+    """
+
+    __slots__ = ("_compact", "_position")
+
+    def __init__(self, compact, position):
+
+        object.__setattr__(self, "_compact", compact)
+        object.__setattr__(self, "_position", position)
+
+    def __getattr__(self, name):
+
+        columns = self._compact._columns
+
+        if name in columns:
+            return columns[name][self._position]
+
+        raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
+    def __getitem__(self, name):
+
+        return self._compact._columns[name][self._position]
+
+    def __contains__(self, name):
+
+        return name in self._compact._columns
+
+    def __setattr__(self, name, value):
+
+        raise AttributeError("compact rows are read only")
+
+    def __delattr__(self, name):
+
+        raise AttributeError("compact rows are read only")
+
+    def keys(self):
+        """
+        Field names
+        """
+
+        return self._compact.keys()
+
+    def export(self):
+        """
+        The row as a dict
+        """
+
+        return {name: self._compact._columns[name][self._position] for name in self._compact._names}
+
+
+class Titled:
+    """
+    Stands in for a model to make titles from the rows of a titles query, which only have the
+    columns titles need and so can't be built into models
+    """
+
+    def __init__(self, model, rows):
+
+        self.model = model
+        self.rows = rows
+        self.row = None
+
+        self._id = model._id
+        self._titles = model._titles
+        self._fields = model._fields
+        self._record = copy.deepcopy(model._fields)
+
+    def __getitem__(self, name):
+
+        store = self._fields._names[name].store
+
+        if self.row is None:
+            return [row[store] for row in self.rows]
+
+        return self.row[store]
+
+    def __iter__(self):
+
+        names = {name.split("__", 1)[0] for name in self._titles}
+
+        for row in self.rows:
+
+            self.row = row
+
+            for name in names:
+                self._record._names[name].read(row)
+
+            yield self
+
+        self.row = None
+
+    def _ancestor(self, field):
+
+        return self.model._ancestor(field)
+
+
+class Column:
+    """
+    One field's stored values for a chunk of rows. Ints, floats and bools go in a contiguous
+    typed array, usable by numpy.frombuffer and the like without copying, with a null mask
+    if any are NULL. JSON is only decoded when read.
+    """
+
+    TYPES = {int: "q", float: "d", bool: "b"}
+
+    def __init__(self, name, kind, values):
+
+        self.name = name
+        self.kind = kind
+        self.nulls = None
+        self.decoded = None
+        self.code = self.TYPES.get(kind)
+
+        if self.code is not None:
+
+            if any(value is None for value in values):
+                self.nulls = bytearray(value is None for value in values)
+                values = [0 if value is None else value for value in values]
+
+            self.values = array.array(self.code, values)
+
+        else:
+
+            self.values = values
+
+            if kind is not str:
+                self.decoded = {}
+
+    def __len__(self):
+
+        return len(self.values)
+
+    def __getitem__(self, position):
+
+        if self.nulls is not None and self.nulls[position]:
+            return None
+
+        value = self.values[position]
+
+        if self.code == "b":
+            return bool(value)
+
+        if self.decoded is not None and isinstance(value, str):
+
+            if position < 0:
+                position += len(self.values)
+
+            if position not in self.decoded:
+                self.decoded[position] = json.loads(value)
+
+            return self.decoded[position]
+
+        return value
+
+    def __iter__(self):
+
+        return (self[position] for position in range(len(self.values)))
+
+    def tolist(self):
+        """
+        All the values, NULLs as None and JSON decoded
+        """
+
+        return list(self)
@@ -0,0 +1,135 @@
+"""
+The DB-API drivers a Source can run on
+"""
+
+import abc
+
+import pymysql
+import pymysql.cursors
+import pymysql.constants.CLIENT
+
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+    import MySQLdb.constants.CLIENT
+except ImportError: # pragma: no cover
+    MySQLdb = None
+
+
+class Driver(abc.ABC):
+    """
+    The DB-API driver a Source runs on: how to connect so rows come back as dicts, and the base
+    of the errors it raises. Both drivers report affected (not matched) rows in rowcount, and the
+    auto increment id in lastrowid.
+    """
+
+    NAME = None
+    ERROR = None
+    TUPLES = None   # Cursor class that returns tuples
+    STREAM = None   # Cursor class that returns tuples unbuffered, as they're fetched
+    MULTI = None    # Client flag allowing several statements per execute
+
+    @abc.abstractmethod
+    def connect(self, **kwargs):
+        """
+        Opens a connection
+        """
+
+    def multi(self, **kwargs):
+        """
+        Opens a connection that can run several statements per execute
+        """
+
+        return self.connect(**{**kwargs, "client_flag": kwargs.get("client_flag", 0) | self.MULTI})
+
+    def cursor(self, connection, tuples=False, stream=False):
+        """
+        Opens a cursor, returning dicts or tuples, or streaming tuples
+        """
+
+        if stream:
+            return connection.cursor(self.STREAM)
+
+        return connection.cursor(self.TUPLES) if tuples else connection.cursor()
+
+    def streaming(self, cursor):
+        """
+        Whether a cursor streams, so doesn't know how many rows there are until they're fetched
+        """
+
+        return isinstance(cursor, self.STREAM or ())
+
+    @staticmethod
+    def code(exception):
+        """
+        The MySQL error code of an exception
+        """
+
+        return exception.args[0] if exception.args else None
+
+    @staticmethod
+    @abc.abstractmethod
+    def info(cursor):
+        """
+        The info MySQL sent about the last statement, like "Records: 3  Duplicates: 1  Warnings: 0"
+        """
+
+
+class PyMySQLDriver(Driver):
+    """
+    Pure Python PyMySQL
+    """
+
+    NAME = "pymysql"
+    ERROR = pymysql.err.MySQLError
+    TUPLES = pymysql.cursors.Cursor
+    STREAM = pymysql.cursors.SSCursor
+    MULTI = pymysql.constants.CLIENT.MULTI_STATEMENTS
+
+    def connect(self, **kwargs):
+
+        return pymysql.connect(cursorclass=pymysql.cursors.DictCursor, **kwargs)
+
+    @staticmethod
+    def info(cursor):
+
+        message = getattr(getattr(cursor, "_result", None), "message", None)
+
+        return message.decode() if isinstance(message, bytes) else (message or "")
+
+
+class MySQLdbDriver(Driver):
+    """
+    The mysqlclient C extension, much faster parsing big results
+    """
+
+    NAME = "mysqldb"
+    ERROR = MySQLdb.MySQLError if MySQLdb is not None else None
+    TUPLES = MySQLdb.cursors.Cursor if MySQLdb is not None else None
+    STREAM = MySQLdb.cursors.SSCursor if MySQLdb is not None else None
+    MULTI = MySQLdb.constants.CLIENT.MULTI_STATEMENTS if MySQLdb is not None else None
+    MULTI_OFF = 1   # MYSQL_OPTION_MULTI_STATEMENTS_OFF, which mysqlclient doesn't name
+
+    def __init__(self):
+
+        if MySQLdb is None:
+            raise ImportError("the mysqldb driver needs mysqlclient installed")
+
+    def connect(self, **kwargs):
+
+        kwargs.setdefault("charset", "utf8mb4")
+
+        connection = MySQLdb.connect(cursorclass=MySQLdb.cursors.DictCursor, **kwargs)
+
+        # mysqlclient always sets the MULTI_STATEMENTS flag, so turn stacked statements back off
+        # unless they were asked for
+
+        if not kwargs.get("client_flag", 0) & self.MULTI:
+            connection.set_server_option(self.MULTI_OFF)
+
+        return connection
+
+    @staticmethod
+    def info(cursor):
+
+        return cursor.connection.info() or ""
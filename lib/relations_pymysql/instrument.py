@@ -0,0 +1,333 @@
+"""
+Running statements, and the hooks, logs, metrics and profiles around them
+"""
+
+import copy
+import json
+import time
+import random
+import contextlib
+
+import threading
+
+
+class InstrumentMixin:
+    """
+    Runs statements for a Source, keeping its hooks, slow log, metrics and profiles
+    """
+
+    def hook(self, before=None, after=None):
+        """
+        Adds callables to run before and after every statement, each getting the event
+        """
+
+        if before is not None:
+            self.hooks["before"].append(before)
+
+        if after is not None:
+            self.hooks["after"].append(after)
+
+    def cursor_execute(self, cursor, sql, args=None, model=None, operation=None):
+        """
+        Executes a statement, the one place everything sent to MySQL goes through
+        """
+
+        args = tuple(args) if args is not None else None
+
+        budget = getattr(self.local, "budget", None)
+
+        if budget is not None:
+            budget["statements"] += 1
+            budget["shapes"][sql] += 1
+
+        timeout = self.timeouts.get(operation, self.timeout)
+
+        if timeout is not None and sql.startswith("SELECT "):
+            sql = f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout * 1000)}) */ {sql[7:]}"
+
+        thread = threading.get_ident()
+        self.executing[thread] = (cursor.connection, sql, time.time())
+
+        if operation in self.WRITES and cursor.connection is self.connections.get(thread):
+            self.local.pending = True
+
+        try:
+            return self.cursor_executed(cursor, sql, args, model, operation)
+        finally:
+            self.executing.pop(thread, None)
+
+    def cursor_executed(self, cursor, sql, args, model, operation):
+        """
+        Executes a statement, running hooks and keeping logs and metrics if any are on
+        """
+
+        if (
+            not self.hooks["before"] and not self.hooks["after"] and
+            self.slow is None and self.meters is None and self.profiles is None
+        ):
+            return cursor.execute(sql, args)
+
+        event = {
+            "model": model.__class__ if model is not None else None,
+            "operation": operation,
+            "sql": sql,
+            "args": len(args or ()),
+            "rows": None,
+            "connection": cursor.connection.thread_id()
+        }
+
+        for before in self.hooks["before"]:
+            before(event)
+
+        start = time.perf_counter()
+
+        try:
+            result = cursor.execute(sql, args)
+            if not self.driver.streaming(cursor):
+                event["rows"] = cursor.rowcount
+            return result
+        except Exception as exception:
+            event["error"] = exception
+            raise
+        finally:
+            event["seconds"] = time.perf_counter() - start
+            if self.slow is not None and event["seconds"] >= self.slow_log:
+                self.slow_record(model, event, args)
+            if self.meters is not None:
+                self.meter_event(event)
+            if self.profiles is not None:
+                self.profile_add(model, operation, "execute", event["seconds"])
+            for after in self.hooks["after"]:
+                after(event)
+
+    def running(self, slower=None):
+        """
+        The statements running now, by thread, optionally only those running longer than so many seconds
+        """
+
+        now = time.time()
+
+        return [
+            {"thread": thread, "connection": connection.thread_id(), "sql": sql, "seconds": now - start}
+            for thread, (connection, sql, start) in list(self.executing.items())
+            if slower is None or now - start >= slower
+        ]
+
+    def cancel(self, thread=None, slower=None):
+        """
+        Stops what a thread is running, or any thread's statements running longer than so many
+        seconds, or both, with KILL QUERY from a connection of its own. One or the other is needed,
+        slower=0 for everything. The statements stopped raise in their threads, which keep their
+        connections. Returns how many were stopped.
+        """
+
+        if thread is None and slower is None:
+            raise ValueError("need a thread or how many seconds slower to cancel, slower=0 for everything")
+
+        cancelled = 0
+
+        with self.lock:
+
+            for running in self.running(slower):
+
+                if thread is not None and running["thread"] != thread:
+                    continue
+
+                if self.canceller is None:
+                    self.canceller = self.driver.connect(**self.kwargs)
+                    self.meter("connections_opened_total", purpose="cancel")
+
+                cursor = self.canceller.cursor()
+
+                try:
+                    cursor.execute("KILL QUERY %s", (running["connection"],))
+                    cancelled += 1
+                except self.driver.ERROR:
+                    pass # Finished before it could be stopped
+                finally:
+                    cursor.close()
+
+        return cancelled
+
+    def profile_add(self, model, operation, phase, seconds):
+        """
+        Adds time spent in a phase of an operation
+        """
+
+        name = model.__class__.__name__ if model is not None else ""
+
+        with self.lock:
+            timing = self.profiles.setdefault(name, {}).setdefault(operation or "", {}).setdefault(
+                phase, {"seconds": 0.0, "calls": 0}
+            )
+            timing["seconds"] += seconds
+            timing["calls"] += 1
+
+    @contextlib.contextmanager
+    def phase(self, model, operation, phase):
+        """
+        Times a phase of an operation if profiling
+        """
+
+        if self.profiles is None:
+            yield
+            return
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.profile_add(model, operation, phase, time.perf_counter() - start)
+
+    def profiled(self, clear=False):
+        """
+        Seconds and calls for each model, operation and phase (build, execute, fetch, decode,
+        models, ties) with ties including the nested operations on the tie models
+        """
+
+        if self.profiles is None:
+            return {}
+
+        with self.lock:
+
+            profiles = copy.deepcopy(self.profiles)
+
+            if clear:
+                self.profiles.clear()
+
+        return profiles
+
+    def meter(self, name, value=1, **labels):
+        """
+        Adds to a counter, if keeping metrics
+        """
+
+        if self.meters is not None:
+            self.meters.inc(name, labels, value)
+
+    def meter_event(self, event):
+        """
+        Records a statement in the metrics
+        """
+
+        model = event["model"].__name__ if event["model"] is not None else ""
+        operation = event["operation"] or ""
+
+        self.meters.inc("queries_total", {"model": model, "operation": operation})
+        self.meters.observe("query_seconds", {"operation": operation}, event["seconds"])
+
+        if "error" in event:
+            self.meters.inc("query_errors_total", {"model": model, "operation": operation})
+        elif event["rows"] is not None and event["rows"] >= 0:
+            if operation in ("retrieve", "count"):
+                self.meters.inc("rows_read_total", {"model": model}, event["rows"])
+            elif operation in ("create", "update", "delete"):
+                self.meters.inc("rows_written_total", {"model": model, "operation": operation}, event["rows"])
+
+    def metrics_text(self):
+        """
+        A snapshot of the metrics in the Prometheus text format, or None if not keeping them
+        """
+
+        if self.meters is None:
+            return None
+
+        self.meters.set("connections", {}, len([connection for connection in self.connections.values() if connection]))
+
+        for name, cache in (("results", self.results), ("counts", self.counts), ("titled", self.titled)):
+            if cache is not None:
+                for stat, value in cache.statistics().items():
+                    self.meters.set("cache", {"cache": name, "stat": stat}, value)
+
+        for stat, value in self.retries.items():
+            if stat != "codes":
+                self.meters.set("retries", {"stat": stat}, value)
+
+        if self.buffer is not None:
+            self.meters.set("buffered_rows", {}, self.buffer.rows)
+
+        if self.slow is not None:
+            self.meters.set("slow_queries", {}, len(self.slow))
+
+        return self.meters.text()
+
+    @staticmethod
+    def criteria(model):
+        """
+        Which fields a model is filtering by and how, but not the values
+        """
+
+        if model is None:
+            return None
+
+        criteria = {field.name: sorted(field.criteria) for field in model._record._order if field.criteria}
+
+        if model._like is not None:
+            criteria["like"] = True
+
+        return criteria
+
+    def explain(self, sql, args):
+        """
+        The JSON plan for a SELECT, using its own connection so it doesn't disturb the statement's
+        """
+
+        # The explainer has a lock of its own, so a slow EXPLAIN doesn't hold up other threads'
+        # connections, profiles or cancels
+
+        try:
+
+            with self.explain_lock:
+
+                if self.explainer is None:
+                    self.explainer = self.driver.connect(**self.kwargs)
+                    self.meter("connections_opened_total", purpose="explain")
+
+                cursor = self.driver.cursor(self.explainer, tuples=True)
+                cursor.execute(f"EXPLAIN FORMAT=JSON {sql}", args)
+                plan = json.loads(cursor.fetchone()[0])
+                cursor.close()
+
+            return plan
+
+        except self.driver.ERROR as exception:
+
+            return {"error": str(exception)}
+
+    def slow_record(self, model, event, args):
+        """
+        Logs a slow statement, EXPLAINing a sample of the SELECTs
+        """
+
+        entry = {
+            "at": time.time(),
+            "model": event["model"].__name__ if event["model"] is not None else None,
+            "operation": event["operation"],
+            "sql": event["sql"],
+            "args": event["args"],
+            "criteria": self.criteria(model),
+            "rows": event["rows"],
+            "seconds": event["seconds"],
+            "plan": None
+        }
+
+        if "error" not in event and event["sql"].lstrip().upper().startswith("SELECT") and random.random() < self.slow_log_sample:
+            entry["plan"] = self.explain(event["sql"], args)
+
+        self.slow.append(entry)
+
+    def slow_queries(self, clear=False):
+        """
+        The slow statements logged, oldest first
+        """
+
+        if self.slow is None:
+            return []
+
+        entries = list(self.slow)
+
+        if clear:
+            self.slow.clear()
+
+        return entries
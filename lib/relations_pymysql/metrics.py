@@ -0,0 +1,139 @@
+"""
+Metrics kept in memory and written in the Prometheus text format
+"""
+
+import threading
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms, rendered in the Prometheus text format
+    """
+
+    PREFIX = "relations_pymysql"
+
+    BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    METRICS = {
+        "queries_total": ("counter", "Statements executed"),
+        "query_errors_total": ("counter", "Statements that raised"),
+        "query_seconds": ("histogram", "Seconds statements took"),
+        "rows_read_total": ("counter", "Rows statements returned"),
+        "rows_written_total": ("counter", "Rows statements created, updated or deleted"),
+        "decode_seconds": ("histogram", "Seconds spent decoding JSON fields of retrieved rows"),
+        "connections_opened_total": ("counter", "Connections opened"),
+        "connections_closed_total": ("counter", "Connections closed"),
+        "connections": ("gauge", "Connections open"),
+        "cache": ("gauge", "Result cache statistics"),
+        "retries": ("gauge", "Deadlock and lock wait timeout retry statistics"),
+        "buffered_rows": ("gauge", "Rows written behind but not yet flushed"),
+        "slow_queries": ("gauge", "Statements in the slow query log")
+    }
+
+    def __init__(self, buckets=None):
+
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in self.METRICS}
+
+    @staticmethod
+    def labels(labels):
+        """
+        Labels as a hashable key, sorted by name
+        """
+
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name, labels=None, value=1):
+        """
+        Adds to a counter
+        """
+
+        key = self.labels(labels or {})
+
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + value
+
+    def set(self, name, labels=None, value=0):
+        """
+        Sets a gauge
+        """
+
+        key = self.labels(labels or {})
+
+        with self.lock:
+            self.values[name][key] = value
+
+    def observe(self, name, labels=None, value=0):
+        """
+        Adds a sample to a histogram
+        """
+
+        key = self.labels(labels or {})
+
+        with self.lock:
+
+            if key not in self.values[name]:
+                self.values[name][key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+
+            histogram = self.values[name][key]
+
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    histogram["buckets"][index] += 1
+
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @staticmethod
+    def escape(text):
+        """
+        Escapes a label value
+        """
+
+        return str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def line(self, name, key, value, extra=None):
+        """
+        A single sample line
+        """
+
+        pairs = list(key) + (extra or [])
+
+        if not pairs:
+            return f"{name} {value}"
+
+        labels = ",".join(f'{label}="{self.escape(text)}"' for label, text in pairs)
+
+        return f"{name}{{{labels}}} {value}"
+
+    def text(self):
+        """
+        Everything in the Prometheus text exposition format
+        """
+
+        lines = []
+
+        with self.lock:
+
+            for name, (kind, description) in self.METRICS.items():
+
+                full = f"{self.PREFIX}_{name}"
+
+                lines.append(f"# HELP {full} {description}")
+                lines.append(f"# TYPE {full} {kind}")
+
+                for key, value in sorted(self.values[name].items()):
+
+                    if kind != "histogram":
+                        lines.append(self.line(full, key, value))
+                        continue
+
+                    for bucket, count in zip(self.buckets, value["buckets"]):
+                        lines.append(self.line(f"{full}_bucket", key, count, [("le", bucket)]))
+
+                    lines.append(self.line(f"{full}_bucket", key, value["count"], [("le", "+Inf")]))
+                    lines.append(self.line(f"{full}_sum", key, value["sum"]))
+                    lines.append(self.line(f"{full}_count", key, value["count"]))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,633 @@
+"""
+Executing SQL, loading files and migrating, online or not
+"""
+
+import glob
+import json
+import time
+import contextlib
+import concurrent.futures
+
+import threading
+
+import relations
+import relations_sql
+
+from relations_pymysql.splitter import Splitter
+
+
+class MigrationMixin:
+    """
+    Executes, loads and migrates for a Source
+    """
+
+    @staticmethod
+    def split(sql):
+        """
+        Splits SQL into statements
+        """
+
+        splitter = Splitter()
+
+        return splitter.feed(sql) + splitter.end()
+
+    @staticmethod
+    def stream(sql_file, size=1024 * 1024):
+        """
+        Yields the statements in a file, reading a chunk at a time
+        """
+
+        splitter = Splitter()
+
+        while True:
+
+            chunk = sql_file.read(size)
+
+            if not chunk:
+                break
+
+            yield from splitter.feed(chunk)
+
+        yield from splitter.end()
+
+    @contextlib.contextmanager
+    def untimed(self):
+        """
+        Runs this thread's statements on its connection without the read_timeout added for
+        SELECTs, opened the first time and kept, so long DDL and migrations aren't dropped by the
+        client. Commits anything pending first, like DDL would, so it can't hold locks the
+        statements wait on.
+        """
+
+        if self.untimed_kwargs is None or not self.created or self.batch() is not None or getattr(self.local, "untimed", False):
+            yield
+            return
+
+        thread = threading.get_ident()
+
+        if thread in self.connections and self.pending():
+            self.commit()
+
+        if thread not in self.untimeds:
+            connection = self.driver.connect(**self.untimed_kwargs)
+            self.meter("connections_opened_total", purpose="execute")
+        else:
+            connection = self.untimeds[thread]
+
+        with self.lock:
+            self.untimeds[thread] = connection
+            timed = self.connections.get(thread)
+            self.connections[thread] = connection
+
+        self.local.untimed = True
+
+        try:
+
+            yield
+
+        finally:
+
+            self.local.untimed = False
+
+            with self.lock:
+                if timed is not None:
+                    self.connections[thread] = timed
+                else:
+                    del self.connections[thread]
+
+    def execute(self, commands, progress=None):
+        """
+        Execute SQL, a string, list or any iterable of statements, calling progress (if sent)
+        after each statement with its number, SQL, seconds and rows
+        """
+
+        if isinstance(commands, relations_sql.SQL):
+            commands.generate()
+            commands = commands.sql
+
+        if isinstance(commands, str):
+            commands = self.split(commands)
+
+        commands = (command for command in commands if command.strip())
+
+        self.flush()
+        self.invalidate()
+
+        # Sending several at once needs a connection allowing it, which we can only
+        # open ourselves, and can't see what this one's done in a unit of work
+
+        if self.multi_statements and self.created and self.batch() is None:
+            self.execute_multi(commands, progress)
+            return
+
+        with self.untimed():
+
+            cursor = self.connection.cursor()
+
+            self.execute_statements(cursor, commands, progress)
+
+            self.commit()
+
+            cursor.close()
+
+    def execute_statements(self, cursor, commands, progress=None):
+        """
+        Executes statements one at a time without committing
+        """
+
+        for number, command in enumerate(commands, 1):
+
+            start = time.perf_counter()
+            self.cursor_execute(cursor, command, operation="execute")
+
+            if progress is not None:
+                progress({"statement": number, "sql": command, "seconds": time.perf_counter() - start, "rows": cursor.rowcount})
+
+    def execute_batches(self, commands):
+        """
+        Groups statements by the most to send at once
+        """
+
+        commands = iter(commands)
+
+        batch = []
+        size = 0
+
+        for command in commands:
+
+            if batch and (len(batch) >= self.multi_statements or size + len(command) > self.multi_statements_bytes):
+                yield batch
+                batch = []
+                size = 0
+
+            batch.append(command)
+            size += len(command) + 2
+
+        if batch:
+            yield batch
+
+    def execute_multi(self, commands, progress=None):
+        """
+        Executes statements several to a round trip on their own connection, timing each
+        statement by when its result comes back
+        """
+
+        self.commit()
+
+        connection = self.driver.multi(**(self.kwargs if self.untimed_kwargs is None else self.untimed_kwargs))
+        self.meter("connections_opened_total", purpose="execute")
+
+        cursor = connection.cursor()
+
+        number = 0
+
+        try:
+
+            for batch in self.execute_batches(commands):
+
+                start = time.perf_counter()
+                self.cursor_execute(cursor, ";\n".join(batch), operation="execute")
+
+                for position, command in enumerate(batch):
+
+                    if position:
+                        start = time.perf_counter()
+                        cursor.nextset()
+
+                    number += 1
+
+                    if progress is not None:
+                        progress({"statement": number, "sql": command, "seconds": time.perf_counter() - start, "rows": cursor.rowcount})
+
+            connection.commit()
+
+        finally:
+
+            cursor.close()
+            connection.close()
+            self.meter("connections_closed_total", reason="closed")
+
+    def definition(self, file_path, source_path):
+        """"
+        Converts a definition file to a MySQL definition file
+        """
+
+        definitions = []
+
+        with open(file_path, "r") as definition_file:
+            definition = json.load(definition_file)
+            for name in sorted(definition.keys()):
+                if definition[name]["source"] == self.name:
+                    definitions.append(self.define(definition[name]))
+
+        if definitions:
+            file_name = file_path.split("/")[-1].split('.')[0]
+            with open(f"{source_path}/{file_name}.sql", "w") as source_file:
+                source_file.write("\n".join(definitions))
+
+    def migration(self, file_path, source_path):
+        """"
+        Converts a migration file to a source definition file
+        """
+
+        migrations = []
+        online = {}
+
+        with open(file_path, "r") as migration_file:
+            migration = json.load(migration_file)
+
+            for add in sorted(migration.get('add', {}).keys()):
+                if migration['add'][add]["source"] == self.name:
+                    migrations.append(self.define(migration['add'][add]))
+
+            for remove in sorted(migration.get('remove', {}).keys()):
+                if migration['remove'][remove]["source"] == self.name:
+                    migrations.append(self.define(definition=migration['remove'][remove]))
+
+            for change in sorted(migration.get('change', {}).keys()):
+                if migration['change'][change]['definition']["source"] == self.name:
+                    if self.online and self.onlineable(migration['change'][change]):
+                        online[change] = migration['change'][change]
+                    else:
+                        migrations.append(
+                            self.define(migration['change'][change]['migration'], migration['change'][change]['definition'])
+                        )
+
+        if migrations or online:
+            file_name = file_path.split("/")[-1].split('.')[0]
+            with open(f"{source_path}/{file_name}.sql", "w") as source_file:
+                source_file.write("\n".join(migrations))
+
+        if online:
+            stamp = file_path.split("/")[-1].split('.')[0].split('-', 1)[-1]
+            with open(f"{source_path}/online-{stamp}.json", "w") as online_file:
+                json.dump(online, online_file, indent=4, sort_keys=True)
+
+    @staticmethod
+    def onlineable(change):
+        """
+        Whether a change can be made online, which needs an id to chunk by and the same schema
+        """
+
+        return change['definition'].get("id") is not None and "schema" not in change['migration']
+
+    def online_columns(self, cursor, schema, store):
+        """
+        The columns of a table that can be copied, skipping generated ones
+        """
+
+        self.cursor_execute(
+            cursor,
+            "SELECT `COLUMN_NAME` AS `name` FROM `information_schema`.`COLUMNS` "
+            "WHERE `TABLE_SCHEMA`=%s AND `TABLE_NAME`=%s AND `EXTRA` NOT LIKE %s ORDER BY `ORDINAL_POSITION`",
+            (schema, store, "%GENERATED%"),
+            operation="execute"
+        )
+
+        return [row["name"] for row in cursor.fetchall()]
+
+    def migrate_online(self, migration, definition, schema=None, progress=None): # pylint: disable=too-many-locals,too-many-statements
+        """
+        Makes a change without locking the table for long. Creates a shadow table with the change,
+        keeps it in sync with triggers, copies rows over in chunks by id, then swaps the tables with
+        an atomic RENAME. Calls progress (if sent) after each chunk with rows copied, estimated rows
+        and estimated seconds left.
+        """
+
+        if not self.onlineable({"migration": migration, "definition": definition}):
+            raise relations.MigrationsError(f"can't change {definition['name']} online")
+
+        schema = schema or self.schema
+
+        if definition.get("schema") not in [None, self.schema]:
+            schema = definition["schema"]
+
+        store = definition.get("store", definition["name"])
+        swap = migration.get("store", store)
+        shadow = f"_{store}_new"
+        old = f"_{store}_old"
+        triggers = [f"`{schema}`.`_{store}_{action}`" for action in ["insert", "update", "delete"]]
+
+        def table(name):
+            return f"`{schema}`.`{name}`"
+
+        # Point the change at the shadow table
+
+        shadow_migration = {key: value for key, value in migration.items() if key not in ["store", "schema"]}
+        shadow_definition = {**definition, "schema": schema, "store": shadow}
+
+        renames = {}
+
+        for field in definition["fields"]:
+            if "store" in migration.get("fields", {}).get("change", {}).get(field["name"], {}):
+                renames[field.get("store", field["name"])] = migration["fields"]["change"][field["name"]]["store"]
+
+        key = next(field.get("store", field["name"]) for field in definition["fields"] if field["name"] == definition["id"])
+
+        self.flush()
+        self.invalidate()
+
+        with self.untimed():
+
+            cursor = self.connection.cursor()
+
+            try:
+
+                self.cursor_execute(cursor, f"DROP TABLE IF EXISTS {table(shadow)}", operation="execute")
+                self.cursor_execute(cursor, f"CREATE TABLE {table(shadow)} LIKE {table(store)}", operation="execute")
+
+                if shadow_migration:
+                    self.execute_statements(cursor, self.split(self.define(shadow_migration, shadow_definition)))
+
+                copies = set(self.online_columns(cursor, schema, shadow))
+                columns = [
+                    (column, renames.get(column, column))
+                    for column in self.online_columns(cursor, schema, store)
+                    if renames.get(column, column) in copies
+                ]
+
+                sources = ", ".join(f"`{column}`" for column, _ in columns)
+                targets = ", ".join(f"`{column}`" for _, column in columns)
+                news = ", ".join(f"NEW.`{column}`" for column, _ in columns)
+                where = f"`{renames.get(key, key)}`=OLD.`{key}`"
+
+                replace = f"REPLACE INTO {table(shadow)} ({targets}) VALUES ({news})"
+                delete = f"DELETE IGNORE FROM {table(shadow)} WHERE {where}"
+
+                self.execute_statements(cursor, [
+                    f"CREATE TRIGGER {triggers[0]} AFTER INSERT ON {table(store)} FOR EACH ROW {replace}",
+                    f"CREATE TRIGGER {triggers[1]} AFTER UPDATE ON {table(store)} FOR EACH ROW BEGIN {delete}; {replace}; END",
+                    f"CREATE TRIGGER {triggers[2]} AFTER DELETE ON {table(store)} FOR EACH ROW {delete}"
+                ])
+
+                # Copy in chunks, each its own short transaction
+
+                rows = self.table_rows(cursor, schema, store) or 0
+                copied = 0
+                chunks = 0
+                last = None
+                start = time.perf_counter()
+
+                while True:
+
+                    after = [] if last is None else [f"`{key}`>%s"]
+                    args = [] if last is None else [last]
+
+                    self.cursor_execute(
+                        cursor,
+                        f"SELECT `{key}` AS `key` FROM {table(store)} "
+                        f"{'WHERE ' + after[0] + ' ' if after else ''}ORDER BY `{key}` LIMIT %s, 1",
+                        args + [self.online_chunk - 1],
+                        operation="execute"
+                    )
+
+                    bound = cursor.fetchone()
+
+                    if bound is not None:
+                        after.append(f"`{key}`<=%s")
+                        args.append(bound["key"])
+
+                    self.cursor_execute(
+                        cursor,
+                        f"INSERT IGNORE INTO {table(shadow)} ({targets}) SELECT {sources} FROM {table(store)}"
+                        f"{' WHERE ' + ' AND '.join(after) if after else ''}",
+                        args,
+                        operation="execute"
+                    )
+
+                    copied += max(cursor.rowcount, 0)
+                    chunks += 1
+
+                    self.commit()
+
+                    seconds = time.perf_counter() - start
+                    rows = max(rows, copied)
+
+                    if progress is not None:
+                        progress({
+                            "schema": schema,
+                            "table": store,
+                            "chunks": chunks,
+                            "copied": copied,
+                            "rows": rows,
+                            "seconds": seconds,
+                            "eta": seconds / copied * (rows - copied) if copied and bound is not None else 0.0
+                        })
+
+                    if bound is None:
+                        break
+
+                    last = bound["key"]
+
+                    if self.online_pause:
+                        time.sleep(self.online_pause)
+
+                self.cursor_execute(
+                    cursor, f"RENAME TABLE {table(store)} TO {table(old)}, {table(shadow)} TO {table(swap)}", operation="execute"
+                )
+
+            except Exception:
+
+                self.execute_statements(cursor, [f"DROP TRIGGER IF EXISTS {trigger}" for trigger in triggers])
+                self.cursor_execute(cursor, f"DROP TABLE IF EXISTS {table(shadow)}", operation="execute")
+                cursor.close()
+
+                raise
+
+            self.execute_statements(cursor, [f"DROP TRIGGER IF EXISTS {trigger}" for trigger in triggers])
+            self.cursor_execute(cursor, f"DROP TABLE IF EXISTS {table(old)}", operation="execute")
+
+            cursor.close()
+
+            return {"schema": schema, "table": swap, "chunks": chunks, "copied": copied, "seconds": time.perf_counter() - start}
+
+    def load(self, load_path, progress=None):
+        """
+        Load a file, streaming its statements rather than reading it all
+        """
+
+        with open(load_path, 'r') as load_file:
+            self.execute(self.stream(load_file), progress)
+
+    def list(self, source_path):
+        """
+        List the migration by pairs
+        """
+
+        migrations = {}
+
+        for file_path in glob.glob(f"{source_path}/*-*.sql"):
+
+            file_name = file_path.rsplit("/", 1)[-1]
+            kind, stamp = file_name.split('.')[0].split('-', 1)
+
+            migrations.setdefault(stamp, {})
+            migrations[stamp][kind] = file_name
+
+        return migrations
+
+    def reschema(self, commands, schema):
+        """
+        Points statements written for our schema at another
+        """
+
+        if schema == self.schema:
+            return commands
+
+        return (command.replace(f"`{self.schema}`.", f"`{schema}`.") for command in commands)
+
+    def migrate_table(self, cursor, schema):
+        """
+        Makes sure a schema has the table recording migrations, with durations, returning its name
+        """
+
+        class Migration(relations.Model):
+            """
+            Model for migrations
+            """
+
+            SOURCE = self.name
+            STORE = "_relations_migration"
+            UNIQUE = False
+
+            stamp = str
+            seconds = float
+
+        table = self.TABLE_NAME(Migration.STORE, schema=schema)
+
+        if schema != self.schema:
+            self.cursor_execute(cursor, f"CREATE DATABASE IF NOT EXISTS `{schema}`", operation="execute")
+
+        self.execute_statements(cursor, self.reschema(self.split(Migration.define()), schema))
+
+        # Tables from before durations were recorded need the column
+
+        self.cursor_execute(
+            cursor,
+            "SELECT COUNT(*) AS `total` FROM `information_schema`.`COLUMNS` "
+            "WHERE `TABLE_SCHEMA`=%s AND `TABLE_NAME`=%s AND `COLUMN_NAME`=%s",
+            (schema, Migration.STORE, "seconds"),
+            operation="execute"
+        )
+
+        if not cursor.fetchone()["total"]:
+            table.generate()
+            self.cursor_execute(cursor, f"ALTER TABLE {table.sql} ADD COLUMN `seconds` DOUBLE", operation="execute")
+
+        return table
+
+    def migrate_run(self, cursor, source_path, stamp, schema, progress=None):
+        """
+        Runs one migration's statements, or the definition's, then the changes it converts online,
+        returning how long it took
+        """
+
+        if stamp == "definition":
+            load_path = f"{source_path}/definition.sql"
+        else:
+            load_path = f"{source_path}/migration-{stamp}.sql"
+
+        start = time.perf_counter()
+
+        with open(load_path, 'r') as load_file:
+            self.execute_statements(cursor, self.reschema(self.stream(load_file), schema))
+
+        for online_path in glob.glob(f"{source_path}/online-{stamp}.json"):
+            with open(online_path, 'r') as online_file:
+                online = json.load(online_file)
+            for name in sorted(online):
+                self.migrate_online(online[name]["migration"], online[name]["definition"], schema, progress)
+
+        return time.perf_counter() - start
+
+    def migrate(self, source_path, progress=None, schema=None):
+        """
+        Migrate all the existing files to where we are on one connection, committing once,
+        recording how long each took, and calling progress (if sent) after each. Sending a schema
+        migrates that schema instead of ours, creating it if need be. Changes converted online
+        are made after their migration's statements, with progress called per chunk too.
+        """
+
+        schema = schema or self.schema
+
+        self.flush()
+        self.invalidate()
+
+        with self.untimed():
+
+            cursor = self.connection.cursor()
+
+            table = self.migrate_table(cursor, schema)
+
+            query = self.SELECT("stamp").FROM(table)
+            query.generate()
+            self.cursor_execute(cursor, query.sql, query.args, operation="retrieve")
+
+            stamps = {row["stamp"] for row in cursor.fetchall()}
+
+            migration_stamps = [
+                migration_path.rsplit("/migration-", 1)[-1].split('.')[0]
+                for migration_path in sorted(glob.glob(f"{source_path}/migration-*.sql"))
+            ]
+
+            # From scratch, the definition has everything the migrations would
+
+            if not stamps:
+                runs = ["definition"]
+            else:
+                runs = [stamp for stamp in migration_stamps if stamp not in stamps]
+
+            for number, stamp in enumerate(runs, 1):
+
+                seconds = self.migrate_run(cursor, source_path, stamp, schema, progress)
+
+                query = self.INSERT(table, "stamp", "seconds").VALUES(stamp=stamp, seconds=seconds)
+
+                if stamp == "definition":
+                    for migration_stamp in migration_stamps:
+                        query.VALUES(stamp=migration_stamp, seconds=None)
+
+                query.generate()
+                self.cursor_execute(cursor, query.sql, query.args, operation="create")
+
+                if progress is not None:
+                    progress({"schema": schema, "stamp": stamp, "migration": number, "migrations": len(runs), "seconds": seconds})
+
+            self.commit()
+
+            cursor.close()
+
+            return bool(runs)
+
+    def migrate_schema(self, source_path, schema, progress=None):
+        """
+        Migrates a schema on this thread's own connection, closing it after
+        """
+
+        try:
+
+            return self.migrate(source_path, progress, schema)
+
+        finally:
+
+            with self.lock:
+                connection = self.connections.pop(threading.get_ident(), None)
+
+            if connection:
+                connection.close()
+                self.meter("connections_closed_total", reason="closed")
+
+    def migrate_schemas(self, source_path, schemas, workers=None, progress=None):
+        """
+        Migrates several schemas, like test databases, in parallel, each on its own connection,
+        returning whether each migrated
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(schemas) or 1) as executor:
+
+            futures = {
+                schema: executor.submit(self.migrate_schema, source_path, schema, progress)
+                for schema in schemas
+            }
+
+            return {schema: future.result() for schema, future in futures.items()}
@@ -0,0 +1,396 @@
+"""
+Sources spreading rows across several others by a shard key
+"""
+
+# pylint: disable=arguments-differ,unsupported-membership-test
+
+import zlib
+import copy
+import bisect
+import collections
+import concurrent.futures
+
+import relations
+
+
+class ShardedSource(relations.Source): # pylint: disable=too-many-public-methods
+    """
+    Spreads a model's rows across several Sources by a shard key, writing each row to its shard
+    and reading from all of them at once, merging what comes back
+
+    There's no transaction across shards, so writes commit on their shard as they go, and auto
+    increment ids repeat across shards, so models with them should shard by some other field.
+    Rows can't move between shards, so updates can't change the shard key to another shard's.
+    """
+
+    KIND = "mysql"
+
+    sources = None  # The Sources, one per shard, each with its own schema
+    key = None      # Field to shard by, the model's SHARD or its id if not set
+    ranges = None   # Where each shard after the first starts, None to hash instead
+    workers = None  # Most shards read at once, all of them by default
+    executor = None # Threads reading shards
+
+    def __init__(self, name, sources, key=None, ranges=None, workers=None): # pylint: disable=unused-argument
+        # relations.Source.__new__ registers the name
+
+        self.sources = list(sources)
+        self.key = key
+        self.ranges = ranges
+
+        if ranges is not None and len(ranges) != len(self.sources) - 1:
+            raise ValueError("need a range start for every shard after the first")
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(self.sources))
+
+    def close(self):
+        """
+        Stops the threads and closes the shards
+        """
+
+        self.executor.shutdown()
+
+        for source in self.sources:
+            source.close()
+
+    def init(self, model):
+        """
+        Init the model, leaving the schema to each shard
+        """
+
+        schema = getattr(model, "SCHEMA", None)
+
+        self.sources[0].init(model)
+
+        model.SCHEMA = schema
+
+    def shard_key(self, model):
+        """
+        The field the model's sharded by
+        """
+
+        return getattr(model, "SHARD", None) or self.key or model._id
+
+    def shard_index(self, value):
+        """
+        Which shard a shard key value goes to
+        """
+
+        if self.ranges is not None:
+            return bisect.bisect_right(self.ranges, value)
+
+        if not isinstance(value, int):
+            value = zlib.crc32(str(value).encode())
+
+        return value % len(self.sources)
+
+    def shard(self, model, original=False):
+        """
+        The shard a model's record goes to, or came from if original
+        """
+
+        key = self.shard_key(model)
+        field = model._record._names[key]
+        value = field.original if original else field.value
+
+        if value is None:
+            raise relations.ModelError(model, f"no {key} to shard by")
+
+        return self.sources[self.shard_index(value)]
+
+    def targets(self, model):
+        """
+        The shards a filter can match, just those of the shard key's values if it's filtered by them
+        """
+
+        criteria = model._record._names[self.shard_key(model)].criteria or {}
+
+        if len(criteria) == 1 and ("eq" in criteria or "in" in criteria):
+
+            values = [criteria["eq"]] if "eq" in criteria else criteria["in"]
+
+            return [self.sources[index] for index in sorted({self.shard_index(value) for value in values})]
+
+        return self.sources
+
+    @staticmethod
+    def clone(model):
+        """
+        Copies a model to read a shard into, leaving the original as it was
+        """
+
+        cloned = model.__class__.__new__(model.__class__)
+        cloned.__dict__.update(model.__dict__)
+        cloned._record = copy.deepcopy(model._record) if model._record is not None else None
+
+        return cloned
+
+    def queries(self, model, build):
+        """
+        Builds a query for each shard the filter can match, by shard, like define() does
+        """
+
+        targets = self.targets(model)
+
+        return {
+            index: build(source, self.clone(model))
+            for index, source in enumerate(self.sources)
+            if any(source is target for target in targets)
+        }
+
+    def scatter(self, model, work, sources=None):
+        """
+        Runs work on a copy of the model for each shard, in parallel if there's more than one,
+        returning the copies and what the work returned
+        """
+
+        sources = self.targets(model) if sources is None else sources
+        copies = [self.clone(model) for _ in sources]
+
+        def run(source, copied):
+            result = work(source, copied)
+            source.commit()
+            return result
+
+        if len(sources) == 1:
+            return copies, [run(sources[0], copies[0])]
+
+        futures = [self.executor.submit(run, source, copied) for source, copied in zip(sources, copies)]
+
+        return copies, [future.result() for future in futures]
+
+    def define(self, migration=None, definition=None): # pylint: disable=arguments-renamed
+        """
+        Creates the DDL for each shard, by shard, with that shard's schema
+        """
+
+        return {
+            index: source.define(
+                {**migration, "schema": migration.get("schema") or source.schema} if migration is not None else None,
+                {**definition, "schema": definition.get("schema") or source.schema} if definition is not None else None
+            )
+            for index, source in enumerate(self.sources)
+        }
+
+    def execute(self, commands, progress=None):
+        """
+        Executes commands on every shard, or by shard if they're from define()
+        """
+
+        for index, source in enumerate(self.sources):
+            source.execute(commands[index] if isinstance(commands, dict) else commands, progress)
+
+    def commit(self):
+        """
+        Commits every shard
+        """
+
+        for source in self.sources:
+            source.commit()
+
+    def create(self, model):
+        """
+        Creates each record on its shard, bulk creates as one bulk create per shard
+        """
+
+        if model._bulk:
+
+            shards = collections.defaultdict(list)
+
+            for creating in model._each("create"):
+                shards[id(self.shard(creating))].append(creating)
+
+            for source in self.sources:
+                if shards.get(id(source)):
+                    bulk = model.__class__(_action="create", _mode="many", _bulk=True)
+                    bulk._models = shards[id(source)]
+                    source.create(bulk)
+                    source.commit()
+
+            model._models = []
+
+            return model
+
+        for creating in model._each("create"):
+            source = self.shard(creating)
+            source.create(creating)
+            source.commit()
+
+        model._action = "update"
+
+        return model
+
+    def count_query(self, model):
+        """
+        Gets the count query for each shard the filter can match, by shard
+        """
+
+        return self.queries(model, lambda source, copied: source.count_query(copied))
+
+    def count(self, model):
+        """
+        Counts on each shard the filter can match, adding them up
+        """
+
+        copies, counts = self.scatter(model, lambda source, copied: source.count(copied))
+
+        model._approximate = any(getattr(copied, "_approximate", False) for copied in copies)
+
+        return sum(counts)
+
+    @staticmethod
+    def sorting(model, sort):
+        """
+        The value a model sorts by, following an extracted path if the sort has one
+        """
+
+        name, path = (sort.split("__", 1) + [None])[:2]
+
+        if path is None:
+            return model[name]
+
+        return model._record._names[name].title(path)[0]
+
+    def merge(self, model, models):
+        """
+        Sorts models from several shards like the query would have, Nones first as MySQL does
+        """
+
+        for field in reversed(model._sort or model._order or []):
+            models.sort(
+                key=lambda merging, sort=field[1:]: (self.sorting(merging, sort) is not None, self.sorting(merging, sort)),
+                reverse=field[0] == "-"
+            )
+
+        return models
+
+    def retrieve_query(self, model):
+        """
+        Gets the retrieve query for each shard the filter can match, by shard
+        """
+
+        return self.queries(model, lambda source, copied: source.retrieve_query(copied))
+
+    def retrieve(self, model, verify=True):
+        """
+        Retrieves from each shard the filter can match, merging, sorting and limiting what comes back
+        """
+
+        limit = model._limit
+        offset = model._offset or 0
+
+        def work(source, copied):
+            if limit is not None:
+                copied._limit = limit + offset
+                copied._offset = None
+            return source.retrieve(copied, False)
+
+        copies, results = self.scatter(model, work)
+
+        if model._mode == "one" and model._role != "child":
+
+            found = [copied for copied, result in zip(copies, results) if result is not None]
+
+            if len(found) > 1:
+                raise relations.ModelError(model, "more than one retrieved")
+
+            if not found:
+
+                if verify:
+                    raise relations.ModelError(model, "none retrieved")
+                return None
+
+            model.__dict__.update(found[0].__dict__)
+
+            return model
+
+        models = self.merge(model, [retrieved for copied in copies for retrieved in copied._models])
+
+        if limit is not None:
+            model.overflow = model.overflow or any(copied.overflow for copied in copies) or len(models) >= limit + offset
+            models = models[offset:offset + limit]
+
+        model._models = models
+        model._record = None
+        model._sort = None
+        model._action = "update"
+
+        return model
+
+    def titles_query(self, model):
+        """
+        Gets the titles query for each shard the filter can match, by shard
+        """
+
+        return self.queries(model, lambda source, copied: source.titles_query(copied))
+
+    def titles(self, model):
+        """
+        Creates the titles structure, retrieving across shards first if need be, so they're sorted
+        and limited as a whole
+        """
+
+        if model._action == "retrieve":
+            self.retrieve(model)
+
+        titles = relations.Titles(model)
+
+        for titling in model._each():
+            titles.add(titling)
+
+        return titles
+
+    def update(self, model):
+        """
+        Updates each record on the shard it came from, or each shard the filter can match
+        """
+
+        key = self.shard_key(model)
+
+        if model._action == "retrieve":
+
+            field = model._record._names[key]
+
+            if field.changed and self.targets(model) != [self.sources[self.shard_index(field.value)]]:
+                raise relations.ModelError(model, f"can't change {key} to move rows to another shard")
+
+            return sum(self.scatter(model, lambda source, copied: source.update(copied))[1])
+
+        updated = 0
+
+        for updating in model._each("update"):
+
+            source = self.shard(updating, original=True)
+
+            if self.shard(updating) is not source:
+                raise relations.ModelError(updating, f"can't change {key} to move rows to another shard")
+
+            updated += source.update(updating)
+            source.commit()
+
+        return updated
+
+    def delete(self, model):
+        """
+        Deletes records by id on their shards, or from each shard the filter can match
+        """
+
+        if model._action == "retrieve":
+            return sum(self.scatter(model, lambda source, copied: source.delete(copied))[1])
+
+        if not model._id:
+            raise relations.ModelError(model, "nothing to delete from")
+
+        shards = collections.defaultdict(list)
+
+        for deleting in model._each():
+            shards[id(self.shard(deleting))].append(deleting[model._id])
+
+        deleted = 0
+
+        for source in self.sources:
+            if shards.get(id(source)):
+                deleted += source.delete(model.__class__.many(**{f"{model._id}__in": shards[id(source)]}))
+                source.commit()
+
+        return deleted
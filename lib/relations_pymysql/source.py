@@ -0,0 +1,1826 @@
+"""
+The PyMySQL Source
+"""
+
+# pylint: disable=arguments-differ,unsupported-membership-test
+
+import re
+import math
+import copy
+import json
+import time
+import random
+import collections
+
+import threading
+
+import relations
+import relations_sql
+import relations_mysql
+
+from relations_pymysql.batch import Buffer
+from relations_pymysql.cache import Cache
+from relations_pymysql.metrics import Metrics
+from relations_pymysql.compact import Row, Compact, Titled, Column
+from relations_pymysql.driver import PyMySQLDriver, MySQLdbDriver
+from relations_pymysql.instrument import InstrumentMixin
+from relations_pymysql.advice import AdviceMixin
+from relations_pymysql.work import WorkMixin
+from relations_pymysql.migration import MigrationMixin
+
+# Each optional feature (caches, logs, metrics, write behind) keeps its state in an attribute of
+# its own, None while the feature's off
+
+class Source(InstrumentMixin, AdviceMixin, WorkMixin, MigrationMixin, relations_sql.SOURCE, relations.Source): # pylint: disable=too-many-public-methods,too-many-instance-attributes
+    """
+    PyMySQL Source
+    """
+
+    SQL = relations_sql.SQL
+    ASC = relations_sql.ASC
+    DESC = relations_sql.DESC
+
+    LIKE = relations_mysql.LIKE
+    IN = relations_mysql.IN
+    OR = relations_mysql.OR
+    OP = relations_mysql.OP
+
+    AS = relations_mysql.AS
+    ORDER = relations_mysql.ORDER
+    OPTIONS = relations_mysql.OPTIONS
+    FIELDS = relations_mysql.FIELDS
+    COLUMN_NAME = relations_mysql.COLUMN_NAME
+    TABLE = relations_mysql.TABLE
+    TABLE_NAME = relations_mysql.TABLE_NAME
+
+    INSERT = relations_mysql.INSERT
+    SELECT = relations_mysql.SELECT
+    UPDATE = relations_mysql.UPDATE
+    DELETE = relations_mysql.DELETE
+
+    KIND = "mysql"
+
+    SETTINGS = [
+        "name", "schema", "connection", "driver",
+        "retry_codes", "retry_attempts", "retry_delay", "retry_jitter", "retry_cap",
+        "batch_rows",
+        "write_behind", "write_behind_rows", "write_behind_wait", "write_behind_limit",
+        "cache", "cache_ttl", "cache_size", "cache_memory",
+        "slow_log", "slow_log_size", "slow_log_sample",
+        "query_budget", "query_budget_repeats", "query_budget_raise",
+        "metrics", "metrics_buckets",
+        "profile",
+        "tuples",
+        "multi_statements", "multi_statements_bytes",
+        "online", "online_chunk", "online_pause",
+        "extract_index",
+        "advise",
+        "count_approximate", "count_cache_ttl",
+        "timeout", "timeouts",
+        "titles_cache", "titles_cache_ttl", "titles_cache_size"
+    ]
+
+    TABLES = re.compile(r"`([^`]+)`\.`([^`]+)`")
+    WRITES = ("create", "update", "delete", "upsert")
+    RECORDS = re.compile(r"Records: (\d+)\s+Duplicates: (\d+)")
+
+    schema = None   # Database to use
+    connections = None # Connections
+    created = False   # If we created the connection
+    kwargs = None
+    driver = "pymysql" # Driver name or instance
+
+    DRIVERS = {
+        "pymysql": PyMySQLDriver,
+        "mysqldb": MySQLdbDriver
+    }
+
+    retry_codes = (1205, 1213) # Lock wait timeout and deadlock, safe to replay
+    retry_attempts = 3  # Total tries for a unit of work
+    retry_delay = 0.05  # Seconds before the first replay, doubling each time
+    retry_jitter = 0.5  # Fraction of each delay that's randomized
+    retry_cap = 2.0     # Most seconds to wait between tries
+    retries = None      # Retry metrics
+
+    batch_rows = 1000   # Most rows per coalesced statement when flushing a unit of work
+
+    write_behind = False        # Whether to buffer creates that don't need ids back
+    write_behind_rows = 500     # Flush once this many rows are buffered
+    write_behind_wait = 1.0     # Flush once the oldest buffered row is this many seconds old
+    write_behind_limit = 5000   # Make creates wait when this many rows are buffered mid flush
+    buffer = None               # Rows written behind, shared by all threads
+
+    cache = False                   # Whether to cache what's retrieved and counted
+    cache_ttl = 60                  # Seconds a cached result is good for
+    cache_size = 1000               # Most results to cache
+    cache_memory = 64 * 1024 * 1024 # Most bytes (roughly) to cache
+    results = None                  # The result cache
+
+    hooks = None    # Callables run before and after every statement
+
+    slow_log = None         # Seconds a statement has to take to be logged as slow, None for off
+    slow_log_size = 100     # Most slow statements to keep, oldest dropped first
+    slow_log_sample = 1.0   # Fraction of slow SELECTs to EXPLAIN
+    slow = None             # The slow statements
+    explainer = None        # Connection used just for EXPLAIN
+
+    query_budget = None         # Most statements a top level operation may run, None for off
+    query_budget_repeats = 3    # Most times one statement shape may run in a top level operation
+    query_budget_raise = True   # Whether going over budget raises, else it's logged
+
+    metrics = False         # Whether to keep metrics
+    metrics_buckets = None  # Histogram buckets in seconds, None for the default
+    meters = None           # The metrics
+
+    profile = False     # Whether to time the phases of every operation
+    profiles = None     # Seconds and calls by model, operation and phase
+
+    tuples = False  # Whether retrieve reads rows as tuples, rather than a dict per row
+
+    multi_statements = 0                # Most statements execute sends at once, 0 for one at a time
+    multi_statements_bytes = 1024 * 1024 # Most bytes execute sends at once
+
+    online = False      # Whether migrations change tables by copying to a shadow table rather than ALTER
+    online_chunk = 1000 # Rows copied to the shadow table per chunk
+    online_pause = 0.0  # Seconds to wait between chunks, to throttle the copy
+
+    extract_index = False   # Whether define() indexes the generated columns of extracted JSON paths
+
+    advise = False      # Whether to count the shapes of counts and retrieves to suggest indexes
+    shapes = None       # How many times each filter and sort shape ran, by table
+    definitions = None  # Definitions of the tables shapes ran against
+
+    count_approximate = None    # Estimated rows at or above which counts return the estimate, None for always exact
+    count_cache_ttl = None      # Seconds exact counts are cached, None for off
+    counts = None               # The count cache
+
+    timeout = None      # Seconds a SELECT may run before MySQL stops it, None for no limit
+    timeouts = None     # Seconds by operation, like {"retrieve": 5, "count": 1}, overriding timeout
+    executing = None    # What each thread is running, for cancelling
+    canceller = None    # Connection used just for KILL QUERY
+    untimed_kwargs = None   # Connection arguments without the read_timeout we added, for DDL and migrations
+    untimeds = None         # Connections opened with those, by thread
+
+    titles_cache = False        # Whether to cache what titles queries select
+    titles_cache_ttl = 300      # Seconds cached titles rows are good for
+    titles_cache_size = 1000    # Most titles queries to cache
+    titled = None               # The titles cache
+
+    def __init__(self, name, schema, connection=None, **kwargs):
+
+        self.schema = schema
+        self.kwargs = {name: arg for name, arg in kwargs.items() if name not in self.SETTINGS}
+        self.driver = self.DRIVERS[self.driver]() if isinstance(self.driver, str) else self.driver
+        self.lock = threading.Lock()
+        self.explain_lock = threading.Lock()
+        self.local = threading.local()
+        self.connections = {}
+        self.untimeds = {}
+        self.retries = {"attempts": 0, "retried": 0, "recovered": 0, "exhausted": 0, "codes": {}}
+        self.hooks = {"before": [], "after": []}
+        self.timeouts = dict(self.timeouts or {})
+        self.executing = {}
+
+        # Past the longest timeout, MySQL should've stopped the statement, so stop waiting on it.
+        # That only goes for SELECTs, so DDL and migrations run without it.
+
+        if (self.timeout is not None or self.timeouts) and "read_timeout" not in self.kwargs:
+            self.untimed_kwargs = dict(self.kwargs)
+            self.kwargs["read_timeout"] = math.ceil(max([self.timeout or 0] + list(self.timeouts.values())) + 1)
+
+        if self.metrics:
+            self.meters = Metrics(self.metrics_buckets)
+
+        if self.profile:
+            self.profiles = {}
+
+        if self.slow_log is not None:
+            self.slow = collections.deque(maxlen=self.slow_log_size)
+
+        if self.advise:
+            self.shapes = collections.Counter()
+            self.definitions = {}
+
+        if self.cache:
+            self.results = Cache(self.cache_ttl, self.cache_size, self.cache_memory)
+
+        if self.count_cache_ttl is not None:
+            self.counts = Cache(self.count_cache_ttl, self.cache_size, self.cache_memory)
+
+        if self.titles_cache:
+            self.titled = Cache(self.titles_cache_ttl, self.titles_cache_size, self.cache_memory)
+
+        if self.write_behind:
+            self.buffer = Buffer()
+
+        if connection is not None:
+            self.connections[threading.get_ident()] = connection
+        else:
+            self.created = True
+            self.connections[threading.get_ident()] = self.driver.connect(**self.kwargs)
+            self.meter("connections_opened_total", purpose="query")
+
+    def __getattr__(self, name):
+
+        if name == "connection":
+
+            thread = threading.get_ident()
+
+            if thread not in self.connections:
+
+                try:
+
+                    self.lock.acquire()
+
+                    alive = {running.ident for running in threading.enumerate()}
+
+                    for connections in [self.connections, self.untimeds]:
+                        for dead in set(connections.keys()) - alive:
+                            connections[dead].close()
+                            del connections[dead]
+                            self.meter("connections_closed_total", reason="reaped")
+
+                    self.connections[thread] = self.driver.connect(**self.kwargs)
+                    self.meter("connections_opened_total", purpose="query")
+
+                finally:
+
+                    self.lock.release()
+
+            return self.connections[thread]
+
+        raise AttributeError(f"'{self}' object has no attribute '{name}'")
+
+    def __del__(self):
+
+        if self.created and self.connections:
+            for connection in self.connections.values():
+                if connection:
+                    connection.close()
+
+        if self.created and self.untimeds:
+            for connection in self.untimeds.values():
+                if connection not in self.connections.values():
+                    connection.close()
+
+        if self.explainer is not None:
+            self.explainer.close()
+
+        if self.canceller is not None:
+            self.canceller.close()
+
+        if self.buffer is not None and self.buffer.connection is not None:
+            self.buffer.connection.close()
+
+    @staticmethod
+    def snapshot(model):
+        """
+        Captures the state a write changes so a replay starts from scratch
+        """
+
+        snapshot = []
+        models = [model]
+
+        while models:
+
+            current = models.pop()
+
+            snapshot.append((
+                current,
+                current._action,
+                copy.deepcopy(current._record) if current._record is not None else None,
+                list(current._models) if current._models is not None else None,
+                dict(current._related)
+            ))
+
+            for each in current._each():
+                if each is not current:
+                    models.append(each)
+                models.extend(child for child in each._children.values() if child is not None)
+
+        return snapshot
+
+    @staticmethod
+    def restore(snapshot):
+        """
+        Puts models back the way they were before a failed write
+        """
+
+        for model, action, record, models, related in snapshot:
+            model._action = action
+            model._record = record
+            model._models = models
+            model._related = related
+
+    def retry(self, work, *args, **kwargs):
+        """
+        Runs a unit of work, replaying it in a fresh transaction on deadlock or lock wait timeout
+        """
+
+        # Nested work (children, ties) is part of the outer unit, which replays it all, and
+        # work inside a transaction can only be replayed by replaying the whole transaction.
+        # Rolling back would also lose earlier writes not yet committed, so only whoever
+        # made those can replay them.
+
+        if getattr(self.local, "retrying", False) or self.batch() is not None or self.pending():
+            return work(*args, **kwargs)
+
+        snapshot = self.snapshot(args[0]) if args and isinstance(args[0], relations.Model) else None
+        autocommit = self.connection.get_autocommit()
+
+        self.local.retrying = True
+
+        try:
+
+            attempt = 1
+
+            while True:
+
+                self.retries["attempts"] += 1
+
+                try:
+
+                    result = self.attempt(autocommit, work, *args, **kwargs)
+
+                    if attempt > 1:
+                        self.retries["recovered"] += 1
+
+                    return result
+
+                except self.driver.ERROR as exception:
+
+                    code = self.driver.code(exception)
+
+                    if code not in self.retry_codes:
+                        raise
+
+                    self.retries["codes"][code] = self.retries["codes"].get(code, 0) + 1
+
+                    # A deadlock rolls back the transaction but a lock wait timeout only the
+                    # statement, so roll back what this work did either way to start fresh
+
+                    self.connection.rollback()
+                    self.local.pending = False
+
+                    if attempt >= self.retry_attempts:
+                        self.retries["exhausted"] += 1
+                        raise
+
+                    if snapshot is not None:
+                        self.restore(snapshot)
+
+                    if getattr(self.local, "budget", None) is not None:
+                        self.local.budget["statements"] = 0
+                        self.local.budget["shapes"].clear()
+
+                    delay = min(self.retry_cap, self.retry_delay * 2 ** (attempt - 1))
+                    time.sleep(delay * (1 - self.retry_jitter * random.random()))
+
+                    self.retries["retried"] += 1
+                    attempt += 1
+
+        finally:
+
+            self.local.retrying = False
+
+    def attempt(self, autocommit, work, *args, **kwargs):
+        """
+        Runs one attempt of a unit of work, in a transaction of its own if autocommit's on
+        """
+
+        if not autocommit:
+            return work(*args, **kwargs)
+
+        # Otherwise each statement commits as it goes, so a deadlocked child would leave its
+        # parent written and the replay would write the parent again
+
+        self.connection.begin()
+
+        try:
+            result = work(*args, **kwargs)
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+        self.connection.commit()
+        self.committed()
+
+        return result
+
+    def fetch(self, cursor, query, model=None, operation="retrieve", results=None):
+        """
+        Executes a generated SELECT and fetches all its rows, through the result cache if on,
+        or the cache given
+        """
+
+        results = self.results if results is None else results
+        cache = results is not None and self.batch() is None
+
+        if cache:
+
+            key = (query.sql, tuple(query.args))
+
+            found, rows = results.get(key)
+
+            if found:
+                return [dict(row) for row in rows]
+
+        self.cursor_execute(cursor, query.sql, query.args, model, operation)
+
+        with self.phase(model, operation, "fetch"):
+            rows = list(cursor.fetchall())
+
+        if cache:
+            results.set(key, set(self.TABLES.findall(query.sql)), [dict(row) for row in rows])
+
+        return rows
+
+    def fetch_tuples(self, cursor, query, model=None, operation="retrieve"):
+        """
+        Executes a generated SELECT on a tuple cursor and fetches its columns and rows, through
+        the result cache if on
+        """
+
+        cache = self.results is not None and self.batch() is None
+
+        if cache:
+
+            key = ("tuples", query.sql, tuple(query.args))
+
+            found, fetched = self.results.get(key)
+
+            if found:
+                return fetched
+
+        self.cursor_execute(cursor, query.sql, query.args, model, operation)
+
+        with self.phase(model, operation, "fetch"):
+            rows = list(cursor.fetchall())
+
+        columns = [column[0] for column in cursor.description or []]
+
+        # Tuples can't be changed so the cache can hand out the same ones
+
+        if cache:
+            self.results.set(key, set(self.TABLES.findall(query.sql)), (columns, rows))
+
+        return columns, rows
+
+    def init(self, model):
+        """
+        Init the model
+        """
+
+        self.record_init(model._fields)
+
+        self.ensure_attribute(model, "SCHEMA")
+        self.ensure_attribute(model, "STORE")
+
+        if model.SCHEMA is None:
+            model.SCHEMA = self.schema
+
+        if model.STORE is None:
+            model.STORE = model.NAME
+
+        if model._id is not None and model._fields._names[model._id].auto is None and model._fields._names[model._id].kind == int:
+            model._fields._names[model._id].auto = True
+
+    def define(self, migration=None, definition=None):
+        """
+        Creates the DDL for a model
+        """
+
+        if self.extract_index and migration is not None:
+            migration = self.extract_indexes(migration, definition)
+
+        ddl = self.TABLE(migration, definition)
+        ddl.generate(indent=2)
+
+        return ddl.sql
+
+    @staticmethod
+    def extract_columns(fields):
+        """
+        The generated columns for the extracted paths of fields that can be indexed, those of
+        scalar kinds, as MySQL can't index JSON columns
+        """
+
+        scalars = [kind for kind, column in relations_mysql.COLUMN.KINDS.items() if column != relations_mysql.COLUMN.KINDS["json"]]
+
+        columns = []
+
+        for field in fields:
+            if "inject" not in field and field.get("store", field["name"]) and "extract" in field:
+                store = field.get("store", field["name"])
+                columns.extend(f"{store}__{path}" for path, kind in sorted(field["extract"].items()) if kind in scalars)
+
+        return columns
+
+    def extract_indexes(self, migration, definition=None):
+        """
+        Adds an index for every extracted path's generated column that doesn't lead one already,
+        so filtering and sorting on extracted values needn't parse the JSON of every row
+        """
+
+        migration = copy.deepcopy(migration)
+
+        if definition is None:
+
+            indexes = migration.setdefault("index", {})
+            leading = {columns[0] for index in ["index", "unique"] for columns in migration.get(index, {}).values() if columns}
+            columns = self.extract_columns(migration.get("fields", []))
+
+        else:
+
+            if "fields" not in migration:
+                return migration
+
+            indexes = migration.setdefault("index", {}).setdefault("add", {})
+
+            leading = {
+                columns[0]
+                for index in ["index", "unique"]
+                for changes in [definition.get(index, {}), migration.get(index, {}).get("add", {})]
+                for columns in changes.values() if columns
+            }
+
+            changed = []
+
+            for name, change in migration["fields"].get("change", {}).items():
+
+                field = next(field for field in definition["fields"] if field["name"] == name)
+
+                if "extract" in change:
+                    changed.append({
+                        **field, **change, "store": change.get("store", field.get("store", name)),
+                        "extract": {path: kind for path, kind in change["extract"].items() if path not in field.get("extract", {})}
+                    })
+
+            columns = self.extract_columns(migration["fields"].get("add", []) + changed)
+
+        for column in columns:
+            if column not in leading and column not in indexes:
+                indexes[column] = [column]
+
+        return migration
+
+    def create_query(self, model):
+        """
+        Get query for what's being inserted
+        """
+
+        fields = [field.store for field in model._fields._order if not field.auto and not field.inject and field.store]
+        query = self.INSERT(self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema), *fields)
+
+        if not model._bulk and model._id is not None and model._fields._names[model._id].auto:
+            if model._mode == "many":
+                raise relations.ModelError(model, "only one create query at a time")
+            return copy.deepcopy(query).VALUES(**model._record.create({})).bind(model)
+
+        for creating in model._each("create"):
+            query.VALUES(**creating._record.create({}))
+
+        return query
+
+    def create_id(self, cursor, model, query):
+        """
+        Inserts a single record and sets the id
+        """
+
+        with self.phase(model, "create", "build"):
+            query.generate()
+
+        self.cursor_execute(cursor, query.sql, query.args, model, "create")
+
+        model[model._id] = cursor.lastrowid
+
+    def create(self, model, query=None):
+        """
+        Executes the create, replaying on deadlock
+        """
+
+        with self.budget(model, "create"):
+            return self.retry(self.create_execute, model, query)
+
+    def create_later(self, model, query=None):
+        """
+        Queues the rows of a create nothing waits on, in the unit of work or written behind,
+        returning whether it did
+        """
+
+        if query is not None or (self.batch() is None and self.buffer is None):
+            return False
+
+        rows = [creating._record.create({}) for creating in model._each("create")]
+
+        if not rows:
+            return True
+
+        if self.batch() is not None:
+            self.batch().insert((model.SCHEMA or self.schema, model.STORE), self.create_query(model), rows)
+        else:
+            self.buffer_create(model, rows)
+
+        return True
+
+    def create_execute(self, model, query=None):
+        """
+        Executes the create
+        """
+
+        super().create(model)
+
+        self.invalidate(model.SCHEMA or self.schema, model.STORE)
+
+        cursor = self.connection.cursor()
+
+        if not model._bulk and model._id is not None and model._fields._names[model._id].auto:
+            self.flush(model)
+            for creating in model._each("create"):
+                with self.phase(creating, "create", "build"):
+                    create_query = query or self.create_query(creating)
+                self.create_id(cursor, creating, create_query)
+        elif not self.create_later(model, query):
+            self.flush(model)
+            with self.phase(model, "create", "build"):
+                create_query = query or self.create_query(model)
+                create_query.generate()
+            self.cursor_execute(cursor, create_query.sql, create_query.args, model, "create")
+
+        cursor.close()
+
+        if not model._bulk:
+
+            for creating in model._each("create"):
+
+                if model._id:
+                    with self.phase(creating, "create", "ties"):
+                        self.create_ties(creating)
+
+                for parent_child in creating.CHILDREN:
+                    if creating._children.get(parent_child):
+                        creating._children[parent_child].create()
+                creating._action = "update"
+                creating._record._action = "update"
+
+            model._action = "update"
+
+        else:
+
+            model._models = []
+
+        return model
+
+    def upsert_query(self, model, rows):
+        """
+        Get query for what's being inserted or updated, updating everything but the id on duplicate keys
+        """
+
+        fields = [field.store for field in model._fields._order if not field.inject and field.store]
+        query = self.INSERT(self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema), *fields)
+
+        for row in rows:
+            query.VALUES(**row)
+
+        query.generate()
+
+        id_store = model._fields._names[model._id].store if model._id is not None else None
+        updates = [field for field in fields if field != id_store] or fields[:1]
+
+        query.sql = f"{query.sql} ON DUPLICATE KEY UPDATE {','.join(f'`{field}`=VALUES(`{field}`)' for field in updates)}"
+
+        return query
+
+    def upsert_ids(self, cursor, model, upserts):
+        """
+        Sets the ids of upserted models that didn't have them, looking them up by a unique key they all have.
+        Without one, only models with ties need them.
+        """
+
+        missing = [upserting for upserting in upserts if upserting[model._id] is None]
+
+        if not missing:
+            return
+
+        for names in model._unique.values():
+
+            if any(upserting[name] is None for upserting in missing for name in names):
+                continue
+
+            stores = [model._fields._names[name].store for name in names]
+            id_store = model._fields._names[model._id].store
+            keys = [tuple(upserting._record.create({})[store] for store in stores) for upserting in missing]
+
+            columns = ','.join(f'`{store}`' for store in stores)
+            values = ','.join(['(' + ','.join(['%s'] * len(stores)) + ')'] * len(keys))
+
+            self.cursor_execute(
+                cursor,
+                f"SELECT `{id_store}`,{columns} FROM `{model.SCHEMA or self.schema}`.`{model.STORE}` WHERE ({columns}) IN ({values})",
+                [value for key in keys for value in key],
+                model,
+                "retrieve"
+            )
+
+            ids = {tuple(row[store] for store in stores): row[id_store] for row in cursor.fetchall()}
+
+            for upserting, key in zip(missing, keys):
+
+                if key not in ids:
+                    raise relations.ModelError(model, f"upserted {dict(zip(names, key))} not found to get its id")
+
+                upserting[model._id] = ids[key]
+
+            return
+
+        if any(upserting._record.tie({}) for upserting in missing):
+            raise relations.ModelError(model, "need ids or unique values to upsert ties")
+
+    def upsert_ties(self, model, upserts):
+        """
+        Replaces the ties of upserted models, all at once per relation, once they have their ids
+        """
+
+        tied = [upserting for upserting in upserts if upserting._record.tie({})]
+
+        if not tied:
+            return
+
+        ids = [upserting[model._id] for upserting in tied]
+
+        self.delete_ties(model, ids)
+
+        for relations_, model_ref, other_ref, ref in [
+            (model.SISTERS, "tie_brother_ref", "tie_sister_ref", "brother_sister_ref"),
+            (model.BROTHERS, "tie_sister_ref", "tie_brother_ref", "sister_brother_ref")
+        ]:
+
+            for relation in relations_.values():
+
+                values = [
+                    {getattr(relation, model_ref): upserting[model._id], getattr(relation, other_ref): value}
+                    for upserting in tied
+                    for value in (upserting._record.tie({}).get(getattr(relation, ref)) or [])
+                ]
+
+                if values:
+                    relation.Tie(values).create()
+
+    def upsert(self, model):
+        """
+        Inserts models, updating those whose id or unique values are already there, replaying on deadlock
+        """
+
+        with self.budget(model, "upsert"):
+            return self.retry(self.upsert_execute, model)
+
+    def upsert_execute(self, model):
+        """
+        Inserts models, updating those whose id or unique values are already there, batch_rows at a time with
+        INSERT ... ON DUPLICATE KEY UPDATE, then replaces their ties. Returns how many were inserted, updated,
+        and already as they were.
+        """
+
+        self.flush(model)
+        self.invalidate(model.SCHEMA or self.schema, model.STORE)
+
+        upserts = list(model._each("create"))
+
+        if model._bulk and any(self.has_ties(upserting) for upserting in upserts):
+            raise relations.ModelError(model, "cannot upsert ties in bulk mode")
+
+        id_store = model._fields._names[model._id].store if model._id is not None else None
+
+        rows = []
+
+        for upserting in upserts:
+            row = upserting._record.create({})
+            if id_store is not None:
+                row[id_store] = upserting[model._id]
+            rows.append(row)
+
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        cursor = self.connection.cursor()
+
+        for start in range(0, len(rows), self.batch_rows):
+
+            with self.phase(model, "upsert", "build"):
+                query = self.upsert_query(model, rows[start:start + self.batch_rows])
+
+            self.cursor_execute(cursor, query.sql, query.args, model, "upsert")
+
+            # Inserts affect one row and updates two, and multiple rows report how many were duplicates
+
+            records = self.RECORDS.search(self.driver.info(cursor))
+
+            if records:
+                inserted = int(records.group(1)) - int(records.group(2))
+                updated = (cursor.rowcount - inserted) // 2
+                unchanged = int(records.group(2)) - updated
+            else:
+                inserted, updated, unchanged = int(cursor.rowcount == 1), int(cursor.rowcount == 2), int(cursor.rowcount == 0)
+
+            counts["inserted"] += inserted
+            counts["updated"] += updated
+            counts["unchanged"] += unchanged
+
+        if not model._bulk and model._id is not None:
+
+            self.upsert_ids(cursor, model, upserts)
+
+            with self.phase(model, "upsert", "ties"):
+                self.upsert_ties(model, upserts)
+
+            for upserting in upserts:
+                if upserting[model._id] is not None:
+                    upserting._action = "update"
+                    upserting._record._action = "update"
+
+        cursor.close()
+
+        return counts
+
+    def retrieve_field(self, field, query):
+        """
+        Adds where caluse to query
+        """
+
+        for operator, value in (field.criteria or {}).items():
+            name = f"{field.store}__{operator}"
+            extracted = operator.rsplit("__", 1)[0] in (field.extract or {})
+            query.WHERE(self.OP(name, value, EXTRACTED=extracted))
+
+    def like(self, model, query):
+        """
+        Adds like information to the query
+        """
+
+        if model._like is None:
+            return
+
+        titles = self.OR()
+
+        for name in model._titles:
+
+            path = name.split("__", 1)
+            name = path.pop(0)
+
+            field = model._fields._names[name]
+
+            parent = False
+
+            for relation in model.PARENTS.values():
+                if field.name == relation.child_parent_ref:
+                    parent = relation.Parent.many(like=model._like).limit(model._chunk)
+                    if parent[relation.parent_id]:
+                        titles(self.IN(field.store, parent[relation.parent_id]))
+                        model.overflow = model.overflow or parent.overflow
+                    else:
+                        parent = True
+
+            if not parent:
+
+                paths = path if path else field.titles
+
+                if paths:
+                    for path in paths:
+                        titles(self.LIKE(f"{field.store}__{path}", model._like, extracted=path in (field.extract or {})))
+                else:
+                    titles(self.LIKE(field.store, model._like))
+
+        if titles:
+            query.WHERE(titles)
+
+    def sort(self, model, query):
+        """
+        Adds sort information to the query
+        """
+
+        for field in (model._sort or model._order or []):
+
+            order = self.ASC if field[0] == "+" else self.DESC
+            name, path = (field[1:].split("__", 1) + [None])[:2]
+
+            # Sort extracted paths by their generated column, which can be indexed
+
+            if name in model._fields._names and path in (model._fields._names[name].extract or {}):
+                query.ORDER_BY(self.ORDER(self.COLUMN_NAME(f"{model._fields._names[name].store}__{path}", extracted=True), order))
+            else:
+                query.ORDER_BY(**{field[1:]: order})
+
+        model._sort = None
+
+    @staticmethod
+    def limit(model, query):
+        """
+        Adds sort informaiton to the query
+        """
+
+        if model._limit is not None:
+            query.LIMIT(model._limit)
+
+        if model._offset:
+            query.LIMIT(model._offset)
+
+    def count_query(self, model):
+        """
+        Get query for what's being inserted
+        """
+
+        query = self.SELECT(self.AS("total", self.SQL("COUNT(*)"))).FROM(self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema))
+
+        model._collate()
+        self.collate_ties_query(model, query)
+        self.retrieve_record(model._record, query)
+        self.like(model, query)
+
+        # a sibling-attribute flat join repeats a model tied to several matching siblings, so
+        # count the distinct model id instead of the joined rows
+        if getattr(model, "_distinct", False):
+            query.FIELDS = self.FIELDS(self.AS("total", self.SQL(f"COUNT(DISTINCT {model.STORE}.{model._id})")))
+
+        return query
+
+    def retrieve_query(self, model):
+        """
+        Get query for what's being inserted
+        """
+
+        query = self.count_query(model)
+
+        # honor the flat-join DISTINCT marker: dedupe the model rows the join multiplied
+        if getattr(model, "_distinct", False):
+            query.OPTIONS = self.OPTIONS("DISTINCT")
+            query.FIELDS = self.FIELDS(self.COLUMN_NAME("*", table=model.STORE))
+        else:
+            query.FIELDS = self.FIELDS("*")
+
+        self.sort(model, query)
+        self.limit(model, query)
+
+        return query
+
+    @staticmethod
+    def titles_columns(model):
+        """
+        The columns titles need, the id's and the title fields', or None if there's no id
+        or a title isn't stored in a column
+        """
+
+        if model._id is None:
+            return None
+
+        columns = [model._fields._names[model._id].store]
+
+        for name in model._titles:
+
+            field = model._fields._names[name.split("__", 1)[0]]
+
+            if not isinstance(field.store, str) or field.inject:
+                return None
+
+            if field.store not in columns:
+                columns.append(field.store)
+
+        return columns
+
+    def titles_query(self, model):
+        """
+        Get query for what's being selected, just the columns titles need
+        """
+
+        columns = self.titles_columns(model)
+
+        if columns is None:
+            return self.retrieve_query(model)
+
+        query = self.count_query(model)
+
+        # DISTINCT needs what it sorts by selected as well
+
+        if getattr(model, "_distinct", False):
+
+            for field in (model._sort or model._order or []):
+                name = field[1:].split("__", 1)[0]
+                if name in model._fields._names and isinstance(model._fields._names[name].store, str):
+                    columns.append(model._fields._names[name].store)
+
+            query.OPTIONS = self.OPTIONS("DISTINCT")
+            query.FIELDS = self.FIELDS(*(self.COLUMN_NAME(column, table=model.STORE) for column in dict.fromkeys(columns)))
+
+        else:
+
+            query.FIELDS = self.FIELDS(*columns)
+
+        self.sort(model, query)
+        self.limit(model, query)
+
+        return query
+
+    def count(self, model, query=None):
+        """
+        Executes the count, within budget
+        """
+
+        with self.budget(model, "count"):
+            return self.count_execute(model, query)
+
+    def count_execute(self, model, query=None):
+        """
+        Executes the count, through the count cache and estimates if on, flagging
+        the model _approximate if the count's an estimate
+        """
+
+        super().count(model)
+
+        self.flush(model)
+
+        cursor = self.connection.cursor()
+
+        with self.phase(model, "count", "build"):
+
+            if query is None:
+                self.advise_record(model, sort=False)
+                query = self.count_query(model)
+
+            query.generate()
+
+        model._approximate = False
+
+        counting = self.batch() is None
+        key = (query.sql, tuple(query.args))
+
+        if self.counts is not None and counting:
+
+            found, total = self.counts.get(key)
+
+            if found:
+                cursor.close()
+                return total
+
+        if self.count_approximate is not None and counting:
+
+            estimate = self.estimate(cursor, model, query)
+
+            if estimate is not None and estimate >= self.count_approximate:
+                model._approximate = True
+                cursor.close()
+                return estimate
+
+        rows = self.fetch(cursor, query, model, "count")
+
+        total = rows[0]["total"] if rows else 0
+
+        if self.counts is not None and counting:
+            self.counts.set(key, set(self.TABLES.findall(query.sql)), total)
+
+        cursor.close()
+
+        return total
+
+    def table_rows(self, cursor, schema, store, model=None):
+        """
+        Estimated rows in a table from its statistics, as counting a large one takes too long
+        """
+
+        self.cursor_execute(
+            cursor,
+            "SELECT `TABLE_ROWS` AS `rows` FROM `information_schema`.`TABLES` WHERE `TABLE_SCHEMA`=%s AND `TABLE_NAME`=%s",
+            (schema, store),
+            model,
+            "estimate"
+        )
+
+        row = cursor.fetchone()
+
+        return int(row["rows"]) if row and row["rows"] is not None else None
+
+    def estimate(self, cursor, model, query):
+        """
+        Estimated rows a count would find, from table statistics when unfiltered, else from the
+        optimizer's estimate if it reads one table, else None
+        """
+
+        if not self.criteria(model) and not getattr(model, "_distinct", False):
+            return self.table_rows(cursor, model.SCHEMA or self.schema, model.STORE, model)
+
+        self.cursor_execute(cursor, f"EXPLAIN FORMAT=JSON {query.sql}", query.args, model, "estimate")
+        table = json.loads(list(cursor.fetchone().values())[0])["query_block"].get("table", {})
+
+        if "rows_examined_per_scan" not in table:
+            return None
+
+        return int(table["rows_examined_per_scan"] * float(table.get("filtered", 100)) / 100)
+
+    @staticmethod
+    def values_retrieve(model, values):
+        """
+        Encodes the fields in json if needed
+        """
+        for field in model._fields._order:
+            if isinstance(values.get(field.store), str) and field.kind not in [bool, int, float, str]:
+                values[field.store] = json.loads(values[field.store])
+
+        return values
+
+    def values_rows(self, model, rows):
+        """
+        Encodes the fields of rows, timing it if keeping metrics or profiling
+        """
+
+        if self.meters is None and self.profiles is None:
+            return [self.values_retrieve(model, row) for row in rows]
+
+        start = time.perf_counter()
+        rows = [self.values_retrieve(model, row) for row in rows]
+        self.decoded(model, time.perf_counter() - start)
+
+        return rows
+
+    def values_tuples(self, model, columns, rows):
+        """
+        Encodes the fields of tuple rows by position, mapping columns to positions once
+        """
+
+        start = time.perf_counter()
+
+        index = {column: position for position, column in enumerate(columns)}
+
+        positions = [
+            index[field.store] for field in model._fields._order
+            if field.store in index and field.kind not in [bool, int, float, str]
+        ]
+
+        if not positions:
+            rows = [Row(index, row) for row in rows]
+        else:
+            decoded = []
+            for row in rows:
+                row = list(row)
+                for position in positions:
+                    if isinstance(row[position], str):
+                        row[position] = json.loads(row[position])
+                decoded.append(Row(index, row))
+            rows = decoded
+
+        if self.meters is not None or self.profiles is not None:
+            self.decoded(model, time.perf_counter() - start)
+
+        return rows
+
+    def decoded(self, model, seconds):
+        """
+        Records time spent decoding, if keeping metrics or profiling
+        """
+
+        if self.meters is not None:
+            self.meters.observe("decode_seconds", {"model": model.__class__.__name__}, seconds)
+
+        if self.profiles is not None:
+            self.profile_add(model, "retrieve", "decode", seconds)
+
+    @staticmethod
+    def identity_narrowed(model):
+        """
+        Whether a model's retrieve is narrowed by more than field criteria
+        """
+
+        return model._like is not None or model._limit is not None or bool(model._offset) or bool(model._ties)
+
+    @staticmethod
+    def identity_related(model):
+        """
+        Whether a model's retrieve is narrowed by its parents or children
+        """
+
+        return any(parent is not None for parent in model._parents.values()) or any(child is not None for child in model._children.values())
+
+    @staticmethod
+    def identity_sorting(model):
+        """
+        The stores to sort by and whether descending, or None if a sort isn't a stored field
+        """
+
+        sorting = []
+
+        for field in (model._sort or model._order or []):
+
+            name = field[1:]
+
+            if name not in model._fields._names:
+                return None
+
+            store = model._fields._names[name].store
+
+            if not isinstance(store, str) or model._fields._names[name].inject:
+                return None
+
+            sorting.append((store, field[0] == "-"))
+
+        return sorting
+
+    def identity_ids(self, model):
+        """
+        The ids a model is retrieving if it's retrieving by nothing but id, else None
+        """
+
+        if model._id is None or self.identity_narrowed(model) or self.identity_related(model):
+            return None
+
+        for field in model._record._order:
+            if field.name != model._id and field.criteria:
+                return None
+
+        criteria = model._record._names[model._id].criteria or {}
+
+        if list(criteria) == ["eq"]:
+            return [criteria["eq"]]
+
+        if list(criteria) == ["in"]:
+            return list(criteria["in"])
+
+        return None
+
+    def identity_retrieve(self, cursor, model):
+        """
+        Serves rows by id from the session's identity map, querying only for the missing ones
+        """
+
+        ids = self.identity_ids(model)
+
+        if ids is None:
+            return None
+
+        # Sorts by extracted paths are left to the database
+
+        sorting = self.identity_sorting(model)
+
+        if sorting is None:
+            return None
+
+        store = model._fields._names[model._id].store
+        known = self.identities().setdefault((model.SCHEMA or self.schema, model.STORE), {})
+        missing = [id for id in ids if id not in known]
+
+        if missing:
+
+            model._record._names[model._id].criteria = {"in": missing}
+
+            query = self.retrieve_query(model)
+            query.generate()
+
+            for row in self.values_rows(model, self.fetch(cursor, query, model)):
+                known[row[store]] = copy.deepcopy(row)
+
+        model._sort = None
+
+        rows = [copy.deepcopy(known[id]) for id in dict.fromkeys(ids) if id in known]
+
+        # Same order the database would have used, least significant first
+
+        for column, descending in reversed(sorting):
+            rows.sort(
+                key=lambda row, column=column: (row.get(column) is not None, row.get(column) if row.get(column) is not None else 0),
+                reverse=descending
+            )
+
+        return rows
+
+    def retrieve(self, model, verify=True, query=None):
+        """
+        Executes the retrieve, within budget
+        """
+
+        with self.budget(model, "retrieve"):
+            return self.retrieve_execute(model, verify, query)
+
+    def retrieve_execute(self, model, verify=True, query=None):
+        """
+        Executes the retrieve
+        """
+
+        super().retrieve(model)
+
+        self.flush(model)
+
+        cursor = self.connection.cursor()
+
+        rows = self.retrieve_rows(cursor, model, query)
+
+        if model._mode == "one" and len(rows) > 1:
+            raise relations.ModelError(model, "more than one retrieved")
+
+        if model._mode == "one" and model._role != "child":
+
+            if not rows:
+
+                if verify:
+                    raise relations.ModelError(model, "none retrieved")
+                return None
+
+            with self.phase(model, "retrieve", "models"):
+                model._record = model._build("update", _read=rows[0])
+
+        else:
+
+            with self.phase(model, "retrieve", "models"):
+                model._models = [model.__class__(_read=row) for row in rows]
+
+            if model._limit is not None:
+                model.overflow = model.overflow or len(model._models) >= model._limit
+
+            model._record = None
+
+        model._action = "update"
+
+        with self.phase(model, "retrieve", "ties"):
+            self.retrieve_ties(model)
+
+        cursor.close()
+
+        return model
+
+    def retrieve_rows(self, cursor, model, query=None):
+        """
+        Fetches the rows being retrieved, from the identity map if it has them all
+        """
+
+        if query is None and self.identities() is not None:
+
+            rows = self.identity_retrieve(cursor, model)
+
+            if rows is not None:
+                return rows
+
+        # Only full rows from our own query can go in the identity map
+
+        identify = query is None and self.identities() is not None and model._id is not None
+
+        with self.phase(model, "retrieve", "build"):
+
+            if query is None:
+                self.advise_record(model)
+                query = self.retrieve_query(model)
+
+            query.generate()
+
+        if self.tuples and not identify:
+            return self.retrieve_tuples(model, query)
+
+        rows = self.values_rows(model, self.fetch(cursor, query, model))
+
+        if identify:
+            self.identify(model, rows)
+
+        return rows
+
+    def retrieve_tuples(self, model, query):
+        """
+        Fetches the rows being retrieved through a tuple cursor
+        """
+
+        cursor = self.driver.cursor(self.connection, tuples=True)
+        rows = self.values_tuples(model, *self.fetch_tuples(cursor, query, model))
+        cursor.close()
+
+        return rows
+
+    def identify(self, model, rows):
+        """
+        Puts full rows retrieved in the session's identity map
+        """
+
+        store = model._fields._names[model._id].store
+        known = self.identities().setdefault((model.SCHEMA or self.schema, model.STORE), {})
+
+        for row in rows:
+            known[row[store]] = copy.deepcopy(row)
+
+    def compact(self, model, query=None):
+        """
+        Retrieves read only rows stored by column, without building a model per row
+        """
+
+        with self.budget(model, "retrieve"):
+
+            super().retrieve(model)
+
+            self.flush(model)
+
+            with self.phase(model, "retrieve", "build"):
+
+                if query is None:
+                    self.advise_record(model)
+                    query = self.retrieve_query(model)
+
+                query.generate()
+
+            cursor = self.driver.cursor(self.connection, tuples=True)
+            rows = self.values_tuples(model, *self.fetch_tuples(cursor, query, model))
+            cursor.close()
+
+            if model._mode == "one" and len(rows) > 1:
+                raise relations.ModelError(model, "more than one retrieved")
+
+            with self.phase(model, "retrieve", "models"):
+                compact = Compact([field.name for field in model._fields._order], self.compact_columns(model, rows))
+
+            with self.phase(model, "retrieve", "ties"):
+                self.compact_ties(model, compact)
+
+            return compact
+
+    @staticmethod
+    def compact_columns(model, rows):
+        """
+        Reads rows into a list of values per field, the way records read them
+        """
+
+        columns = {}
+
+        for field in model._fields._order:
+
+            if field.inject:
+                store = model._fields._names[field.inject.split('__')[0]].store
+                reader = copy.deepcopy(field)
+                column = []
+                for row in rows:
+                    reader.read(row[store])
+                    column.append(reader.value)
+            elif field.store:
+                column = [field.valid(row.get(field.store)) for row in rows]
+            else:
+                column = [None] * len(rows)
+
+            columns[field.name] = column
+
+        return columns
+
+    def compact_ties(self, model, compact):
+        """
+        Fills in the tie fields of every row with one query per relation
+        """
+
+        for relation in model.SISTERS.values():
+            self.compact_tie(model, compact, relation, (
+                relation.brother_id, relation.brother_sister_ref, relation.tie_brother_ref, relation.tie_sister_ref
+            ))
+
+        for relation in model.BROTHERS.values():
+            self.compact_tie(model, compact, relation, (
+                relation.sister_id, relation.sister_brother_ref, relation.tie_sister_ref, relation.tie_brother_ref
+            ))
+
+    def compact_tie(self, model, compact, relation, names):
+        """
+        Fills in one tie field of every row, names being the id field, the tie field, and the
+        tie's refs to this side and the other
+        """
+
+        id_name, ref, tie_ref, tie_other_ref = names
+
+        ids = compact._columns[id_name]
+
+        ties = {}
+
+        if ids:
+
+            found = self.compact(relation.Tie.many(**{f"{tie_ref}__in": ids}))
+
+            for tied, other in zip(found._columns[tie_ref], found._columns[tie_other_ref]):
+                ties.setdefault(tied, []).append(other)
+
+        field = model._fields._names[ref]
+
+        compact._columns[ref] = [field.valid(ties.get(tied, [])) for tied in ids]
+
+    def columns(self, model, chunk=10000, query=None):
+        """
+        Streams a retrieve as a dict of field names to Columns per chunk of rows, never holding
+        more than a chunk. The connection can't run anything else until it's exhausted or closed.
+        """
+
+        super().retrieve(model)
+
+        self.flush(model)
+
+        with self.phase(model, "retrieve", "build"):
+
+            if query is None:
+                self.advise_record(model)
+                query = self.retrieve_query(model)
+
+            query.generate()
+
+        cursor = self.driver.cursor(self.connection, stream=True)
+
+        # A streaming cursor's rowcount is meaningless, so count what's fetched
+
+        fetched = 0
+
+        try:
+
+            self.cursor_execute(cursor, query.sql, query.args, model, "retrieve")
+
+            index = {column[0]: position for position, column in enumerate(cursor.description or [])}
+
+            fields = [
+                (field, index[field.store]) for field in model._fields._order
+                if field.store and not field.inject and field.store in index
+            ]
+
+            while True:
+
+                with self.phase(model, "retrieve", "fetch"):
+                    rows = cursor.fetchmany(chunk)
+
+                if not rows:
+                    break
+
+                fetched += len(rows)
+
+                yield {field.name: Column(field.name, field.kind, [row[position] for row in rows]) for field, position in fields}
+
+        finally:
+
+            cursor.close()
+
+            self.meter("rows_read_total", fetched, model=model.__class__.__name__)
+
+    def titles(self, model, query=None):
+        """
+        Creates the titles structure, selecting just the columns titles need if retrieving,
+        through the titles cache if on
+        """
+
+        if model._action == "retrieve" and (query is not None or self.titles_columns(model) is not None):
+
+            with self.budget(model, "retrieve"):
+
+                super().retrieve(model)
+
+                self.flush(model)
+
+                with self.phase(model, "retrieve", "build"):
+
+                    if query is None:
+                        self.advise_record(model)
+                        query = self.titles_query(model)
+
+                    query.generate()
+
+                cursor = self.connection.cursor()
+                rows = self.values_rows(model, self.fetch(cursor, query, model, results=self.titled))
+                cursor.close()
+
+                if model._mode == "one" and len(rows) > 1:
+                    raise relations.ModelError(model, "more than one retrieved")
+
+                with self.phase(model, "retrieve", "models"):
+
+                    titled = Titled(model, rows)
+                    titles = relations.Titles(titled)
+
+                    for titling in titled:
+                        titles.add(titling)
+
+                return titles
+
+        if model._action == "retrieve":
+            self.retrieve(model, query=query)
+
+        titles = relations.Titles(model)
+
+        for titling in model._each():
+            titles.add(titling)
+
+        return titles
+
+    def update_field(self, field, updates, query):
+        """
+        Adds fields to update clause
+        """
+
+        if field.store in updates and not field.auto:
+            query.SET(**{field.store: updates[field.store]})
+
+    def update_query(self, model):
+        """
+        Create the update query
+        """
+
+        query = self.UPDATE(self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema))
+
+        if model._action == "retrieve" and model._record._action == "update":
+
+            self.update_record(model._record, model._record.mass({}), query)
+
+        elif model._id:
+
+            if model._mode == "many":
+                raise relations.ModelError(model, "only one update query at a time")
+
+            self.update_record(model._record, model._record.update({}), query)
+
+            query.WHERE(**{model._fields._names[model._id].store: model[model._id]})
+
+        else:
+
+            raise relations.ModelError(model, "nothing to update from")
+
+        self.retrieve_record(model._record, query)
+
+        return query
+
+    def update(self, model, query=None):
+        """
+        Executes the update, replaying on deadlock
+        """
+
+        with self.budget(model, "update"):
+            return self.retry(self.update_execute, model, query)
+
+    def update_execute(self, model, query=None):
+        """
+        Executes the update
+        """
+
+        self.flush(model)
+        self.invalidate(model.SCHEMA or self.schema, model.STORE)
+
+        cursor = self.connection.cursor()
+
+        updated = 0
+
+        # If the overall model is retrieving and the record has values set
+
+        if model._action == "retrieve" and model._record._action == "update":
+
+            with self.phase(model, "update", "build"):
+                update_query = query or self.update_query(model)
+
+            if update_query.SET.expressions:
+
+                with self.phase(model, "update", "build"):
+                    update_query.generate()
+
+                self.cursor_execute(cursor, update_query.sql, update_query.args, model, "update")
+                updated = cursor.rowcount
+
+            ties = model._record.tie({})
+
+            if ties:
+
+                store_id = model._fields._names[model._id].store
+
+                table = self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema)
+                id_query = self.SELECT(store_id, WHERE=update_query.WHERE).FROM(table)
+
+                id_query.generate()
+
+                self.cursor_execute(cursor, id_query.sql, id_query.args, model, "retrieve")
+                ids = [row[store_id] for row in cursor.fetchall()]
+
+                with self.phase(model, "update", "ties"):
+                    self.delete_ties(model, ids)
+                    self.create_ties(model, ties, ids)
+
+                updated = len(ids)
+
+        elif model._id:
+
+            for updating in model._each("update"):
+
+                with self.phase(updating, "update", "build"):
+                    update_query = query or self.update_query(updating)
+
+                if update_query.SET.expressions:
+
+                    with self.phase(updating, "update", "build"):
+                        update_query.generate()
+
+                    self.cursor_execute(cursor, update_query.sql, update_query.args, updating, "update")
+
+                with self.phase(updating, "update", "ties"):
+                    self.delete_ties(updating)
+                    self.create_ties(updating)
+
+                for parent_child in updating.CHILDREN:
+                    if updating._children.get(parent_child):
+                        updating._children[parent_child].create().update()
+
+                updated += cursor.rowcount
+
+        else:
+
+            raise relations.ModelError(model, "nothing to update from")
+
+        return updated
+
+    def delete_query(self, model):
+        """
+        Create the update query
+        """
+
+        query = self.DELETE(self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema))
+
+        if model._action == "retrieve":
+
+            self.retrieve_record(model._record, query)
+
+        elif model._id:
+
+            ids = []
+            store = model._fields._names[model._id].store
+            for deleting in model._each():
+                ids.append(deleting[model._id])
+
+            query.WHERE(**{f"{store}__in": ids})
+
+        else:
+
+            raise relations.ModelError(model, "nothing to delete from")
+
+        return query
+
+    def delete_ties(self, model, ids=None): # pylint: disable=arguments-renamed
+        """
+        Deletes records for tie tables, batched when in a unit of work
+        """
+
+        if self.batch() is None:
+            super().delete_ties(model, ids)
+            return
+
+        if ids is None:
+            ids = model[model._id]
+
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        for relation in model.SISTERS.values():
+            tie = relation.Tie.thy()
+            self.batch().delete((tie.SCHEMA or self.schema, tie.STORE), tie._fields._names[relation.tie_brother_ref].store, ids)
+
+        for relation in model.BROTHERS.values():
+            tie = relation.Tie.thy()
+            self.batch().delete((tie.SCHEMA or self.schema, tie.STORE), tie._fields._names[relation.tie_sister_ref].store, ids)
+
+    def delete(self, model, query=None):
+        """
+        Executes the delete, replaying on deadlock
+        """
+
+        with self.budget(model, "delete"):
+            return self.retry(self.delete_execute, model, query)
+
+    def delete_execute(self, model, query=None):
+        """
+        Executes the delete
+        """
+
+        self.flush(model)
+        self.invalidate(model.SCHEMA or self.schema, model.STORE)
+
+        cursor = self.connection.cursor()
+
+        if model._action == "retrieve":
+
+            with self.phase(model, "delete", "build"):
+                delete_query = query or self.delete_query(model)
+
+            if model._id:
+
+                store_id = model._fields._names[model._id].store
+
+                table = self.TABLE_NAME(model.STORE, schema=model.SCHEMA or self.schema)
+                id_query = self.SELECT(store_id, WHERE=delete_query.WHERE).FROM(table)
+
+                id_query.generate()
+
+                self.cursor_execute(cursor, id_query.sql, id_query.args, model, "retrieve")
+                ids = [row[store_id] for row in cursor.fetchall()]
+
+                with self.phase(model, "delete", "ties"):
+                    self.delete_ties(model, ids)
+
+        elif model._id:
+
+            with self.phase(model, "delete", "build"):
+                delete_query = self.delete_query(model)
+
+            for deleting in model._each():
+                if self.has_ties(deleting):
+                    with self.phase(deleting, "delete", "ties"):
+                        self.delete_ties(deleting)
+
+        else:
+
+            raise relations.ModelError(model, "nothing to delete from")
+
+        with self.phase(model, "delete", "build"):
+            delete_query.generate()
+
+        self.cursor_execute(cursor, delete_query.sql, delete_query.args, model, "delete")
+        return cursor.rowcount
@@ -0,0 +1,197 @@
+"""
+Splitting SQL into statements as it streams
+"""
+
+import re
+
+
+class Splitter:
+    """
+    Splits SQL into statements as it streams in, leaving any ; in strings, quoted identifiers,
+    comments and the BEGIN ... END bodies of stored programs alone, and following DELIMITER
+    like the mysql client does
+    """
+
+    SPECIAL = r"""['"`#]|--(?=\s)|/\*|^[ \t]*DELIMITER\b|\b(?:BEGIN|CASE|END)\b"""
+
+    TOKENS = {
+        "'": re.compile(r"'(?:[^'\\]|\\.)*'", re.S),
+        '"': re.compile(r'"(?:[^"\\]|\\.)*"', re.S),
+        "`": re.compile(r"`[^`]*`"),
+        "#": re.compile(r"#[^\n]*\n"),
+        "--": re.compile(r"--[^\n]*\n"),
+        "/*": re.compile(r"/\*.*?\*/", re.S)
+    }
+
+    COMMENTS = re.compile(r"(?:#|--\s)[^\n]*(?:\n|$)|/\*.*?\*/", re.S)
+
+    PROGRAM = re.compile(r"(?:CREATE|ALTER)\b[^;(]*?\b(?:TRIGGER|PROCEDURE|FUNCTION|EVENT)\b", re.I)
+    FOLLOWING = re.compile(r"\s*(\w*)")
+    TAIL = re.compile(r"(?:^[ \t]*)?\w*\Z", re.M)
+
+    def __init__(self):
+
+        self.buffer = ""
+        self.start = 0      # Where the statement being read starts
+        self.position = 0   # Where to pick up scanning
+        self.depth = 0      # How many BEGIN ... END blocks of a stored program we're in
+        self.delimit(";")
+
+    def delimit(self, delimiter):
+        """
+        Sets what ends statements
+        """
+
+        self.delimiter = delimiter
+        self.special = re.compile(f"{self.SPECIAL}|{re.escape(delimiter)}", re.I | re.M)
+
+    def statement(self, end):
+        """
+        The statement from the start to end, or None if there's nothing to it but comments
+        """
+
+        statement = self.buffer[self.start:end].strip()
+
+        if not self.COMMENTS.sub("", statement).strip():
+            return None
+
+        return statement
+
+    def redelimit(self, found):
+        """
+        Follows a DELIMITER line, returning where to pick up scanning, or None if the line isn't
+        all there yet
+        """
+
+        newline = self.buffer.find("\n", found.end())
+
+        if newline < 0:
+            return None
+
+        delimiter = self.buffer[found.end():newline].split()
+
+        # It only counts on a line of its own between statements
+
+        if not delimiter or self.statement(found.start()) is not None:
+            return found.end()
+
+        self.delimit(delimiter[0])
+        self.start = newline + 1
+
+        return self.start
+
+    def keyword(self, found):
+        """
+        Follows a DELIMITER, BEGIN, CASE or END, returning where to pick up scanning, or None if
+        there isn't enough yet to tell
+        """
+
+        word = found.group().strip().upper()
+
+        if word == "DELIMITER":
+            return self.redelimit(found)
+
+        # With a delimiter of their own, stored programs need no help
+
+        if self.delimiter != ";":
+            return found.end()
+
+        following = self.FOLLOWING.match(self.buffer, found.end())
+
+        if following.end() == len(self.buffer):
+            return None
+
+        # Blocks start with BEGIN in the body of a stored program, and end with a plain END,
+        # where CASE ... END (CASE) nests too but END IF, END LOOP and the like don't
+
+        if word == "BEGIN" and (
+            self.depth or self.PROGRAM.match(self.COMMENTS.sub("", self.buffer[self.start:found.start()]).lstrip())
+        ):
+            self.depth += 1
+        elif word == "CASE" and self.depth:
+            self.depth += 1
+        elif word == "END":
+
+            closing = following.group(1).upper()
+
+            if self.depth and closing not in ("IF", "LOOP", "WHILE", "REPEAT"):
+                self.depth -= 1
+
+            # What END closes isn't the start of anything
+
+            if closing in ("IF", "LOOP", "WHILE", "REPEAT", "CASE"):
+                return following.end()
+
+        return found.end()
+
+    def feed(self, text):
+        """
+        Adds text, returning the statements it finished
+        """
+
+        self.buffer = self.buffer[self.start:] + text
+        self.position -= self.start
+        self.start = 0
+
+        statements = []
+
+        while True:
+
+            found = self.special.search(self.buffer, self.position)
+
+            # Back up a little so a --, /*, delimiter or word split across feeds is found next time
+
+            if found is None:
+                tail = len(self.buffer) - max(2, len(self.delimiter))
+                self.position = max(self.position, min(tail, self.TAIL.search(self.buffer).start()))
+                break
+
+            special = found.group()
+
+            if special == self.delimiter:
+
+                if not self.depth:
+                    statement = self.statement(found.start())
+                    if statement is not None:
+                        statements.append(statement)
+                    self.start = found.end()
+
+                self.position = found.end()
+                continue
+
+            if special in self.TOKENS:
+
+                token = self.TOKENS[special].match(self.buffer, found.start())
+
+                # Unfinished, so wait for more
+
+                if token is None:
+                    self.position = found.start()
+                    break
+
+                self.position = token.end()
+                continue
+
+            position = self.keyword(found)
+
+            if position is None:
+                self.position = found.start()
+                break
+
+            self.position = position
+
+        return statements
+
+    def end(self):
+        """
+        Returns whatever's left as the last statement, if anything
+        """
+
+        statement = self.statement(len(self.buffer))
+
+        self.buffer = ""
+        self.start = self.position = 0
+        self.depth = 0
+        self.delimit(";")
+
+        return [statement] if statement is not None else []
@@ -0,0 +1,433 @@
+"""
+Units of work, sessions, write behind and invalidating caches
+"""
+
+import time
+import contextlib
+
+import threading
+
+from relations_pymysql.batch import Batch
+
+
+class WorkMixin:
+    """
+    Batches, buffers, commits and invalidates what a Source writes
+    """
+
+    def batch(self):
+        """
+        The unit of work this thread is in, if any
+        """
+
+        return getattr(self.local, "batch", None)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Unit of work: writes that nothing waits on are batched, flushed in order and committed once
+        """
+
+        if self.batch() is not None:
+            yield self.batch()
+            return
+
+        self.local.batch = Batch()
+
+        try:
+
+            self.connection.begin()
+
+            with self.session():
+                yield self.local.batch
+
+            self.flush()
+            self.connection.commit()
+            self.committed()
+
+        except BaseException:
+
+            self.connection.rollback()
+            self.local.dirty = None
+
+            # Anything read in a rolled back transaction can't be trusted by an outer session
+
+            if self.identities() is not None:
+                self.identities().clear()
+
+            raise
+
+        finally:
+
+            self.local.batch = None
+            self.local.pending = False
+
+    def identities(self):
+        """
+        The identity map of the session this thread is in, if any
+        """
+
+        return getattr(self.local, "identities", None)
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Identity map: rows retrieved by id are kept and served from memory until the session ends
+        """
+
+        if self.identities() is not None:
+            yield self.identities()
+            return
+
+        self.local.identities = {}
+
+        try:
+            yield self.local.identities
+        finally:
+            self.local.identities = None
+
+    def commit(self):
+        """
+        Commits unless in a unit of work, which commits once at the end
+        """
+
+        if self.batch() is None:
+            self.connection.commit()
+            self.local.pending = False
+            self.committed()
+
+    def pending(self):
+        """
+        Whether this thread's connection has writes it hasn't committed
+        """
+
+        return getattr(self.local, "pending", False) and not self.connection.get_autocommit()
+
+    def batch_execute(self, writes, connection=None):
+        """
+        Executes coalesced writes in order, on this thread's connection or the one given
+        """
+
+        cursor = (connection or self.connection).cursor()
+
+        for write in writes:
+
+            self.invalidate(*write["table"])
+
+            if write["kind"] == "insert":
+
+                values = []
+                args = []
+                rows = 0
+
+                for fragment, fragment_args, fragment_rows, _ in write["values"]:
+
+                    values.append(fragment)
+                    args.extend(fragment_args)
+                    rows += fragment_rows
+
+                    if rows >= self.batch_rows:
+                        self.cursor_execute(cursor, f"{write['prefix']} VALUES {','.join(values)}", args, operation="create")
+                        values = []
+                        args = []
+                        rows = 0
+
+                if values:
+                    self.cursor_execute(cursor, f"{write['prefix']} VALUES {','.join(values)}", args, operation="create")
+
+            else:
+
+                ids = sorted(write["ids"])
+
+                for start in range(0, len(ids), self.batch_rows):
+                    query = self.DELETE(self.TABLE_NAME(write["table"][1], schema=write["table"][0]))
+                    query.WHERE(**{f"{write['column']}__in": ids[start:start + self.batch_rows]})
+                    query.generate()
+                    self.cursor_execute(cursor, query.sql, query.args, operation="delete")
+
+        cursor.close()
+
+    def buffer_create(self, model, rows):
+        """
+        Writes a create behind, flushing if enough rows are waiting, and raising if rows this
+        thread wrote behind earlier failed
+        """
+
+        buffer = self.buffer
+        owner = threading.get_ident()
+
+        with buffer.condition:
+
+            # Backpressure: if a flush is already underway and we're at the limit, wait it out
+
+            while buffer.rows >= self.write_behind_limit and buffer.flushing:
+                buffer.condition.wait()
+
+            buffer.insert((model.SCHEMA or self.schema, model.STORE), self.create_query(model), rows, owner)
+
+            if not buffer.rows:
+                buffer.since = time.time()
+
+            buffer.rows += len(rows)
+
+            if buffer.flusher is None:
+                buffer.flusher = threading.Thread(target=self.buffer_wait, daemon=True)
+                buffer.flusher.start()
+
+            buffer.condition.notify_all()
+
+            full = buffer.rows >= self.write_behind_rows and not buffer.flushing
+
+        if full:
+            self.buffer_flush()
+
+        error = buffer.error(owner)
+
+        if error is not None:
+            raise error
+
+    def buffer_flush(self):
+        """
+        Flushes rows written behind as multi-row inserts, on the buffer's own connection so
+        no caller's work is committed or rolled back with them
+        """
+
+        buffer = self.buffer
+
+        with buffer.condition:
+
+            while buffer.flushing:
+                buffer.condition.wait()
+
+            if not buffer.rows:
+                return
+
+            writes = buffer.writes
+            rows = buffer.rows
+            buffer.writes = []
+            buffer.rows = 0
+            buffer.since = None
+            buffer.flushing = True
+
+        def requeue():
+            with buffer.condition:
+                buffer.writes = writes + buffer.writes
+                buffer.rows += rows
+                buffer.since = buffer.since or time.time()
+
+        try:
+
+            if buffer.connection is None:
+
+                try:
+                    buffer.connection = self.driver.connect(**self.kwargs)
+                except self.driver.ERROR:
+                    requeue()
+                    raise
+
+                self.meter("connections_opened_total", purpose="buffer")
+
+            try:
+
+                self.batch_execute(writes, buffer.connection)
+
+            except self.driver.ERROR as exception:
+
+                buffer.connection.rollback()
+
+                # Transient failures go back in line for the next flush
+
+                if self.driver.code(exception) in self.retry_codes:
+                    requeue()
+                    return
+
+                # Anything else is down to some of the rows, so the rest go in without them
+
+                self.buffer_rows(writes)
+
+            buffer.connection.commit()
+
+            for table in {write["table"] for write in writes}:
+                self.uncache(*table)
+
+        finally:
+
+            with buffer.condition:
+                buffer.flushing = False
+                buffer.condition.notify_all()
+
+    def buffer_rows(self, writes):
+        """
+        Inserts rows written behind a create at a time, keeping those that fail and the
+        error for whoever wrote them
+        """
+
+        cursor = self.buffer.connection.cursor()
+
+        for write in writes:
+            for values, args, _, owner in write["values"]:
+
+                sql = f"{write['prefix']} VALUES {values}"
+
+                # A failed statement only rolls back itself, so the rest of the flush stands
+
+                try:
+                    self.cursor_execute(cursor, sql, args, operation="create")
+                except self.driver.ERROR as exception:
+                    self.buffer.fail(owner, exception, {"table": write["table"], "sql": sql, "args": args})
+
+        cursor.close()
+
+    def buffer_wait(self):
+        """
+        Background flusher, flushing rows that have waited long enough
+        """
+
+        buffer = self.buffer
+
+        while True:
+
+            with buffer.condition:
+
+                while not buffer.closed:
+
+                    if buffer.rows and time.time() - buffer.since >= self.write_behind_wait:
+                        break
+
+                    buffer.condition.wait(self.write_behind_wait - (time.time() - buffer.since) if buffer.rows else None)
+
+                if buffer.closed:
+                    return
+
+            try:
+                self.buffer_flush()
+            except Exception as exception: # pylint: disable=broad-except
+                buffer.fail(None, exception)
+
+    def flush(self, model=None):
+        """
+        Executes pending writes, everything written behind and everything in this thread's
+        unit of work
+        """
+
+        # What runs now can read other tables through joins and ties, or depend on rows
+        # queued earlier for other tables, so all of it goes first, whatever the model
+
+        if self.buffer is not None:
+
+            self.buffer_flush()
+
+            # Rows that failed surface to whoever wrote them, or anyone on an explicit flush
+
+            error = self.buffer.error(threading.get_ident(), everyone=model is None)
+
+            if error is not None:
+                raise error
+
+        batch = self.batch()
+
+        if not batch:
+            return
+
+        writes = batch.writes
+        batch.writes = []
+
+        self.batch_execute(writes)
+
+    def close(self):
+        """
+        Flushes anything written behind and closes the connections we made
+        """
+
+        if self.buffer is not None:
+
+            with self.buffer.condition:
+                self.buffer.closed = True
+                self.buffer.condition.notify_all()
+
+            try:
+                self.flush()
+            finally:
+                if self.buffer.connection is not None:
+                    self.buffer.connection.close()
+                    self.buffer.connection = None
+                    self.meter("connections_closed_total", reason="closed")
+
+        if self.created:
+
+            with self.lock:
+
+                for connection in self.untimeds.values():
+                    if connection not in self.connections.values():
+                        connection.close()
+                        self.meter("connections_closed_total", reason="closed")
+
+                for connection in self.connections.values():
+                    if connection:
+                        connection.close()
+                        self.meter("connections_closed_total", reason="closed")
+
+                self.connections = {}
+                self.untimeds = {}
+
+        if self.explainer is not None:
+
+            with self.explain_lock:
+                self.explainer.close()
+                self.explainer = None
+                self.meter("connections_closed_total", reason="closed")
+
+        if self.canceller is not None:
+
+            with self.lock:
+                self.canceller.close()
+                self.canceller = None
+                self.meter("connections_closed_total", reason="closed")
+
+    def invalidate(self, schema=None, store=None):
+        """
+        Drops cached results and identities read from a table, or all of them, and the
+        cached results again once this thread commits
+        """
+
+        self.uncache(schema, store)
+
+        if self.results is not None or self.counts is not None or self.titled is not None:
+
+            if getattr(self.local, "dirty", None) is None:
+                self.local.dirty = set()
+
+            self.local.dirty.add((schema, store))
+
+        if self.identities() is not None:
+            if store is None:
+                self.identities().clear()
+            else:
+                self.identities().pop((schema, store), None)
+
+    def uncache(self, schema=None, store=None):
+        """
+        Drops cached results read from a table, or all of them
+        """
+
+        table = None if store is None else (schema, store)
+
+        if self.results is not None:
+            self.results.invalidate(table)
+
+        if self.counts is not None:
+            self.counts.invalidate(table)
+
+        if self.titled is not None:
+            self.titled.invalidate(table)
+
+    def committed(self):
+        """
+        Drops cached results again for tables this thread wrote to, as other threads could've
+        cached what was there before the writes committed
+        """
+
+        dirty, self.local.dirty = getattr(self.local, "dirty", None), None
+
+        for schema, store in dirty or ():
+            self.uncache(schema, store)
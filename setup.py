@@ -9,7 +9,7 @@ setup(
     name="relations-pymysql",
     version="0.6.15",
     package_dir = {'': 'lib'},
-    py_modules = [
+    packages = [
         'relations_pymysql'
     ],
     install_requires=[
@@ -17,6 +17,9 @@ setup(
         'relations-dil>=0.6.14',
         'relations-mysql>=0.6.4'
     ],
+    extras_require={
+        'mysqldb': ['mysqlclient>=2.0.1']
+    },
     url="https://github.com/relations-dil/python-relations-pymysql",
     author="Gaffer Fitch",
     author_email="relations@gaf3.com",
@@ -6,6 +6,8 @@ import shutil
 import pathlib
 import copy
 import json
+import time
+import array
 import threading
 
 import pymysql.cursors
@@ -102,6 +104,632 @@ class SisBro(SourceModel):
 
 relations.ManyToMany(Sis, Bro, SisBro)
 
+class ShardModel(relations.Model):
+    SOURCE = "PyMySQLSharded"
+
+class Part(ShardModel):
+    SHARD = "name"
+    id = int
+    name = str
+    rank = int
+
+class TestBatch(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_insert(self):
+
+        batch = relations_pymysql.Batch()
+
+        batch.insert(("test_source", "sis_bro"), relations_pymysql.Source.INSERT(
+            relations_pymysql.Source.TABLE_NAME("sis_bro", schema="test_source"), "bro_id", "sis_id"
+        ).VALUES(bro_id=1, sis_id=2), [{"bro_id": 1, "sis_id": 2}])
+
+        batch.insert(("test_source", "sis_bro"), relations_pymysql.Source.INSERT(
+            relations_pymysql.Source.TABLE_NAME("sis_bro", schema="test_source"), "bro_id", "sis_id"
+        ).VALUES(bro_id=1, sis_id=3).VALUES(bro_id=2, sis_id=3), [{"bro_id": 1, "sis_id": 3}, {"bro_id": 2, "sis_id": 3}])
+
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(batch.tables(), {("test_source", "sis_bro")})
+        self.assertEqual(batch.writes[0]["prefix"], "INSERT INTO `test_source`.`sis_bro` (`bro_id`,`sis_id`)")
+        self.assertEqual(batch.writes[0]["values"], [
+            ("(%s,%s)", [1, 2], 1, None),
+            ("(%s,%s),(%s,%s)", [1, 3, 2, 3], 2, None)
+        ])
+
+        # A delete that would match the new rows keeps them apart
+
+        batch.delete(("test_source", "sis_bro"), "sis_id", [4])
+        batch.insert(("test_source", "sis_bro"), relations_pymysql.Source.INSERT(
+            relations_pymysql.Source.TABLE_NAME("sis_bro", schema="test_source"), "bro_id", "sis_id"
+        ).VALUES(bro_id=1, sis_id=4), [{"bro_id": 1, "sis_id": 4}])
+
+        self.assertEqual(len(batch), 3)
+
+        batch.insert(("test_source", "sis_bro"), relations_pymysql.Source.INSERT(
+            relations_pymysql.Source.TABLE_NAME("sis_bro", schema="test_source"), "bro_id", "sis_id"
+        ).VALUES(bro_id=1, sis_id=5), [{"bro_id": 1, "sis_id": 5}], "owner")
+
+        self.assertEqual(batch.writes[2]["values"][-1], ("(%s,%s)", [1, 5], 1, "owner"))
+
+    def test_delete(self):
+
+        batch = relations_pymysql.Batch()
+
+        batch.delete(("test_source", "sis_bro"), "sis_id", [1])
+        batch.insert(("test_source", "sis_bro"), relations_pymysql.Source.INSERT(
+            relations_pymysql.Source.TABLE_NAME("sis_bro", schema="test_source"), "bro_id", "sis_id"
+        ).VALUES(bro_id=1, sis_id=1), [{"bro_id": 1, "sis_id": 1}])
+        batch.delete(("test_source", "sis_bro"), "sis_id", [2])
+        batch.insert(("test_source", "sis_bro"), relations_pymysql.Source.INSERT(
+            relations_pymysql.Source.TABLE_NAME("sis_bro", schema="test_source"), "bro_id", "sis_id"
+        ).VALUES(bro_id=1, sis_id=2), [{"bro_id": 1, "sis_id": 2}])
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.writes[0]["ids"], {1, 2})
+        self.assertEqual(len(batch.writes[1]["values"]), 2)
+
+        # Deleting what was just inserted has to wait for the insert
+
+        batch.delete(("test_source", "sis_bro"), "sis_id", [1])
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.writes[2]["ids"], {1})
+
+
+class TestBuffer(unittest.TestCase):
+
+    def test___init__(self):
+
+        buffer = relations_pymysql.Buffer()
+
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.rows, 0)
+        self.assertFalse(buffer.flushing)
+        self.assertIsNone(buffer.connection)
+        self.assertEqual(buffer.failed, [])
+
+    def test_fail(self):
+
+        buffer = relations_pymysql.Buffer()
+        error = Exception("nope")
+
+        buffer.fail("owner", error, {"table": ("test_source", "plain"), "sql": "INSERT", "args": [1]})
+        buffer.fail(None, error)
+
+        self.assertEqual(buffer.failed, [{"table": ("test_source", "plain"), "sql": "INSERT", "args": [1], "error": error}])
+        self.assertEqual(buffer.errors, {"owner": error, None: error})
+
+    def test_error(self):
+
+        buffer = relations_pymysql.Buffer()
+        mine = Exception("mine")
+        background = Exception("background")
+        theirs = Exception("theirs")
+
+        buffer.fail("me", mine)
+        buffer.fail(None, background)
+        buffer.fail("them", theirs)
+
+        self.assertEqual(buffer.error("me"), mine)
+        self.assertEqual(buffer.error("me"), background)
+        self.assertIsNone(buffer.error("me"))
+        self.assertEqual(buffer.error(everyone=True), theirs)
+        self.assertIsNone(buffer.error(everyone=True))
+
+
+class TestCache(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_sizeof(self):
+
+        self.assertGreater(relations_pymysql.Cache.sizeof([{"a": "b" * 100}]), 100)
+
+    @unittest.mock.patch("time.time", unittest.mock.MagicMock(return_value=0))
+    def test_get(self):
+
+        cache = relations_pymysql.Cache(ttl=10)
+
+        self.assertEqual(cache.get("a"), (False, None))
+
+        cache.set("a", {("test", "unit")}, [{"id": 1}])
+        self.assertEqual(cache.get("a"), (True, [{"id": 1}]))
+
+        time.time.return_value = 11
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(len(cache), 0)
+
+        self.assertEqual(cache.statistics(), {
+            "hits": 1,
+            "misses": 2,
+            "evictions": 0,
+            "expirations": 1,
+            "invalidations": 0,
+            "entries": 0,
+            "bytes": 0
+        })
+
+    def test_set(self):
+
+        cache = relations_pymysql.Cache(size=2)
+
+        cache.set("a", {("test", "unit")}, 1)
+        cache.set("b", {("test", "unit")}, 2)
+        cache.get("a")
+        cache.set("c", {("test", "test")}, 3)
+
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual(cache.tables, {("test", "unit"): {"a"}, ("test", "test"): {"c"}})
+        self.assertEqual(cache.stats["evictions"], 1)
+
+        cache = relations_pymysql.Cache(memory=relations_pymysql.Cache.sizeof("a" * 100) * 2)
+
+        cache.set("a", set(), "a" * 100)
+        cache.set("b", set(), "b" * 100)
+        cache.set("c", set(), "c" * 100)
+        cache.set("d", set(), "d" * 1000)
+
+        self.assertEqual(list(cache.entries), ["b", "c"])
+
+    def test_invalidate(self):
+
+        cache = relations_pymysql.Cache()
+
+        cache.set("a", {("test", "unit"), ("test", "test")}, 1)
+        cache.set("b", {("test", "unit")}, 2)
+        cache.set("c", {("test", "case")}, 3)
+
+        cache.invalidate(("test", "test"))
+        self.assertEqual(list(cache.entries), ["b", "c"])
+
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.tables, {})
+        self.assertEqual(cache.bytes, 0)
+        self.assertEqual(cache.stats["invalidations"], 3)
+
+
+class TestMetrics(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_labels(self):
+
+        self.assertEqual(relations_pymysql.Metrics.labels({"b": 1, "a": "x"}), (("a", "x"), ("b", "1")))
+
+    def test_inc(self):
+
+        metrics = relations_pymysql.Metrics()
+
+        metrics.inc("queries_total", {"operation": "create"})
+        metrics.inc("queries_total", {"operation": "create"}, 2)
+
+        self.assertEqual(metrics.values["queries_total"], {(("operation", "create"),): 3})
+
+    def test_set(self):
+
+        metrics = relations_pymysql.Metrics()
+
+        metrics.set("connections", {}, 2)
+        metrics.set("connections", {}, 1)
+
+        self.assertEqual(metrics.values["connections"], {(): 1})
+
+    def test_observe(self):
+
+        metrics = relations_pymysql.Metrics(buckets=[0.1, 1])
+
+        metrics.observe("query_seconds", {"operation": "count"}, 0.05)
+        metrics.observe("query_seconds", {"operation": "count"}, 0.5)
+        metrics.observe("query_seconds", {"operation": "count"}, 5)
+
+        self.assertEqual(metrics.values["query_seconds"], {
+            (("operation", "count"),): {"buckets": [1, 2], "sum": 5.55, "count": 3}
+        })
+
+    def test_escape(self):
+
+        self.assertEqual(relations_pymysql.Metrics.escape('a\\b"c\nd'), 'a\\\\b\\"c\\nd')
+
+    def test_text(self):
+
+        metrics = relations_pymysql.Metrics(buckets=[1])
+
+        metrics.inc("queries_total", {"model": "Unit", "operation": "create"})
+        metrics.set("connections", {}, 1)
+        metrics.observe("query_seconds", {"operation": "create"}, 0.5)
+
+        text = metrics.text()
+
+        self.assertTrue(text.endswith("\n"))
+
+        lines = text.split("\n")
+
+        self.assertIn("# HELP relations_pymysql_queries_total Statements executed", lines)
+        self.assertIn("# TYPE relations_pymysql_queries_total counter", lines)
+        self.assertIn('relations_pymysql_queries_total{model="Unit",operation="create"} 1', lines)
+        self.assertIn("# TYPE relations_pymysql_connections gauge", lines)
+        self.assertIn("relations_pymysql_connections 1", lines)
+        self.assertIn("# TYPE relations_pymysql_query_seconds histogram", lines)
+        self.assertIn('relations_pymysql_query_seconds_bucket{operation="create",le="1"} 1', lines)
+        self.assertIn('relations_pymysql_query_seconds_bucket{operation="create",le="+Inf"} 1', lines)
+        self.assertIn('relations_pymysql_query_seconds_sum{operation="create"} 0.5', lines)
+        self.assertIn('relations_pymysql_query_seconds_count{operation="create"} 1', lines)
+
+
+class TestRow(unittest.TestCase):
+
+    def test_row(self):
+
+        index = {"id": 0, "name": 1}
+
+        row = relations_pymysql.Row(index, (1, "yep"))
+
+        self.assertEqual(row["name"], "yep")
+        self.assertEqual(row.get("id"), 1)
+        self.assertIsNone(row.get("nope"))
+        self.assertEqual(row.get("nope", 2), 2)
+        self.assertIn("id", row)
+        self.assertNotIn("nope", row)
+        self.assertEqual(len(row), 2)
+        self.assertEqual(list(row.keys()), ["id", "name"])
+        self.assertEqual(dict(row), {"id": 1, "name": "yep"})
+        self.assertRaises(KeyError, row.__getitem__, "nope")
+        self.assertRaises(AttributeError, setattr, row, "extra", True)
+
+
+class TestCompact(unittest.TestCase):
+
+    def setUp(self):
+
+        self.compact = relations_pymysql.Compact(["id", "name"], {"id": [1, 2, 3], "name": ["a", "b", "c"]})
+
+    def test___len__(self):
+
+        self.assertEqual(len(self.compact), 3)
+        self.assertEqual(len(relations_pymysql.Compact([], {})), 0)
+
+    def test___iter__(self):
+
+        self.assertEqual([row.name for row in self.compact], ["a", "b", "c"])
+
+    def test___getitem__(self):
+
+        self.assertEqual(self.compact["name"], ["a", "b", "c"])
+        self.assertEqual(self.compact[1].name, "b")
+        self.assertEqual(self.compact[-1].id, 3)
+        self.assertEqual([row.id for row in self.compact[1:]], [2, 3])
+        self.assertRaises(IndexError, self.compact.__getitem__, 3)
+
+    def test___getattr__(self):
+
+        self.assertEqual(self.compact.name, ["a", "b", "c"])
+
+        names = self.compact.name
+        names.append("d")
+        self.assertEqual(len(self.compact.name), 3)
+
+        self.assertRaisesRegex(AttributeError, "'Compact' object has no attribute 'nope'", getattr, self.compact, "nope")
+
+    def test_keys(self):
+
+        self.assertEqual(self.compact.keys(), ["id", "name"])
+
+    def test_export(self):
+
+        self.assertEqual(self.compact.export(), [
+            {"id": 1, "name": "a"},
+            {"id": 2, "name": "b"},
+            {"id": 3, "name": "c"}
+        ])
+
+
+class TestCompactRow(unittest.TestCase):
+
+    def setUp(self):
+
+        self.row = relations_pymysql.Compact(["id", "name"], {"id": [1, 2], "name": ["a", "b"]})[1]
+
+    def test___getattr__(self):
+
+        self.assertEqual(self.row.name, "b")
+        self.assertRaisesRegex(AttributeError, "'CompactRow' object has no attribute 'nope'", getattr, self.row, "nope")
+
+    def test___getitem__(self):
+
+        self.assertEqual(self.row["id"], 2)
+        self.assertRaises(KeyError, self.row.__getitem__, "nope")
+
+    def test___contains__(self):
+
+        self.assertIn("id", self.row)
+        self.assertNotIn("nope", self.row)
+
+    def test___setattr__(self):
+
+        self.assertRaisesRegex(AttributeError, "compact rows are read only", setattr, self.row, "name", "c")
+        self.assertRaisesRegex(AttributeError, "compact rows are read only", delattr, self.row, "name")
+
+    def test_export(self):
+
+        self.assertEqual(self.row.export(), {"id": 2, "name": "b"})
+        self.assertEqual(self.row.keys(), ["id", "name"])
+
+
+class TestColumn(unittest.TestCase):
+
+    def test___init__(self):
+
+        column = relations_pymysql.Column("id", int, [1, 2, 3])
+        self.assertEqual(column.values, array.array("q", [1, 2, 3]))
+        self.assertIsNone(column.nulls)
+
+        column = relations_pymysql.Column("spend", float, [1.5, None])
+        self.assertEqual(column.values, array.array("d", [1.5, 0]))
+        self.assertEqual(column.nulls, bytearray([0, 1]))
+
+        column = relations_pymysql.Column("name", str, ["a"])
+        self.assertEqual(column.values, ["a"])
+        self.assertIsNone(column.decoded)
+
+        column = relations_pymysql.Column("things", dict, ['{"a": 1}'])
+        self.assertEqual(column.decoded, {})
+
+    def test___getitem__(self):
+
+        column = relations_pymysql.Column("flag", bool, [1, 0, None])
+        self.assertIs(column[0], True)
+        self.assertIs(column[1], False)
+        self.assertIsNone(column[2])
+
+        column = relations_pymysql.Column("things", dict, ['{"a": 1}', None, '[1]'])
+        self.assertEqual(column.decoded, {})
+        self.assertEqual(column[-1], [1])
+        self.assertEqual(column.decoded, {2: [1]})
+        self.assertIs(column[2], column[-1])
+        self.assertIsNone(column[1])
+
+    def test___len__(self):
+
+        self.assertEqual(len(relations_pymysql.Column("id", int, [1, 2])), 2)
+
+    def test_tolist(self):
+
+        self.assertEqual(relations_pymysql.Column("id", int, [1, None]).tolist(), [1, None])
+        self.assertEqual(relations_pymysql.Column("stuff", list, ['[1]', None]).tolist(), [[1], None])
+
+
+class TestSplitter(unittest.TestCase):
+
+    def test_statement(self):
+
+        splitter = relations_pymysql.Splitter()
+        splitter.buffer = " SELECT 1 -- yep\n# nope\n"
+
+        self.assertEqual(splitter.statement(10), "SELECT 1")
+        self.assertEqual(splitter.statement(len(splitter.buffer)), "SELECT 1 -- yep\n# nope")
+
+        splitter.start = 10
+        self.assertIsNone(splitter.statement(len(splitter.buffer)))
+
+    def test_feed(self):
+
+        splitter = relations_pymysql.Splitter()
+
+        self.assertEqual(splitter.feed(
+            "CREATE TABLE `a;b` (x INT);\n"
+            "INSERT INTO `a;b` VALUES ('a;b'), (\"c;\\\"d\"), ('it\\'s;'), ('x''y;');\n"
+            "/* ; */ SELECT 1; -- ;\n"
+            "# ;\n"
+            "SELECT 2"
+        ), [
+            "CREATE TABLE `a;b` (x INT)",
+            "INSERT INTO `a;b` VALUES ('a;b'), (\"c;\\\"d\"), ('it\\'s;'), ('x''y;')",
+            "/* ; */ SELECT 1"
+        ])
+
+        self.assertEqual(splitter.end(), ["-- ;\n# ;\nSELECT 2"])
+
+        # a bit at a time is the same
+
+        text = "SELECT 'a;b'; SELECT 1 -- x;y\n; SELECT 2/* ; */;SELECT 3--;\n"
+
+        statements = []
+
+        for character in text:
+            statements.extend(splitter.feed(character))
+
+        self.assertEqual(statements, ["SELECT 'a;b'", "SELECT 1 -- x;y", "SELECT 2/* ; */", "SELECT 3--"])
+        self.assertEqual(splitter.end(), [])
+
+    def test_end(self):
+
+        splitter = relations_pymysql.Splitter()
+
+        self.assertEqual(splitter.feed("SELECT 'a;"), [])
+        self.assertEqual(splitter.end(), ["SELECT 'a;"])
+        self.assertEqual(splitter.buffer, "")
+
+        splitter.feed("SELECT 1; -- done")
+        self.assertEqual(splitter.end(), [])
+
+        # what DELIMITER set doesn't carry over
+
+        splitter.feed("DELIMITER $$\nSELECT 1")
+        self.assertEqual(splitter.end(), ["SELECT 1"])
+        self.assertEqual(splitter.delimiter, ";")
+
+    def test_delimit(self):
+
+        splitter = relations_pymysql.Splitter()
+
+        splitter.delimit("$$")
+
+        self.assertEqual(splitter.delimiter, "$$")
+        self.assertEqual(splitter.feed("SELECT 1; SELECT 2$$"), ["SELECT 1; SELECT 2"])
+
+    def test_keyword(self):
+
+        text = (
+            "CREATE DEFINER=`root`@`%` TRIGGER `t` BEFORE INSERT ON `unit` FOR EACH ROW\n"
+            "BEGIN\n"
+            "  IF NEW.name = 'a;b' THEN\n"
+            "    SET NEW.name = CASE WHEN 1 THEN 'c' ELSE 'd' END;\n"
+            "  END IF;\n"
+            "  CASE NEW.id WHEN 1 THEN SET NEW.name = 'e'; ELSE BEGIN END; END CASE;\n"
+            "  label: LOOP LEAVE label; END LOOP label;\n"
+            "END;\n"
+            "BEGIN;\n"
+            "SELECT CASE WHEN 1 THEN 2 END, `end`, begin_at FROM x;\n"
+            "DELIMITER $$\n"
+            "CREATE PROCEDURE p() BEGIN SELECT 1; END$$\n"
+            "DELIMITER ;\n"
+            "SELECT 3;\n"
+        )
+
+        expected = [
+            text[:text.index("END;\nBEGIN")] + "END",
+            "BEGIN",
+            "SELECT CASE WHEN 1 THEN 2 END, `end`, begin_at FROM x",
+            "CREATE PROCEDURE p() BEGIN SELECT 1; END",
+            "SELECT 3"
+        ]
+
+        splitter = relations_pymysql.Splitter()
+
+        self.assertEqual(splitter.feed(text), expected)
+        self.assertEqual(splitter.end(), [])
+
+        # a bit at a time is the same
+
+        statements = []
+
+        for character in text:
+            statements.extend(splitter.feed(character))
+
+        self.assertEqual(statements, expected)
+        self.assertEqual(splitter.end(), [])
+
+    def test_redelimit(self):
+
+        splitter = relations_pymysql.Splitter()
+
+        self.assertEqual(splitter.feed("-- switch\nDELIMITER //\nSELECT 1; SELECT 2//"), ["SELECT 1; SELECT 2"])
+        self.assertEqual(splitter.delimiter, "//")
+
+        # a DELIMITER that's not between statements is just a word
+
+        splitter.delimit(";")
+
+        self.assertEqual(splitter.feed("SELECT 1\nDELIMITER $$\n;"), ["SELECT 1\nDELIMITER $$"])
+        self.assertEqual(splitter.delimiter, ";")
+
+
+class TestDriver(unittest.TestCase):
+
+    def test_connect(self):
+
+        self.assertRaisesRegex(TypeError, "abstract", relations_pymysql.Driver)
+
+    def test_cursor(self):
+
+        connection = unittest.mock.MagicMock()
+
+        driver = relations_pymysql.PyMySQLDriver()
+
+        self.assertEqual(driver.cursor(connection), connection.cursor.return_value)
+        connection.cursor.assert_called_once_with()
+
+        driver.cursor(connection, tuples=True)
+        connection.cursor.assert_called_with(pymysql.cursors.Cursor)
+
+        driver.cursor(connection, stream=True)
+        connection.cursor.assert_called_with(pymysql.cursors.SSCursor)
+
+    def test_streaming(self):
+
+        driver = relations_pymysql.PyMySQLDriver()
+
+        self.assertTrue(driver.streaming(pymysql.cursors.SSCursor(unittest.mock.MagicMock())))
+        self.assertFalse(driver.streaming(pymysql.cursors.Cursor(unittest.mock.MagicMock())))
+
+    def test_code(self):
+
+        self.assertEqual(relations_pymysql.Driver.code(pymysql.err.OperationalError(1213, "Deadlock")), 1213)
+        self.assertIsNone(relations_pymysql.Driver.code(pymysql.err.OperationalError()))
+
+    def test_info(self):
+
+        self.assertIn("info", relations_pymysql.Driver.__abstractmethods__)
+
+
+class TestPyMySQLDriver(unittest.TestCase):
+
+    @unittest.mock.patch("pymysql.connect", unittest.mock.MagicMock())
+    def test_connect(self):
+
+        driver = relations_pymysql.PyMySQLDriver()
+
+        self.assertEqual(driver.connect(host="db.com"), pymysql.connect.return_value)
+        pymysql.connect.assert_called_once_with(cursorclass=pymysql.cursors.DictCursor, host="db.com")
+
+        self.assertEqual(driver.ERROR, pymysql.err.MySQLError)
+
+    def test_info(self):
+
+        cursor = unittest.mock.MagicMock()
+        cursor._result.message = b"Records: 3  Duplicates: 1  Warnings: 0"
+
+        self.assertEqual(relations_pymysql.PyMySQLDriver.info(cursor), "Records: 3  Duplicates: 1  Warnings: 0")
+
+        cursor._result.message = b""
+        self.assertEqual(relations_pymysql.PyMySQLDriver.info(cursor), "")
+
+        cursor._result = None
+        self.assertEqual(relations_pymysql.PyMySQLDriver.info(cursor), "")
+
+
+class TestMySQLdbDriver(unittest.TestCase):
+
+    @unittest.mock.patch("relations_pymysql.driver.MySQLdb", None)
+    def test___init__(self):
+
+        self.assertRaisesRegex(ImportError, "needs mysqlclient installed", relations_pymysql.MySQLdbDriver)
+
+    @unittest.mock.patch("relations_pymysql.driver.MySQLdb")
+    @unittest.mock.patch.object(relations_pymysql.MySQLdbDriver, "MULTI", 65536)
+    def test_connect(self, mock_mysqldb):
+
+        driver = relations_pymysql.MySQLdbDriver()
+
+        self.assertEqual(driver.connect(host="db.com"), mock_mysqldb.connect.return_value)
+        mock_mysqldb.connect.assert_called_once_with(
+            cursorclass=mock_mysqldb.cursors.DictCursor, host="db.com", charset="utf8mb4"
+        )
+        mock_mysqldb.connect.return_value.set_server_option.assert_called_once_with(1)
+
+        # only connections asking for stacked statements keep them
+
+        mock_mysqldb.connect.reset_mock()
+
+        driver.multi(host="db.com")
+        mock_mysqldb.connect.assert_called_once_with(
+            cursorclass=mock_mysqldb.cursors.DictCursor, host="db.com", charset="utf8mb4", client_flag=65536
+        )
+        mock_mysqldb.connect.return_value.set_server_option.assert_not_called()
+
+    def test_info(self):
+
+        cursor = unittest.mock.MagicMock()
+
+        cursor.connection.info.return_value = "Records: 3  Duplicates: 1  Warnings: 0"
+        self.assertEqual(relations_pymysql.MySQLdbDriver.info(cursor), "Records: 3  Duplicates: 1  Warnings: 0")
+
+        cursor.connection.info.return_value = None
+        self.assertEqual(relations_pymysql.MySQLdbDriver.info(cursor), "")
+
+
 class TestSource(unittest.TestCase):
 
     maxDiff = None
@@ -119,6 +747,11 @@ class TestSource(unittest.TestCase):
         cursor = self.source.connection.cursor()
         cursor.execute("DROP DATABASE IF EXISTS `test_source`")
 
+    @staticmethod
+    def configured(**settings):
+
+        return relations_pymysql.Source("PyMySQLSource", "test_source", host=os.environ["MYSQL_HOST"], port=int(os.environ["MYSQL_PORT"]), **settings)
+
     @unittest.mock.patch("relations.SOURCES", {})
     @unittest.mock.patch("pymysql.connect", unittest.mock.MagicMock())
     def test___init__(self):
@@ -138,6 +771,19 @@ class TestSource(unittest.TestCase):
         self.assertEqual(relations.SOURCES["test"], source)
         pymysql.connect.assert_called_once_with(cursorclass=pymysql.cursors.DictCursor, host="db.com", extra="stuff")
 
+    @unittest.mock.patch("relations.SOURCES", {})
+    @unittest.mock.patch("pymysql.connect", unittest.mock.MagicMock())
+    def test___init___driver(self):
+
+        source = relations_pymysql.Source("test", "init", host="db.com")
+        self.assertIsInstance(source.driver, relations_pymysql.PyMySQLDriver)
+
+        driver = unittest.mock.MagicMock()
+        source = relations_pymysql.Source("test", "init", driver=driver, host="db.com")
+        self.assertEqual(source.driver, driver)
+        self.assertEqual(source.connection, driver.connect.return_value)
+        driver.connect.assert_called_once_with(host="db.com")
+
     @unittest.mock.patch("relations.SOURCES", {})
     @unittest.mock.patch("pymysql.connect", unittest.mock.MagicMock())
     def test___getattr__(self):
@@ -171,18 +817,1253 @@ class TestSource(unittest.TestCase):
         del relations.SOURCES["test"]
         pymysql.connect.return_value.close.assert_called_once_with()
 
-    def test_execute(self):
-
-        self.source.execute("")
+    def test_snapshot(self):
 
-        self.source.execute(relations_sql.SQL("""CREATE TABLE IF NOT EXISTS `test_source`.`simple` (
-  `id` BIGINT AUTO_INCREMENT,
-  `name` VARCHAR(255) NOT NULL,
-  PRIMARY KEY (`id`),
-  UNIQUE `name` (`name`)
-);"""))
+        simple = Simple("sure")
+        simple.plain.add("fine")
 
-        cursor = self.source.connection.cursor()
+        snapshot = self.source.snapshot(simple)
+
+        self.source.execute(Simple.define())
+        self.source.execute(Plain.define())
+
+        simple.create()
+
+        self.assertEqual(simple.id, 1)
+        self.assertEqual(simple._action, "update")
+        self.assertEqual(simple.plain[0]._action, "update")
+
+        self.source.restore(snapshot)
+
+        self.assertIsNone(simple.id)
+        self.assertEqual(simple._action, "create")
+        self.assertEqual(simple._record._action, "create")
+        self.assertEqual(simple.plain[0]._action, "create")
+
+    @unittest.mock.patch("time.sleep")
+    def test_retry(self, mock_sleep):
+
+        work = unittest.mock.MagicMock(side_effect=[pymysql.err.OperationalError(1213, "Deadlock found"), "done"])
+
+        self.assertEqual(self.source.retry(work, "unit"), "done")
+        work.assert_has_calls([unittest.mock.call("unit"), unittest.mock.call("unit")])
+        mock_sleep.assert_called_once()
+        self.assertLessEqual(mock_sleep.call_args[0][0], self.source.retry_delay)
+        self.assertEqual(self.source.retries, {
+            "attempts": 2,
+            "retried": 1,
+            "recovered": 1,
+            "exhausted": 0,
+            "codes": {1213: 1}
+        })
+
+        work = unittest.mock.MagicMock(side_effect=pymysql.err.OperationalError(1205, "Lock wait timeout exceeded"))
+
+        self.assertRaisesRegex(pymysql.err.OperationalError, "Lock wait timeout", self.source.retry, work)
+        self.assertEqual(work.call_count, 3)
+        self.assertEqual(self.source.retries["exhausted"], 1)
+        self.assertEqual(self.source.retries["codes"], {1213: 1, 1205: 3})
+
+        work = unittest.mock.MagicMock(side_effect=pymysql.err.ProgrammingError(1064, "You have an error"))
+
+        self.assertRaisesRegex(pymysql.err.ProgrammingError, "You have an error", self.source.retry, work)
+        self.assertEqual(work.call_count, 1)
+
+        self.source.execute(Unit.define())
+        self.source.execute(Test.define())
+
+        unit = Unit("people")
+        unit.test.add("stuff")
+
+        create_id = self.source.create_id
+        deadlocks = [pymysql.err.OperationalError(1213, "Deadlock found")]
+
+        def deadlock(cursor, model, query):
+
+            if model.NAME == "test" and deadlocks:
+                raise deadlocks.pop()
+
+            create_id(cursor, model, query)
+
+        with unittest.mock.patch.object(self.source, "create_id", deadlock):
+            unit.create()
+
+        self.assertEqual(Unit.many().name, ["people"])
+        self.assertEqual(Test.many().name, ["stuff"])
+        self.assertEqual(unit.test[0].unit_id, unit.id)
+
+        # Earlier writes not yet committed would be rolled back too, so they're not replayed
+
+        self.assertTrue(self.source.pending())
+
+        work = unittest.mock.MagicMock(side_effect=[pymysql.err.OperationalError(1213, "Deadlock found"), "done"])
+
+        self.assertRaisesRegex(pymysql.err.OperationalError, "Deadlock found", self.source.retry, work)
+        self.assertEqual(work.call_count, 1)
+
+        self.source.commit()
+        self.assertFalse(self.source.pending())
+
+        work = unittest.mock.MagicMock(side_effect=[pymysql.err.OperationalError(1213, "Deadlock found"), "done"])
+
+        self.assertEqual(self.source.retry(work), "done")
+        self.assertEqual(work.call_count, 2)
+
+    @unittest.mock.patch("time.sleep", unittest.mock.MagicMock())
+    def test_retry_autocommit(self):
+
+        self.source.execute(Unit.define())
+        self.source.execute(Test.define())
+        self.source.connection.autocommit(True)
+
+        create_id = self.source.create_id
+        failures = [pymysql.err.OperationalError(1213, "Deadlock found")]
+
+        def fail(cursor, model, query):
+
+            if model.NAME == "test" and failures:
+                raise failures.pop()
+
+            create_id(cursor, model, query)
+
+        # The parent's rolled back with the deadlocked child, so the replay doesn't write it twice
+
+        unit = Unit("people")
+        unit.test.add("stuff")
+
+        with unittest.mock.patch.object(self.source, "create_id", fail):
+            unit.create()
+
+        self.assertEqual(Unit.many().name, ["people"])
+        self.assertEqual(Test.many().name, ["stuff"])
+        self.assertEqual(self.source.retries["recovered"], 1)
+
+        # Nor is it left written when the child fails for good
+
+        failures.append(pymysql.err.ProgrammingError(1064, "You have an error"))
+
+        unit = Unit("things")
+        unit.test.add("nope")
+
+        with unittest.mock.patch.object(self.source, "create_id", fail):
+            self.assertRaisesRegex(pymysql.err.ProgrammingError, "You have an error", unit.create)
+
+        self.assertEqual(Unit.many().name, ["people"])
+        self.assertEqual(Test.many().name, ["stuff"])
+
+        self.source.connection.autocommit(False)
+
+    def test_pending(self):
+
+        self.source.execute(Unit.define())
+
+        self.assertFalse(self.source.pending())
+
+        Unit("people").create()
+        self.assertTrue(self.source.pending())
+
+        Unit.many().retrieve()
+        self.assertTrue(self.source.pending())
+
+        self.source.commit()
+        self.assertFalse(self.source.pending())
+
+        with self.source.transaction():
+            Unit("stuff").create()
+
+        self.assertFalse(self.source.pending())
+
+        self.source.connection.autocommit(True)
+        Unit("things").create()
+        self.assertFalse(self.source.pending())
+        self.source.connection.autocommit(False)
+
+    def test_hook(self):
+
+        before = unittest.mock.MagicMock()
+        after = unittest.mock.MagicMock()
+
+        self.source.hook(before=before)
+        self.source.hook(after=after)
+
+        self.assertEqual(self.source.hooks, {"before": [before], "after": [after]})
+
+    def test_cursor_execute(self):
+
+        self.source.execute(Unit.define())
+
+        events = []
+
+        def before(event):
+            events.append(("before", dict(event)))
+
+        def after(event):
+            events.append(("after", dict(event)))
+
+        self.source.hook(before, after)
+
+        Unit("people").create()
+
+        (when, started), (_, event) = events
+
+        self.assertEqual(when, "before")
+        self.assertEqual(started["model"], Unit)
+        self.assertEqual(started["operation"], "create")
+        self.assertEqual(started["sql"], "INSERT INTO `test_source`.`unit` (`name`) VALUES (%s)")
+        self.assertEqual(started["args"], 1)
+        self.assertIsNone(started["rows"])
+        self.assertEqual(started["connection"], self.source.connection.thread_id())
+
+        self.assertEqual(event["rows"], 1)
+        self.assertGreaterEqual(event["seconds"], 0)
+        self.assertNotIn("error", event)
+
+        events.clear()
+
+        self.assertEqual(Unit.many().count(), 1)
+        self.assertEqual(events[-1][1]["operation"], "count")
+        self.assertEqual(events[-1][1]["model"], Unit)
+
+        events.clear()
+
+        cursor = self.source.connection.cursor()
+
+        self.assertRaises(pymysql.err.ProgrammingError, self.source.cursor_execute, cursor, "SELECT nope FROM nowhere")
+
+        self.assertIsNone(events[-1][1]["model"])
+        self.assertIsInstance(events[-1][1]["error"], pymysql.err.ProgrammingError)
+
+        cursor.close()
+
+    def test_timeout(self):
+
+        self.assertNotIn("read_timeout", self.source.kwargs)
+
+        source = self.configured(timeout=0.5, timeouts={"count": 5})
+
+        self.assertEqual(source.kwargs["read_timeout"], 6)
+        self.assertNotIn("read_timeout", source.untimed_kwargs)
+
+        source.execute(Unit.define())
+
+        sqls = []
+        source.hook(lambda event: sqls.append(event["sql"]))
+
+        Unit("people").create()
+        Unit.many().retrieve()
+        Unit.many().count()
+
+        self.assertEqual(sqls[0], "INSERT INTO `test_source`.`unit` (`name`) VALUES (%s)")
+        self.assertTrue(sqls[1].startswith("SELECT /*+ MAX_EXECUTION_TIME(500) */ * FROM"))
+        self.assertTrue(sqls[2].startswith("SELECT /*+ MAX_EXECUTION_TIME(5000) */ COUNT(*)"))
+
+        cursor = source.connection.cursor()
+
+        start = time.time()
+        source.cursor_execute(cursor, "SELECT SLEEP(3) AS `slept`")
+        self.assertEqual(cursor.fetchone()["slept"], 1)
+        self.assertLess(time.time() - start, 2)
+
+        cursor.close()
+
+    def test_untimed(self):
+
+        with self.source.untimed():
+            self.assertIs(self.source.connection, self.source.connections[threading.get_ident()])
+
+        source = self.configured(timeout=1, read_timeout=1)
+
+        self.assertIsNone(source.untimed_kwargs)
+
+        source = self.configured(timeout=0.5)
+
+        connection = source.connection
+
+        # statements that aren't SELECTs can run past the read timeout
+
+        with source.untimed():
+            self.assertIsNot(source.connection, connection)
+            cursor = source.connection.cursor()
+            source.cursor_execute(cursor, "DO SLEEP(3)", operation="execute")
+            cursor.close()
+
+        self.assertIs(source.connection, connection)
+
+        source.execute("DO SLEEP(3)")
+
+    def test_untimed_reuse(self):
+
+        self.source.execute(Unit.define())
+
+        source = self.configured(timeout=0.5, metrics=True)
+
+        # each thread opens one untimed connection and keeps it
+
+        with source.untimed():
+            untimed = source.connection
+
+        with source.untimed():
+            self.assertIs(source.connection, untimed)
+
+        self.assertEqual(source.untimeds, {threading.get_ident(): untimed})
+        self.assertIn('relations_pymysql_connections_opened_total{purpose="execute"} 1', source.metrics_text().split("\n"))
+
+        # only what's pending is committed first
+
+        with unittest.mock.patch.object(source, "commit", wraps=source.commit) as commit:
+
+            with source.untimed():
+                pass
+
+            commit.assert_not_called()
+
+            Unit("people").create()
+
+            with source.untimed():
+                pass
+
+            commit.assert_called_once_with()
+
+        self.assertEqual(Unit.many().name, ["people"])
+
+        source.close()
+
+        self.assertEqual(source.untimeds, {})
+
+    def test_running(self):
+
+        self.assertEqual(self.source.running(), [])
+
+        started = threading.Event()
+
+        def sleep(event):
+            if event["sql"].startswith("SELECT SLEEP"):
+                started.set()
+
+        self.source.hook(sleep)
+
+        def query():
+            cursor = self.source.connection.cursor()
+            self.source.cursor_execute(cursor, "SELECT SLEEP(1)")
+            cursor.close()
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        started.wait()
+        time.sleep(0.1)
+
+        running = self.source.running()
+
+        self.assertEqual(len(running), 1)
+        self.assertEqual(running[0]["thread"], thread.ident)
+        self.assertEqual(running[0]["sql"], "SELECT SLEEP(1)")
+        self.assertGreater(running[0]["seconds"], 0)
+        self.assertEqual(self.source.running(slower=60), [])
+
+        thread.join()
+
+        self.assertEqual(self.source.running(), [])
+
+    def test_cancel(self):
+
+        self.assertRaisesRegex(ValueError, "need a thread or how many seconds slower", self.source.cancel)
+        self.assertEqual(self.source.cancel(slower=0), 0)
+        self.assertIsNone(self.source.canceller)
+
+        started = threading.Event()
+        slept = []
+
+        def sleep(event):
+            if event["sql"].startswith("SELECT SLEEP"):
+                started.set()
+
+        self.source.hook(sleep)
+
+        def query():
+            cursor = self.source.connection.cursor()
+            start = time.time()
+            self.source.cursor_execute(cursor, "SELECT SLEEP(5) AS `slept`")
+            slept.append((cursor.fetchone()["slept"], time.time() - start))
+            cursor.close()
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        started.wait()
+        time.sleep(0.1)
+
+        self.assertEqual(self.source.cancel(thread=threading.get_ident()), 0)
+        self.assertEqual(self.source.cancel(slower=60), 0)
+        self.assertEqual(self.source.cancel(slower=0), 1)
+
+        thread.join()
+
+        self.assertEqual(slept[0][0], 1)
+        self.assertLess(slept[0][1], 5)
+
+        self.assertIsNotNone(self.source.canceller)
+        self.source.close()
+        self.assertIsNone(self.source.canceller)
+
+    def test_criteria(self):
+
+        self.assertIsNone(self.source.criteria(None))
+
+        self.assertEqual(self.source.criteria(Unit.many(name__in=["people"], id__gt=1)), {
+            "id": ["gt"],
+            "name": ["in"]
+        })
+
+        self.assertEqual(self.source.criteria(Net.many(like="1.2")), {"like": True})
+
+    def test_explain(self):
+
+        self.source.execute(Unit.define())
+
+        plan = self.source.explain("SELECT * FROM `test_source`.`unit` WHERE `id`=%s", (1,))
+        self.assertIn("query_block", plan)
+        self.assertIsNotNone(self.source.explainer)
+
+        self.assertIn("error", self.source.explain("SELECT * FROM nowhere", ()))
+
+        self.source.close()
+        self.assertIsNone(self.source.explainer)
+
+    def test_explain_lock(self):
+
+        self.source.execute(Unit.define())
+
+        # EXPLAIN only waits on its own connection, not on what the rest of the Source locks
+
+        plans = []
+
+        with self.source.lock:
+            thread = threading.Thread(target=lambda: plans.append(self.source.explain("SELECT * FROM `test_source`.`unit`", ())))
+            thread.start()
+            thread.join(5)
+
+        self.assertEqual(len(plans), 1)
+        self.assertIn("query_block", plans[0])
+
+        self.source.close()
+
+    def test_slow_queries(self):
+
+        self.assertEqual(self.source.slow_queries(), [])
+
+        source = self.configured(slow_log=0, slow_log_size=2)
+
+        self.assertNotIn("slow_log", source.kwargs)
+
+        source.execute(Unit.define())
+
+        Unit("people").create()
+        Unit.one(name="people").retrieve()
+
+        entries = source.slow_queries()
+
+        self.assertEqual(len(entries), 2)
+
+        create, retrieve = entries
+
+        self.assertEqual(create["model"], "Unit")
+        self.assertEqual(create["operation"], "create")
+        self.assertEqual(create["criteria"], {})
+        self.assertIsNone(create["plan"])
+
+        self.assertEqual(retrieve["operation"], "retrieve")
+        self.assertEqual(retrieve["criteria"], {"name": ["eq"]})
+        self.assertEqual(retrieve["args"], 1)
+        self.assertEqual(retrieve["rows"], 1)
+        self.assertIn("query_block", retrieve["plan"])
+
+        self.assertEqual(len(source.slow_queries(clear=True)), 2)
+        self.assertEqual(source.slow_queries(), [])
+
+        # only a sample is explained
+
+        source.slow_log_sample = 0
+
+        Unit.many().retrieve()
+
+        self.assertIsNone(source.slow_queries()[-1]["plan"])
+
+        source.close()
+
+    def test_shape(self):
+
+        self.assertEqual(self.source.shape(Unit.many(name="people")), (("name",), (), ()))
+        self.assertEqual(self.source.shape(Test.many(unit_id=1, name__gt="b")), (("unit_id",), ("name",), ("name",)))
+        self.assertEqual(self.source.shape(Test.many(name="x").sort("-id")), (("name",), (), ("id",)))
+        self.assertEqual(self.source.shape(Net.many(ip__value__gte=3).sort("ip__value")), ((), ("ip__value",), ("ip__value",)))
+        self.assertEqual(self.source.shape(Meta.many(flag__not_eq=True, things__a__b="x", like="y").sort("name")), ((), (), ("name",)))
+
+    def test_indexed(self):
+
+        self.assertEqual(self.source.indexed(Test.thy().define()), [["id"], ["unit_id", "name", "id"]])
+        self.assertEqual(self.source.indexed({"unique": {"a": ["a"]}}), [["a"]])
+
+    def test_covers(self):
+
+        self.assertTrue(self.source.covers(["b", "a", "c"], ("a", "b"), ("c",)))
+        self.assertTrue(self.source.covers(["a", "c", "d"], ("a",), ("c",)))
+        self.assertFalse(self.source.covers(["a", "d", "c"], ("a",), ("c",)))
+        self.assertFalse(self.source.covers(["a"], ("a",), ("c",)))
+
+    def test_advice_candidates(self):
+
+        definitions = {("s", "t"): {"index": {"a": ["a"]}}}
+
+        self.assertEqual(self.source.advice_candidates([
+            ((("s", "t"), ("a",), (), ()), 5),
+            ((("s", "t"), ("b",), ("c",), ("d",)), 2),
+            ((("s", "t"), ("b",), (), ("c", "e")), 1)
+        ], definitions), {
+            (("s", "t"), ("b",), ("c",)): {"queries": 2, "shapes": 1},
+            (("s", "t"), ("b",), ("c", "e")): {"queries": 1, "shapes": 1}
+        })
+
+    def test_advice_fold(self):
+
+        self.assertEqual(self.source.advice_fold({
+            (("s", "t"), ("b",), ("c",)): {"queries": 2, "shapes": 1},
+            (("s", "t"), ("b",), ("c", "e")): {"queries": 1, "shapes": 1},
+            (("s", "t"), ("f",), ("c",)): {"queries": 1, "shapes": 1}
+        }), {
+            (("s", "t"), ("b",), ("c",)): {"queries": 0, "shapes": 1},
+            (("s", "t"), ("b",), ("c", "e")): {"queries": 3, "shapes": 2},
+            (("s", "t"), ("f",), ("c",)): {"queries": 1, "shapes": 1}
+        })
+
+    def test_advice(self):
+
+        self.assertEqual(self.source.advice(), [])
+
+        source = self.configured(advise=True)
+
+        source.execute(Unit.define())
+        source.execute(Test.define())
+
+        Unit.many(name="people").retrieve()
+        Test.many(unit_id=1).sort("name").retrieve()
+        Test.many(name="x").count()
+        Test.many(name="x").sort("unit_id").retrieve()
+        Test.many(name="y").sort("unit_id").retrieve()
+
+        self.assertEqual(source.advice(), [
+            {"schema": "test_source", "store": "test", "name": "name-unit_id", "columns": ["name", "unit_id"], "queries": 3, "shapes": 2}
+        ])
+
+        self.assertEqual(source.advice(threshold=4), [])
+
+        self.assertEqual(source.advice_migration(), {
+            "change": {
+                "test": {
+                    "definition": Test.thy().define(),
+                    "migration": {"index": {"add": {"name-unit_id": ["name", "unit_id"]}}}
+                }
+            }
+        })
+
+        change = source.advice_migration()["change"]["test"]
+        source.execute(source.define(change["migration"], change["definition"]))
+
+        cursor = source.connection.cursor()
+        cursor.execute("SHOW INDEX FROM `test_source`.`test` WHERE `Key_name`='name_unit_id'")
+        self.assertEqual([row["Column_name"] for row in cursor.fetchall()], ["name", "unit_id"])
+        cursor.close()
+
+    def test_budget(self):
+
+        source = self.configured(query_budget=3, query_budget_repeats=2)
+
+        self.assertNotIn("query_budget", source.kwargs)
+
+        source.execute(Unit.define())
+        source.execute(Test.define())
+
+        # within budget
+
+        unit = Unit("people")
+        unit.test.add("stuff")
+        unit.test.add("things")
+        unit.create()
+
+        self.assertEqual(Unit.one().test.name, ["stuff", "things"])
+
+        # the same statement shape too many times
+
+        unit = Unit("stuff")
+        unit.test.add("a")
+        unit.test.add("b")
+        unit.test.add("c")
+
+        self.assertRaisesRegex(
+            relations.ModelError, "unit: create 3 times over 2 running INSERT INTO `test_source`.`test`", unit.create
+        )
+
+        self.assertIsNone(source.local.budget)
+
+        # too many statements
+
+        source.query_budget_repeats = 10
+
+        unit = Unit("things")
+        unit.test.add("a")
+        unit.test.add("b")
+        unit.test.add("c")
+
+        self.assertRaisesRegex(relations.ModelError, "unit: create 4 statements over budget of 3", unit.create)
+
+        # logged instead
+
+        source.query_budget_raise = False
+
+        with self.assertLogs("relations_pymysql", level="WARNING") as logs:
+            self.assertEqual(Unit.many().count(), 3)
+            unit = Unit("moar")
+            unit.test.add("a")
+            unit.test.add("b")
+            unit.test.add("c")
+            unit.create()
+
+        self.assertEqual(logs.output, ["WARNING:relations_pymysql:Unit: create 4 statements over budget of 3"])
+
+    def test_metrics_text(self):
+
+        self.assertIsNone(self.source.metrics_text())
+
+        source = self.configured(metrics=True, cache=True)
+
+        self.assertNotIn("metrics", source.kwargs)
+
+        source.execute(Meta.define())
+
+        Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+        Meta("sure", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+
+        self.assertEqual(Meta.many().count(), 2)
+        self.assertEqual(len(Meta.many()), 2)
+
+        # streamed rows count as they're fetched, not by the cursor's rowcount
+
+        self.assertEqual(len(list(source.columns(Meta.many(), chunk=1))), 2)
+
+        lines = source.metrics_text().split("\n")
+
+        self.assertIn('relations_pymysql_queries_total{model="Meta",operation="create"} 2', lines)
+        self.assertIn('relations_pymysql_queries_total{model="Meta",operation="count"} 1', lines)
+        self.assertIn('relations_pymysql_queries_total{model="Meta",operation="retrieve"} 2', lines)
+        self.assertIn('relations_pymysql_queries_total{model="",operation="execute"} 1', lines)
+        self.assertIn('relations_pymysql_rows_written_total{model="Meta",operation="create"} 2', lines)
+        self.assertIn('relations_pymysql_rows_read_total{model="Meta"} 5', lines)
+        self.assertIn('relations_pymysql_decode_seconds_count{model="Meta"} 1', lines)
+        self.assertIn('relations_pymysql_connections_opened_total{purpose="query"} 1', lines)
+        self.assertIn("relations_pymysql_connections 1", lines)
+        self.assertIn('relations_pymysql_cache{cache="results",stat="misses"} 2', lines)
+        self.assertIn('relations_pymysql_retries{stat="attempts"} 2', lines)
+
+        # reaped connections from dead threads count as closed
+
+        for _ in range(2):
+            thread = threading.Thread(target=lambda: source.connection)
+            thread.start()
+            thread.join()
+
+        source.close()
+
+        lines = source.metrics_text().split("\n")
+
+        self.assertIn('relations_pymysql_connections_opened_total{purpose="query"} 3', lines)
+        self.assertIn('relations_pymysql_connections_closed_total{reason="reaped"} 1', lines)
+        self.assertIn('relations_pymysql_connections_closed_total{reason="closed"} 2', lines)
+        self.assertIn("relations_pymysql_connections 0", lines)
+
+    def test_metrics_caches(self):
+
+        source = self.configured(metrics=True, count_cache_ttl=60, titles_cache=True)
+
+        source.execute(Unit.define())
+
+        Unit([["stuff"], ["people"]]).create()
+
+        for _ in range(2):
+            self.assertEqual(Unit.many().count(), 2)
+            self.assertEqual(Unit.many().titles().ids, [2, 1])
+
+        lines = source.metrics_text().split("\n")
+
+        self.assertIn('relations_pymysql_cache{cache="counts",stat="hits"} 1', lines)
+        self.assertIn('relations_pymysql_cache{cache="counts",stat="misses"} 1', lines)
+        self.assertIn('relations_pymysql_cache{cache="titled",stat="hits"} 1', lines)
+        self.assertIn('relations_pymysql_cache{cache="titled",stat="entries"} 1', lines)
+        self.assertEqual([line for line in lines if 'cache="results"' in line], [])
+
+        source.close()
+
+    def test_profiled(self):
+
+        self.assertEqual(self.source.profiled(), {})
+
+        source = self.configured(profile=True)
+
+        self.assertNotIn("profile", source.kwargs)
+
+        source.execute(Sis.define())
+        source.execute(Bro.define())
+        source.execute(SisBro.define())
+
+        tom = Bro("Tom").create()
+        Sis("Mary", bro_id=[tom.id]).create()
+
+        self.assertEqual(Sis.many().count(), 1)
+        self.assertEqual(Sis.one().bro_id, [tom.id])
+
+        profiles = source.profiled(clear=True)
+
+        self.assertEqual(set(profiles), {"", "Sis", "Bro", "SisBro"})
+        self.assertEqual(set(profiles["Sis"]), {"create", "count", "retrieve"})
+        self.assertEqual(set(profiles["Sis"]["create"]), {"build", "execute", "ties"})
+        self.assertEqual(set(profiles["Sis"]["count"]), {"build", "execute", "fetch"})
+        self.assertEqual(set(profiles["Sis"]["retrieve"]), {"build", "execute", "fetch", "decode", "models", "ties"})
+        self.assertEqual(profiles["Sis"]["retrieve"]["decode"]["calls"], 1)
+        self.assertGreaterEqual(profiles["Sis"]["retrieve"]["ties"]["seconds"], 0)
+        self.assertEqual(profiles["SisBro"]["create"]["execute"]["calls"], 1)
+        self.assertEqual(profiles[""]["execute"]["execute"]["calls"], 3)
+
+        self.assertEqual(source.profiled(), {})
+
+        Sis.one().set(bro_id=[]).update()
+        Sis.many().delete()
+
+        profiles = source.profiled()
+
+        self.assertIn("ties", profiles["Sis"]["update"])
+        self.assertIn("ties", profiles["Sis"]["delete"])
+
+    @unittest.skipIf(relations_pymysql.driver.MySQLdb is None, "mysqlclient not installed")
+    def test_driver(self):
+
+        source = self.configured(driver="mysqldb")
+
+        self.assertNotIn("driver", source.kwargs)
+
+        source.execute(Meta.define())
+
+        yep = Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+        self.assertEqual(yep.id, 1)
+
+        meta = Meta.one(name="yep")
+        self.assertEqual(meta.people, {"tom"})
+        self.assertEqual(meta.things, {"a": 1})
+
+        self.assertEqual(Meta.many().set(flag=False).update(), 1)
+        self.assertEqual(Meta.many().set(flag=False).update(), 0)
+
+        self.assertRaises(source.driver.ERROR, source.execute, "SELECT nope FROM nowhere")
+
+        source.close()
+
+    def test_batch(self):
+
+        self.assertIsNone(self.source.batch())
+
+        with self.source.transaction() as batch:
+            self.assertEqual(self.source.batch(), batch)
+
+        self.assertIsNone(self.source.batch())
+
+    def test_transaction(self):
+
+        self.source.execute(Sis.define())
+        self.source.execute(Bro.define())
+        self.source.execute(SisBro.define())
+
+        tom = Bro("Tom").create()
+        dick = Bro("Dick").create()
+
+        with self.source.transaction() as batch:
+
+            mary = Sis("Mary", bro_id=[tom.id, dick.id]).create()
+
+            # tie inserts wait and merge
+
+            self.assertEqual(len(batch), 1)
+            self.assertEqual(len(batch.writes[0]["rows"]), 2)
+
+            # creating with an auto id runs now, so everything waiting goes first
+
+            sue = Sis("Sue", bro_id=[tom.id]).create()
+
+            self.assertEqual(len(batch), 1)
+            self.assertEqual(len(batch.writes[0]["rows"]), 1)
+
+            # reads through ties see the ties waiting
+
+            self.assertEqual(Sis.many(bro_id=[tom.id]).count(), 2)
+            self.assertEqual(len(batch), 0)
+
+            mary.bro_id = [dick.id]
+            sue.bro_id = [dick.id]
+            mary.update()
+            sue.update()
+
+            # reading the ties flushes them first
+
+            self.assertEqual(Sis.one(name="Mary").bro.id, [dick.id])
+            self.assertEqual(len(batch), 0)
+
+        self.assertEqual(SisBro.many().count(), 2)
+
+        def fail():
+
+            with self.source.transaction():
+                Sis("Ann", bro_id=[tom.id]).create()
+                raise Exception("nope")
+
+        self.assertRaisesRegex(Exception, "nope", fail)
+        self.assertIsNone(self.source.batch())
+        self.assertEqual(Sis.many(name="Ann").count(), 0)
+        self.assertEqual(SisBro.many().count(), 2)
+
+    def test_identities(self):
+
+        self.assertIsNone(self.source.identities())
+
+        with self.source.session() as identities:
+            self.assertEqual(self.source.identities(), identities)
+
+        self.assertIsNone(self.source.identities())
+
+    def test_session(self):
+
+        self.source.execute(Unit.define())
+        self.source.execute(Test.define())
+
+        Unit([["people"], ["stuff"]]).create()
+        Test([[1, "moar"], [1, "less"]]).create()
+
+        with self.source.session() as identities:
+
+            with unittest.mock.patch.object(self.source, "fetch", wraps=self.source.fetch) as fetch:
+
+                self.assertEqual(Unit.one(1).name, "people")
+                self.assertEqual(Unit.one(1).name, "people")
+                self.assertEqual(fetch.call_count, 1)
+
+                # parent walks are served from memory too
+
+                self.assertEqual(Test.many().unit_id, [1, 1])
+                self.assertEqual(fetch.call_count, 2)
+
+                for test in Test.many():
+                    self.assertEqual(test.unit.name, "people")
+
+                self.assertEqual(fetch.call_count, 3)
+
+                # only the missing ids are queried, in the order asked for
+
+                self.assertEqual(Unit.many(id__in=[2, 1]).sort("-name").name, ["stuff", "people"])
+                self.assertEqual(fetch.call_count, 4)
+
+                query = fetch.call_args[0][1]
+                self.assertEqual(query.args, [2])
+
+                self.assertEqual(Unit.many(id__in=[2, 1]).name, ["people", "stuff"])
+                self.assertEqual(fetch.call_count, 4)
+
+                # writes forget what was read
+
+                Unit.one(2).set(name="things").update()
+                self.assertNotIn(("test_source", "unit"), identities)
+
+                self.assertEqual(Unit.one(2).name, "things")
+                self.assertEqual(fetch.call_count, 5)
+
+                # models don't share values
+
+                unit = Unit.one(2)
+                unit.name = "changed"
+                self.assertEqual(Unit.one(2).name, "things")
+
+        self.assertIsNone(self.source.identities())
+
+    def test_identity_narrowed(self):
+
+        self.assertFalse(self.source.identity_narrowed(Unit.many(id=1)))
+        self.assertTrue(self.source.identity_narrowed(Unit.many(id=1, like="p")))
+        self.assertTrue(self.source.identity_narrowed(Unit.many(id=1).limit(1)))
+        self.assertTrue(self.source.identity_narrowed(Unit.many(id=1).limit(1, 1)))
+
+    def test_identity_related(self):
+
+        self.assertFalse(self.source.identity_related(Unit.many(id=1)))
+        self.assertTrue(self.source.identity_related(Unit.many(id=1, test__name="moar")))
+
+    def test_identity_sorting(self):
+
+        class Label(SourceModel):
+            id = int
+            name = str, {"store": "label"}
+
+        self.assertEqual(self.source.identity_sorting(Unit.many()), [("name", False)])
+        self.assertEqual(self.source.identity_sorting(Label.many().sort("-name", "id")), [("label", True), ("id", False)])
+        self.assertIsNone(self.source.identity_sorting(Meta.many().sort("things__for__0____1")))
+        self.assertIsNone(self.source.identity_sorting(Meta.many().sort("push")))
+
+    def test_identity_ids(self):
+
+        self.assertEqual(self.source.identity_ids(Unit.one(1)), [1])
+        self.assertEqual(self.source.identity_ids(Unit.many(id__in=[1, 2])), [1, 2])
+        self.assertIsNone(self.source.identity_ids(Unit.many()))
+        self.assertIsNone(self.source.identity_ids(Unit.many(id__gt=1)))
+        self.assertIsNone(self.source.identity_ids(Unit.many(id=1, name="people")))
+        self.assertIsNone(self.source.identity_ids(Unit.many(id=1, like="p")))
+        self.assertIsNone(self.source.identity_ids(Unit.many(id=1).limit(1)))
+        self.assertIsNone(self.source.identity_ids(Unit.many(id=1, test__name="moar")))
+        self.assertIsNone(self.source.identity_ids(Plain.many()))
+
+    def test_identity_retrieve(self):
+
+        self.source.execute(Unit.define())
+
+        Unit([["people"], ["stuff"]]).create()
+
+        cursor = self.source.connection.cursor()
+
+        self.assertIsNone(self.source.identity_retrieve(cursor, Unit.many()))
+
+        with self.source.session() as identities:
+
+            self.assertEqual(self.source.identity_retrieve(cursor, Unit.many(id__in=[2, 3])), [{"id": 2, "name": "stuff"}])
+            self.assertEqual(identities, {("test_source", "unit"): {2: {"id": 2, "name": "stuff"}}})
+
+            self.assertEqual(self.source.identity_retrieve(cursor, Unit.many(id__in=[1, 2]).sort("-name")), [
+                {"id": 2, "name": "stuff"},
+                {"id": 1, "name": "people"}
+            ])
+
+        cursor.close()
+
+    def test_commit(self):
+
+        with unittest.mock.patch.object(self.source.connection, "commit") as mock_commit:
+
+            self.source.commit()
+            mock_commit.assert_called_once_with()
+
+            self.source.local.batch = relations_pymysql.Batch()
+            self.source.commit()
+            mock_commit.assert_called_once_with()
+
+            self.source.local.batch = None
+
+    def test_flush(self):
+
+        self.source.execute(Sis.define())
+        self.source.execute(Bro.define())
+        self.source.execute(SisBro.define())
+
+        with self.source.transaction() as batch:
+
+            sis = Sis("Sally").create()
+            SisBro([{"bro_id": 1, "sis_id": sis.id}, {"bro_id": 2, "sis_id": sis.id}]).create()
+
+            self.assertEqual(len(batch), 1)
+
+            # the whole unit of work flushes, whatever the model
+
+            self.source.flush(Bro.thy())
+            self.assertEqual(len(batch), 0)
+
+            cursor = self.source.connection.cursor()
+            cursor.execute("SELECT COUNT(*) AS total FROM test_source.sis_bro")
+            self.assertEqual(cursor.fetchone()["total"], 2)
+
+            self.source.batch_rows = 1
+            self.source.delete_ties(sis)
+            self.source.flush()
+
+            cursor.execute("SELECT COUNT(*) AS total FROM test_source.sis_bro")
+            self.assertEqual(cursor.fetchone()["total"], 0)
+            cursor.close()
+
+    def test_buffer_create(self):
+
+        self.source.execute(Simple.define())
+        self.source.execute(Plain.define())
+
+        source = self.configured(write_behind=True, write_behind_rows=3, write_behind_wait=60)
+
+        self.assertNotIn("write_behind", source.kwargs)
+
+        simple = Simple("sure").create()
+
+        Plain(simple.id, "yep").create()
+        Plain(simple.id, "sure").create()
+
+        self.assertEqual(source.buffer.rows, 2)
+        self.assertEqual(len(source.buffer), 1)
+
+        Plain(simple.id, "fine").create()
+
+        self.assertEqual(source.buffer.rows, 0)
+
+        cursor = self.source.connection.cursor()
+        cursor.execute("SELECT COUNT(*) AS total FROM test_source.plain")
+        self.assertEqual(cursor.fetchone()["total"], 3)
+        cursor.execute("SELECT COUNT(*) AS total FROM test_source.simple")
+        self.assertEqual(cursor.fetchone()["total"], 0)
+        cursor.close()
+
+        # The flush ran on its own connection, leaving ours uncommitted
+
+        self.assertTrue(source.pending())
+        source.connection.rollback()
+
+        # Rows that fail raise for whoever wrote them, on their next create
+
+        Plain(1, "yep").create()
+        Plain(1, "new").create()
+        self.assertRaisesRegex(pymysql.err.IntegrityError, "Duplicate entry", Plain(1, "again").create)
+
+        source.close()
+
+    def test_buffer_flush(self):
+
+        self.source.execute(Simple.define())
+        self.source.execute(Plain.define())
+
+        source = self.configured(write_behind=True, write_behind_wait=60)
+
+        Plain(1, "yep").create()
+        Plain(1, "sure").create()
+
+        # Reading a buffered table flushes it first
+
+        self.assertEqual(Plain.many().count(), 2)
+        self.assertEqual(source.buffer.rows, 0)
+
+        # A bad row only keeps itself out, and is kept, raising on the next flush
+
+        Plain(1, "yep").create()
+        Plain(1, "new").create()
+
+        source.buffer_flush()
+
+        self.assertEqual(source.buffer.rows, 0)
+        self.assertEqual(len(source.buffer.failed), 1)
+        self.assertEqual(source.buffer.failed[0]["table"], ("test_source", "plain"))
+        self.assertEqual(source.buffer.failed[0]["args"], [1, "yep"])
+        self.assertIsInstance(source.buffer.failed[0]["error"], pymysql.err.IntegrityError)
+
+        cursor = self.source.connection.cursor()
+        cursor.execute("SELECT COUNT(*) AS total FROM test_source.plain")
+        self.assertEqual(cursor.fetchone()["total"], 3)
+        cursor.close()
+
+        self.assertRaisesRegex(pymysql.err.IntegrityError, "Duplicate entry", source.flush)
+        source.flush()
+
+        # Deadlocks put the rows back in line
+
+        Plain(1, "later").create()
+
+        with unittest.mock.patch.object(source, "batch_execute", side_effect=pymysql.err.OperationalError(1213, "Deadlock found")):
+            source.buffer_flush()
+
+        self.assertEqual(source.buffer.rows, 1)
+
+        source.buffer_flush()
+        self.assertEqual(source.buffer.rows, 0)
+        self.assertEqual(Plain.many(name="later").count(), 1)
+
+        source.close()
+
+    def test_buffer_flush_other(self):
+
+        self.source.execute(Simple.define())
+        self.source.execute(Plain.define())
+
+        source = self.configured(write_behind=True, write_behind_wait=60)
+
+        Plain(1, "yep").create()
+        self.assertEqual(source.buffer.rows, 1)
+
+        # Reading any table flushes everything written behind, as joins and ties read others
+
+        self.assertEqual(Simple.many().count(), 0)
+        self.assertEqual(source.buffer.rows, 0)
+
+        cursor = self.source.connection.cursor()
+        cursor.execute("SELECT COUNT(*) AS total FROM test_source.plain")
+        self.assertEqual(cursor.fetchone()["total"], 1)
+        cursor.close()
+
+        source.close()
+
+    def test_buffer_wait(self):
+
+        self.source.execute(Simple.define())
+        self.source.execute(Plain.define())
+
+        source = self.configured(write_behind=True, write_behind_wait=0.1)
+
+        Plain(1, "yep").create()
+
+        self.assertEqual(source.buffer.rows, 1)
+
+        for _ in range(50):
+            if not source.buffer.rows and not source.buffer.flushing:
+                break
+            threading.Event().wait(0.1)
+
+        self.assertEqual(source.buffer.rows, 0)
+
+        cursor = self.source.connection.cursor()
+        cursor.execute("SELECT COUNT(*) AS total FROM test_source.plain")
+        self.assertEqual(cursor.fetchone()["total"], 1)
+        cursor.close()
+
+        source.close()
+
+    def test_close(self):
+
+        self.source.execute(Simple.define())
+        self.source.execute(Plain.define())
+
+        source = self.configured(write_behind=True, write_behind_wait=60)
+
+        Plain(1, "yep").create()
+
+        source.close()
+
+        self.assertEqual(source.connections, {})
+        self.assertEqual(source.buffer.rows, 0)
+        self.assertIsNone(source.buffer.connection)
+
+        cursor = self.source.connection.cursor()
+        cursor.execute("SELECT COUNT(*) AS total FROM test_source.plain")
+        self.assertEqual(cursor.fetchone()["total"], 1)
+        cursor.close()
+
+    def test_invalidate(self):
+
+        source = self.configured(cache=True)
+
+        source.results.set("a", {("test_source", "unit")}, 1)
+        source.results.set("b", {("test_source", "test")}, 2)
+
+        source.invalidate("test_source", "unit")
+        self.assertEqual(list(source.results.entries), ["b"])
+
+        source.invalidate()
+        self.assertEqual(len(source.results), 0)
+
+        # What's cached between a write and its commit could be from before the write
+
+        source.execute(Unit.define())
+
+        Unit("people").create()
+
+        source.results.set("c", {("test_source", "unit")}, 3)
+        source.results.set("d", {("test_source", "test")}, 4)
+
+        source.commit()
+        self.assertEqual(list(source.results.entries), ["d"])
+
+        source.results.set("e", {("test_source", "unit")}, 5)
+
+        source.commit()
+        self.assertEqual(list(source.results.entries), ["d", "e"])
+
+    def test_uncache(self):
+
+        source = self.configured(cache=True, count_cache_ttl=60, titles_cache=True)
+
+        source.results.set("a", {("test_source", "unit")}, 1)
+        source.counts.set("b", {("test_source", "unit")}, 2)
+        source.titled.set("c", {("test_source", "unit")}, 3)
+        source.titled.set("d", {("test_source", "test")}, 4)
+
+        with source.session() as identities:
+
+            identities[("test_source", "unit")] = {}
+
+            source.uncache("test_source", "unit")
+
+            self.assertEqual(len(source.results), 0)
+            self.assertEqual(len(source.counts), 0)
+            self.assertEqual(list(source.titled.entries), ["d"])
+            self.assertEqual(identities, {("test_source", "unit"): {}})
+
+        source.uncache()
+        self.assertEqual(len(source.titled), 0)
+
+    def test_fetch(self):
+
+        source = self.configured(cache=True, cache_ttl=60)
+
+        self.assertNotIn("cache", source.kwargs)
+
+        source.execute(Unit.define())
+        source.execute(Test.define())
+
+        Unit([["people"], ["stuff"]]).create()
+
+        self.assertEqual(Unit.many().name, ["people", "stuff"])
+        self.assertEqual(Unit.many().count(), 2)
+        self.assertEqual(source.results.statistics()["misses"], 2)
+
+        self.assertEqual(Unit.many().name, ["people", "stuff"])
+        self.assertEqual(Unit.many().count(), 2)
+        self.assertEqual(source.results.statistics()["hits"], 2)
+
+        # writes to the table drop what was read from it
+
+        Unit("things").create()
+
+        self.assertEqual(len(source.results), 0)
+        self.assertEqual(Unit.many().name, ["people", "stuff", "things"])
+
+        Test(unit_id=1, name="moar").create()
+        self.assertEqual(len(source.results), 1)
+
+        Unit.many(name="things").delete()
+        self.assertEqual(Unit.many().count(), 2)
+
+        Unit.many(name="stuff").set(name="thing").update()
+        self.assertEqual(Unit.many().name, ["people", "thing"])
+
+        # JSON fields decode the same from the cache
+
+        source.execute(Meta.define())
+
+        Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+
+        self.assertEqual(Meta.one(name="yep").things, {"a": 1})
+        self.assertEqual(Meta.one(name="yep").things, {"a": 1})
+
+        # nothing's cached in a unit of work
+
+        statistics = source.results.statistics()
+
+        with source.transaction():
+            self.assertEqual(Unit.many().count(), 2)
+
+        self.assertEqual(source.results.statistics(), statistics)
+
+    def test_execute(self):
+
+        self.source.execute("")
+
+        self.source.execute(relations_sql.SQL("""CREATE TABLE IF NOT EXISTS `test_source`.`simple` (
+  `id` BIGINT AUTO_INCREMENT,
+  `name` VARCHAR(255) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE `name` (`name`)
+);"""))
+
+        cursor = self.source.connection.cursor()
 
         cursor.execute("DESCRIBE `test_source`.`simple`")
 
@@ -194,34 +2075,219 @@ class TestSource(unittest.TestCase):
         self.assertEqual(name["Field"], "name")
         self.assertEqual(name["Type"], "varchar(255)")
 
+    def test_execute_progress(self):
+
+        self.source.execute(Simple.define())
+
+        # ; in strings doesn't split, and progress hears about each statement
+
+        events = []
+
+        self.source.execute("INSERT INTO `test_source`.`simple` (`name`) VALUES ('a;\nb');\nDELETE FROM `test_source`.`simple`", events.append)
+
+        self.assertEqual([(event["statement"], event["rows"]) for event in events], [(1, 1), (2, 1)])
+        self.assertEqual(events[0]["sql"], "INSERT INTO `test_source`.`simple` (`name`) VALUES ('a;\nb')")
+        self.assertGreaterEqual(events[0]["seconds"], 0)
+
+    def test_execute_multi(self):
+
+        self.source.execute(Simple.define())
+
+        # several to a round trip
+
+        source = self.configured(multi_statements=2)
+
+        self.assertNotIn("multi_statements", source.kwargs)
+
+        events = []
+
+        source.execute(iter([
+            "INSERT INTO `test_source`.`simple` (`name`) VALUES ('a;b')",
+            "INSERT INTO `test_source`.`simple` (`name`) VALUES ('c'), ('d')",
+            "UPDATE `test_source`.`simple` SET `name`=CONCAT(`name`, '!')"
+        ]), events.append)
+
+        self.assertEqual([(event["statement"], event["rows"]) for event in events], [(1, 1), (2, 2), (3, 3)])
+
+        cursor = self.source.connection.cursor()
+
+        cursor.execute("SELECT `name` FROM `test_source`.`simple` ORDER BY `name`")
+        self.assertEqual([row["name"] for row in cursor.fetchall()], ["a;b!", "c!", "d!"])
+
+        self.assertRaises(
+            pymysql.err.ProgrammingError, source.execute,
+            "DELETE FROM `test_source`.`simple` WHERE `name`='c!'; SELECT nope FROM nowhere; DELETE FROM `test_source`.`simple`"
+        )
+
+        # what ran before the error isn't committed
+
+        cursor.execute("SELECT `name` FROM `test_source`.`simple` ORDER BY `name`")
+        self.assertEqual([row["name"] for row in cursor.fetchall()], ["a;b!", "c!", "d!"])
+
+        cursor.close()
+        source.close()
+
+    def test_execute_trigger(self):
+
+        self.source.execute(Unit.define())
+
+        # the ; in a trigger's body don't split it
+
+        self.source.execute("""CREATE TRIGGER `test_source`.`unit_name` BEFORE INSERT ON `test_source`.`unit` FOR EACH ROW
+BEGIN
+    IF NEW.`name` = 'people' THEN
+        SET NEW.`name` = 'persons';
+    END IF;
+    SET NEW.`name` = UPPER(NEW.`name`);
+END;
+INSERT INTO `test_source`.`unit` (`name`) VALUES ('people');
+""")
+
+        self.assertEqual(Unit.many().name, ["PERSONS"])
+
+    def test_split(self):
+
+        self.assertEqual(self.source.split("SELECT ';'; SELECT 2;\n"), ["SELECT ';'", "SELECT 2"])
+
+    def test_stream(self):
+
+        with open("ddl/stream.sql", "w") as sql_file:
+            sql_file.write("SELECT 'a;b';\n" * 3 + "SELECT 2")
+
+        with open("ddl/stream.sql", "r") as sql_file:
+            self.assertEqual(list(self.source.stream(sql_file, size=5)), ["SELECT 'a;b'"] * 3 + ["SELECT 2"])
+
+    def test_execute_batches(self):
+
+        self.source.multi_statements = 2
+        self.source.multi_statements_bytes = 20
+
+        self.assertEqual(list(self.source.execute_batches(["a" * 5, "b" * 5, "c" * 5, "d" * 15, "e" * 30])), [
+            ["a" * 5, "b" * 5],
+            ["c" * 5],
+            ["d" * 15],
+            ["e" * 30]
+        ])
+
     def test_init(self):
 
         class Check(relations.Model):
             id = int
             name = str
 
-        model = Check()
+        model = Check()
+
+        self.source.init(model)
+
+        self.assertEqual(model.SCHEMA, "test_source")
+        self.assertEqual(model.STORE, "check")
+        self.assertTrue(model._fields._names["id"].auto)
+
+    def test_define(self):
+
+        self.assertEqual(self.source.define(Simple.thy().define()),
+"""CREATE TABLE IF NOT EXISTS `test_source`.`simple` (
+  `id` BIGINT AUTO_INCREMENT,
+  `name` VARCHAR(255) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE `name` (`name`)
+);
+""")
+
+        cursor = self.source.connection.cursor()
+        cursor.execute(self.source.define(Simple.thy().define()))
+        cursor.close()
+
+    def test_define_extract_index(self):
+
+        source = self.configured(extract_index=True)
+
+        self.assertEqual(source.define(Meta.thy().define()),
+"""CREATE TABLE IF NOT EXISTS `test_source`.`meta` (
+  `id` BIGINT AUTO_INCREMENT,
+  `name` VARCHAR(255) NOT NULL,
+  `flag` TINYINT,
+  `spend` DOUBLE,
+  `people` JSON NOT NULL,
+  `stuff` JSON NOT NULL,
+  `things` JSON NOT NULL,
+  `things__for__0____1` VARCHAR(255) AS (`things`->>'$.for[0]."1"'),
+  PRIMARY KEY (`id`),
+  INDEX `things__for__0____1` (`things__for__0____1`),
+  UNIQUE `name` (`name`)
+);
+""")
+
+        source.execute(Meta.define())
+
+        plan = source.explain("SELECT * FROM `test_source`.`meta` WHERE `things__for__0____1`=%s", ("yep",))
+        self.assertEqual(plan["query_block"]["table"]["key"], "things__for__0____1")
+
+    def test_extract_columns(self):
+
+        self.assertEqual(self.source.extract_columns([
+            {"name": "id", "store": "id"},
+            {"name": "ip", "store": "ip", "extract": {"value": "int", "address": "str"}},
+            {"name": "push", "store": "push", "inject": "stuff__a", "extract": {"a": "str"}},
+            {"name": "meta", "store": False, "extract": {"a": "str"}}
+        ]), ["ip__address", "ip__value"])
+
+    def test_extract_columns_json(self):
+
+        # lists and dicts are generated as JSON columns, which MySQL can't index
+
+        self.assertEqual(self.source.extract_columns([
+            {"name": "meta", "store": "meta", "extract": {"a": "str", "b": "list", "c": "dict", "d": "bool", "e": "float"}}
+        ]), ["meta__a", "meta__d", "meta__e"])
+
+        class Doc(SourceModel):
+            id = int
+            name = str
+            body = dict, {"extract": {"title": str, "tags": list, "meta": dict}}
+
+        source = self.configured(extract_index=True)
+
+        ddl = source.define(Doc.thy().define())
+
+        self.assertIn("INDEX `body__title` (`body__title`)", ddl)
+        self.assertNotIn("INDEX `body__tags`", ddl)
+        self.assertNotIn("INDEX `body__meta`", ddl)
+
+        source.execute(Doc.define())
+
+        Doc("sure", {"title": "yep", "tags": ["a"], "meta": {"b": 1}}).create()
+        self.assertEqual(Doc.one(body__title="yep").body["tags"], ["a"])
+
+        source.close()
 
-        self.source.init(model)
+    def test_extract_indexes(self):
 
-        self.assertEqual(model.SCHEMA, "test_source")
-        self.assertEqual(model.STORE, "check")
-        self.assertTrue(model._fields._names["id"].auto)
+        definition = {
+            "name": "net",
+            "fields": [
+                {"name": "id", "store": "id"},
+                {"name": "ip", "store": "ip", "extract": {"value": "int", "address": "str"}}
+            ],
+            "index": {"address": ["ip__address", "id"]}
+        }
 
-    def test_define(self):
+        self.assertEqual(self.source.extract_indexes(definition), {
+            **definition,
+            "index": {"address": ["ip__address", "id"], "ip__value": ["ip__value"]}
+        })
 
-        self.assertEqual(self.source.define(Simple.thy().define()),
-"""CREATE TABLE IF NOT EXISTS `test_source`.`simple` (
-  `id` BIGINT AUTO_INCREMENT,
-  `name` VARCHAR(255) NOT NULL,
-  PRIMARY KEY (`id`),
-  UNIQUE `name` (`name`)
-);
-""")
+        self.assertNotIn("ip__value", definition["index"])
 
-        cursor = self.source.connection.cursor()
-        cursor.execute(self.source.define(Simple.thy().define()))
-        cursor.close()
+        self.assertEqual(self.source.extract_indexes({"store": "nets"}, definition), {"store": "nets"})
+
+        self.assertEqual(self.source.extract_indexes({
+            "fields": {
+                "add": [{"name": "meta", "store": "meta", "extract": {"a": "str"}}],
+                "change": {"ip": {"store": "addr", "extract": {"value": "int", "address": "str", "version": "int"}}}
+            }
+        }, definition)["index"], {
+            "add": {"meta__a": ["meta__a"], "addr__version": ["addr__version"]}
+        })
 
     def test_create_query(self):
 
@@ -328,6 +2394,116 @@ class TestSource(unittest.TestCase):
 
         cursor.close()
 
+    def test_upsert_query(self):
+
+        query = self.source.upsert_query(Unit.thy(), [{"id": None, "name": "people"}, {"id": 2, "name": "stuff"}])
+
+        self.assertEqual(query.sql,
+            "INSERT INTO `test_source`.`unit` (`id`,`name`) VALUES (%s,%s),(%s,%s) "
+            "ON DUPLICATE KEY UPDATE `name`=VALUES(`name`)"
+        )
+        self.assertEqual(query.args, [None, "people", 2, "stuff"])
+
+        query = self.source.upsert_query(SisBro.thy(), [{"bro_id": 1, "sis_id": 2}])
+
+        self.assertEqual(query.sql,
+            "INSERT INTO `test_source`.`sis_bro` (`bro_id`,`sis_id`) VALUES (%s,%s) "
+            "ON DUPLICATE KEY UPDATE `bro_id`=VALUES(`bro_id`),`sis_id`=VALUES(`sis_id`)"
+        )
+
+    def test_upsert(self):
+
+        self.source.execute(Unit.define())
+        self.source.execute(Meta.define())
+
+        Unit("people").create()
+
+        units = Unit([["people"], ["stuff"]])
+
+        self.assertEqual(self.source.upsert(units), {"inserted": 1, "updated": 0, "unchanged": 1})
+        self.assertEqual(Unit.many().name, ["people", "stuff"])
+
+        # models without ties get their ids too
+
+        self.assertEqual(units.id, [Unit.one(name="people").id, Unit.one(name="stuff").id])
+
+        people = Unit.one(name="people")
+
+        self.assertEqual(self.source.upsert(Unit(id=people.id, name="persons")), {"inserted": 0, "updated": 1, "unchanged": 0})
+        self.assertEqual(Unit.many().name, ["persons", "stuff"])
+
+        Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+
+        meta = Meta("yep", False, 2.2, {"dick"}, [2], {"b": 2})
+
+        self.assertEqual(self.source.upsert(meta), {"inserted": 0, "updated": 1, "unchanged": 0})
+        self.assertEqual(self.source.upsert(Meta("nope", False, 2.2, {"dick"}, [2], {"b": 2})), {"inserted": 1, "updated": 0, "unchanged": 0})
+        self.assertEqual(self.source.upsert(Meta("nope", False, 2.2, {"dick"}, [2], {"b": 2})), {"inserted": 0, "updated": 0, "unchanged": 1})
+
+        meta = Meta.one(name="yep")
+        self.assertEqual(meta.flag, False)
+        self.assertEqual(meta.things, {"b": 2})
+
+        units = Unit.bulk()
+
+        for index in range(5):
+            units.add(f"unit-{index}")
+
+        units.add("stuff")
+
+        source = self.configured(batch_rows=2)
+
+        self.assertEqual(source.upsert(units), {"inserted": 5, "updated": 0, "unchanged": 1})
+        self.assertEqual(Unit.many().count(), 7)
+
+    def test_upsert_ids(self):
+
+        self.source.execute(Unit.define())
+
+        Unit("people").create()
+
+        cursor = self.source.connection.cursor()
+
+        units = Unit([["people"], ["stuff"]])
+
+        self.assertRaisesRegex(
+            relations.ModelError, "unit: upserted {'name': 'stuff'} not found to get its id",
+            self.source.upsert_ids, cursor, units, units._models
+        )
+
+        units = Unit([["people"]])
+        self.source.upsert_ids(cursor, units, units._models)
+        self.assertEqual(units.id, [Unit.one(name="people").id])
+
+        cursor.close()
+
+    def test_upsert_ties(self):
+
+        self.source.execute(Sis.define())
+        self.source.execute(Bro.define())
+        self.source.execute(SisBro.define())
+
+        tom = Bro("Tom").create()
+        dick = Bro("Dick").create()
+
+        Sis("Sally", bro_id=[tom.id]).create()
+
+        sises = Sis([{"name": "Sally", "bro_id": [dick.id]}, {"name": "Mary", "bro_id": [tom.id, dick.id]}])
+
+        self.assertEqual(self.source.upsert(sises), {"inserted": 1, "updated": 0, "unchanged": 1})
+
+        sally = Sis.one(name="Sally")
+        mary = Sis.one(name="Mary")
+
+        self.assertEqual(sises.id, [sally.id, mary.id])
+        self.assertEqual(sally.bro_id, [dick.id])
+        self.assertEqual(sorted(mary.bro_id), sorted([tom.id, dick.id]))
+
+        self.assertRaisesRegex(
+            relations.ModelError, "cannot upsert ties in bulk mode",
+            self.source.upsert, Sis("Sue", bro_id=[tom.id], _bulk=True)
+        )
+
     def test_retrieve_field(self):
 
         field = relations.Field(int, name="id")
@@ -453,6 +2629,17 @@ class TestSource(unittest.TestCase):
         self.assertEqual(query.args, [])
         self.assertIsNone(unit._sort)
 
+    def test_sort_extract(self):
+
+        net = Net.one()
+
+        net._sort = ['+ip__value', '-ip__other']
+        query = self.source.SELECT()
+        self.source.sort(net, query)
+        query.generate()
+        self.assertEqual(query.sql, """SELECT ORDER BY `ip__value` ASC,`ip`->>%s DESC""")
+        self.assertEqual(query.args, ['$.other'])
+
     def test_limit(self):
 
         unit = Unit.one()
@@ -603,7 +2790,8 @@ LIMIT %s""")
 
         self.assertEqual(query.sql,
 """SELECT
-  *
+  `id`,
+  `name`
 FROM
   `test_source`.`unit`
 WHERE
@@ -618,6 +2806,25 @@ ORDER BY
 LIMIT %s""")
         self.assertEqual(query.args, [2, '%p%', 5])
 
+    def test_titles_query_fields(self):
+
+        query = self.source.titles_query(Test.many())
+        query.generate()
+
+        self.assertEqual(query.sql, "SELECT `id`,`unit_id`,`name` FROM `test_source`.`test` ORDER BY `unit_id` ASC,`name` ASC")
+
+        query = self.source.titles_query(Plain.many())
+        query.generate()
+
+        self.assertEqual(query.sql, "SELECT * FROM `test_source`.`plain` ORDER BY `simple_id` ASC,`name` ASC")
+
+    def test_titles_columns(self):
+
+        self.assertEqual(self.source.titles_columns(Unit.many()), ["id", "name"])
+        self.assertEqual(self.source.titles_columns(Test.many()), ["id", "unit_id", "name"])
+        self.assertEqual(self.source.titles_columns(Net.many()), ["id", "ip"])
+        self.assertIsNone(self.source.titles_columns(Plain.many()))
+
     def test_count(self):
 
         self.source.execute(Unit.define())
@@ -643,6 +2850,105 @@ LIMIT %s""")
         self.assertEqual(Sis.many(bro_id=[tom.id]).count(), 1)
         self.assertEqual(Sis.many(bro_id=[999]).count(), 0)
 
+    def test_count_approximate(self):
+
+        source = self.configured(count_approximate=10)
+
+        source.execute(Unit.define())
+
+        units = Unit.bulk()
+
+        for index in range(30):
+            units.add(f"unit-{index}")
+
+        units.create()
+
+        cursor = source.connection.cursor()
+        cursor.execute("SET SESSION information_schema_stats_expiry=0")
+        cursor.execute("ANALYZE TABLE `test_source`.`unit`")
+        cursor.fetchall()
+        cursor.close()
+
+        units = Unit.many()
+        self.assertGreaterEqual(units.count(), 10)
+        self.assertTrue(units._approximate)
+
+        units = Unit.many(name="unit-1")
+        self.assertEqual(units.count(), 1)
+        self.assertFalse(units._approximate)
+
+        with source.transaction():
+            units = Unit.many()
+            self.assertEqual(units.count(), 30)
+            self.assertFalse(units._approximate)
+
+    def test_count_cache(self):
+
+        source = self.configured(count_cache_ttl=60)
+
+        source.execute(Unit.define())
+
+        Unit([["stuff"], ["people"]]).create()
+
+        self.assertEqual(Unit.many().count(), 2)
+        self.assertEqual(Unit.many(name="people").count(), 1)
+
+        cursor = source.connection.cursor()
+        cursor.execute("INSERT INTO `test_source`.`unit` (`name`) VALUES ('things')")
+        source.commit()
+        cursor.close()
+
+        self.assertEqual(Unit.many().count(), 2)
+        self.assertEqual(source.counts.statistics()["hits"], 1)
+
+        Unit("more").create()
+
+        self.assertEqual(Unit.many().count(), 4)
+        self.assertEqual(Unit.many(name="people").count(), 1)
+
+        source.counts.ttl = 0
+
+        cursor = source.connection.cursor()
+        cursor.execute("INSERT INTO `test_source`.`unit` (`name`) VALUES ('again')")
+        source.commit()
+        cursor.close()
+
+        self.assertEqual(Unit.many().count(), 5)
+
+    def test_table_rows(self):
+
+        self.source.execute(Unit.define())
+
+        cursor = self.source.connection.cursor()
+        self.assertEqual(self.source.table_rows(cursor, "test_source", "unit"), 0)
+        self.assertIsNone(self.source.table_rows(cursor, "test_source", "nope"))
+        cursor.close()
+
+    def test_estimate(self):
+
+        self.source.execute(Unit.define())
+
+        Unit([["stuff"], ["people"]]).create()
+
+        cursor = self.source.connection.cursor()
+
+        model = Unit.many(name="people")
+        query = self.source.count_query(model)
+        query.generate()
+        self.assertEqual(self.source.estimate(cursor, model, query), 1)
+
+        model = Unit.many(name="nope")
+        query = self.source.count_query(model)
+        query.generate()
+        self.assertIsNone(self.source.estimate(cursor, model, query))
+
+        model = Unit.many()
+        query = self.source.count_query(model)
+        query.generate()
+        self.assertIsInstance(self.source.estimate(cursor, model, query), int)
+
+        cursor.close()
+
     def test_values_retrieve(self):
 
         model = unittest.mock.MagicMock()
@@ -654,35 +2960,211 @@ LIMIT %s""")
         stuff.kind = list
         things.kind = dict
 
-        people.store = "people"
-        stuff.store = "stuff"
-        things.store = "things"
+        people.store = "people"
+        stuff.store = "stuff"
+        things.store = "things"
+
+        model._fields._order = [people, stuff, things]
+
+        values = {
+            "people": "sure",
+            "stuff": None,
+            "things": None
+        }
+
+        self.assertEqual(self.source.values_retrieve(model, values), {
+            "people": "sure",
+            "stuff": None,
+            "things": None
+        })
+
+        values = {
+            "people": "sure",
+            "stuff": '[]',
+            "things": '{}'
+        }
+
+        self.assertEqual(self.source.values_retrieve(model, values), {
+            "people": "sure",
+            "stuff": [],
+            "things": {}
+        })
+
+    def test_values_tuples(self):
+
+        model = unittest.mock.MagicMock()
+        people = unittest.mock.MagicMock()
+        stuff = unittest.mock.MagicMock()
+        things = unittest.mock.MagicMock()
+
+        people.kind = str
+        stuff.kind = list
+        things.kind = dict
+
+        people.store = "people"
+        stuff.store = "stuff"
+        things.store = "things"
+
+        model._fields._order = [people, stuff, things]
+
+        rows = self.source.values_tuples(model, ["people", "stuff", "things"], [("sure", None, '{}'), ("fine", '[1]', None)])
+
+        self.assertEqual([dict(row) for row in rows], [
+            {"people": "sure", "stuff": None, "things": {}},
+            {"people": "fine", "stuff": [1], "things": None}
+        ])
+
+        self.assertIs(rows[0].index, rows[1].index)
+
+        rows = self.source.values_tuples(model, ["people"], [("sure",)])
+
+        self.assertEqual(rows[0].values, ("sure",))
+
+    def test_fetch_tuples(self):
+
+        source = self.configured(tuples=True, cache=True)
+
+        self.assertNotIn("tuples", source.kwargs)
+
+        source.execute(Meta.define())
+        source.execute(Unit.define())
+        source.execute(Test.define())
+
+        Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+        Meta("sure", False, 2.2, {"dick"}, [2], {"for": [{"1": "yes"}]}).create()
+
+        query = source.retrieve_query(Meta.many())
+        query.generate()
+
+        cursor = source.driver.cursor(source.connection, tuples=True)
+
+        columns, rows = source.fetch_tuples(cursor, query)
+
+        self.assertEqual(columns[:3], ["id", "name", "flag"])
+        self.assertIsInstance(rows[0], tuple)
+        self.assertEqual(rows[0][1], "yep")
+
+        self.assertEqual(source.fetch_tuples(cursor, query), (columns, rows))
+        self.assertEqual(source.results.statistics()["hits"], 1)
+
+        cursor.close()
+
+        # retrieve builds models the same from tuples
+
+        metas = Meta.many().retrieve()
+
+        self.assertEqual(metas.name, ["yep", "sure"])
+        self.assertEqual(metas[0].people, {"tom"})
+        self.assertEqual(metas[0].stuff, [1, None])
+        self.assertEqual(metas[1].things, {"for": [{"1": "yes"}]})
+
+        meta = Meta.one(name="yep")
+        self.assertEqual(meta.spend, 1.1)
+
+        meta.flag = False
+        meta.update()
+
+        self.assertEqual(Meta.one(name="yep").flag, False)
+
+        unit = Unit("people")
+        unit.test.add("stuff")
+        unit.create()
+
+        self.assertEqual(Unit.one().test.name, ["stuff"])
+
+        # the identity map still gets dicts
+
+        with source.session():
+            self.assertEqual(Meta.one(name="sure").spend, 2.2)
+            self.assertIsInstance(source.identities()[("test_source", "meta")][2], dict)
+
+    def test_identify(self):
+
+        with self.source.session() as identities:
+
+            self.source.identify(Unit.many(), [{"id": 1, "name": "people"}])
+            self.assertEqual(identities, {("test_source", "unit"): {1: {"id": 1, "name": "people"}}})
+
+    def test_compact(self):
+
+        self.source.execute(Meta.define())
+        self.source.execute(Net.define())
+        self.source.execute(Sis.define())
+        self.source.execute(Bro.define())
+        self.source.execute(SisBro.define())
+
+        Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+        Meta("sure", False, 2.2, {"dick"}, [2], {"for": [{"1": "yes"}]}).create()
+
+        metas = self.source.compact(Meta.many())
+
+        self.assertIsInstance(metas, relations_pymysql.Compact)
+        self.assertEqual(len(metas), 2)
+        self.assertEqual(metas.name, Meta.many().name)
+        self.assertEqual(metas.people, [{"tom"}, {"dick"}])
+        self.assertEqual(metas[0].stuff, [1, None])
+        self.assertEqual(metas[1]["things"], {"for": [{"1": "yes"}]})
+        self.assertEqual(metas.export(), [meta.export() for meta in Meta.many()])
+
+        self.assertEqual(self.source.compact(Meta.many(flag=False)).name, ["sure"])
+        self.assertRaisesRegex(relations.ModelError, "meta: more than one retrieved", self.source.compact, Meta.one())
+
+        Net(ip="1.2.3.4", subnet="1.2.3.0/24").create()
+
+        nets = self.source.compact(Net.many())
+        self.assertEqual(nets[0].ip.compressed, "1.2.3.4")
+        self.assertEqual(str(nets[0].subnet), "1.2.3.0/24")
+
+        # ties are filled in with a query per relation
+
+        tom = Bro("Tom").create()
+        dick = Bro("Dick").create()
+        Sis("Mary", bro_id=[tom.id, dick.id]).create()
+        Sis("Sue", bro_id=[tom.id]).create()
+        Sis("Ann").create()
+
+        sises = self.source.compact(Sis.many())
+
+        self.assertEqual(sises.name, ["Ann", "Mary", "Sue"])
+        self.assertEqual(sises.bro_id, [set(), {tom.id, dick.id}, {tom.id}])
+        self.assertEqual(self.source.compact(Bro.many()).sis_id, [{1}, {1, 2}])
+
+        self.assertEqual(len(self.source.compact(Sis.many(name="nope"))), 0)
+
+    def test_columns(self):
+
+        self.source.execute(Meta.define())
+
+        Meta("yep", True, 1.1, {"tom"}, [1, None], {"a": 1}).create()
+        Meta("sure", False, 2.2, {"dick"}, [2], {"for": [{"1": "yes"}]}).create()
+        Meta("fine", None, None).create()
+
+        chunks = list(self.source.columns(Meta.many(), chunk=2))
+
+        self.assertEqual([len(chunk["id"]) for chunk in chunks], [2, 1])
+        self.assertEqual(list(chunks[0]), ["id", "name", "flag", "spend", "people", "stuff", "things"])
+
+        first, second = chunks
 
-        model._fields._order = [people, stuff, things]
+        self.assertEqual(first["name"].tolist(), ["fine", "sure"])
+        self.assertEqual(first["id"].values, array.array("q", [3, 2]))
+        self.assertEqual(first["flag"].tolist(), [None, False])
+        self.assertEqual(first["spend"].tolist(), [None, 2.2])
+        self.assertEqual(first["stuff"].decoded, {})
+        self.assertEqual(first["stuff"][1], [2])
+        self.assertEqual(second["things"][0], {"a": 1})
 
-        values = {
-            "people": "sure",
-            "stuff": None,
-            "things": None
-        }
+        # the connection's free once it's all read
 
-        self.assertEqual(self.source.values_retrieve(model, values), {
-            "people": "sure",
-            "stuff": None,
-            "things": None
-        })
+        self.assertEqual(Meta.many().count(), 3)
 
-        values = {
-            "people": "sure",
-            "stuff": '[]',
-            "things": '{}'
-        }
+        # stopping early frees it too
 
-        self.assertEqual(self.source.values_retrieve(model, values), {
-            "people": "sure",
-            "stuff": [],
-            "things": {}
-        })
+        columns = self.source.columns(Meta.many(flag=True), chunk=1)
+        self.assertEqual(next(columns)["name"].tolist(), ["yep"])
+        columns.close()
+
+        self.assertEqual(Meta.many().count(), 3)
 
     def test_retrieve(self):
 
@@ -1020,6 +3502,57 @@ LIMIT %s""")
 
         self.assertEqual(len(Sis.many(bro_id=[tom.id]).titles().ids), 1)
 
+    def test_titles_retrieve(self):
+
+        self.source.execute(Unit.define())
+
+        Unit("people").create()
+
+        # Titles don't retrieve the model or put what they select in the identity map
+
+        units = Unit.many()
+
+        with self.source.session():
+            self.assertEqual(units.titles().titles, {1: ["people"]})
+            self.assertEqual(self.source.identities(), {})
+
+        self.assertEqual(units._action, "retrieve")
+
+        # Already retrieved models make titles from what they have
+
+        units = Unit.many().retrieve()
+        self.assertEqual(units.titles().titles, {1: ["people"]})
+
+    def test_titles_cache(self):
+
+        source = self.configured(titles_cache=True)
+
+        source.execute(Unit.define())
+
+        Unit([["stuff"], ["people"]]).create()
+
+        self.assertEqual(Unit.many().titles().titles, {2: ["people"], 1: ["stuff"]})
+        self.assertEqual(Unit.many().titles().ids, [2, 1])
+        self.assertEqual(source.titled.statistics()["hits"], 1)
+
+        cursor = source.connection.cursor()
+        cursor.execute("UPDATE `test_source`.`unit` SET `name`='persons' WHERE `id`=2")
+        source.commit()
+        cursor.close()
+
+        self.assertEqual(Unit.many().titles().titles, {2: ["people"], 1: ["stuff"]})
+
+        Unit("things").create()
+
+        self.assertEqual(Unit.many().titles().titles, {2: ["persons"], 1: ["stuff"], 3: ["things"]})
+        self.assertEqual(len(Unit.many(name="things").titles()), 1)
+
+        unit = Unit.one(name="stuff")
+        unit.test.add("a").add("b")
+        unit.update()
+
+        self.assertEqual(Test.many().titles().titles, {1: ["stuff", "a"], 2: ["stuff", "b"]})
+
     def test_update_field(self):
 
         # Standard
@@ -1296,6 +3829,104 @@ DROP TABLE IF EXISTS `test_source`.`simple`;
 RENAME TABLE `test_source`.`simple` TO `test_source`.`simples`;
 """)
 
+    def test_migration_online(self):
+
+        source = self.configured(online=True)
+
+        change = {
+            "definition": Simple.thy().define(),
+            "migration": {
+                "source": "PyMySQLSource",
+                "store": "simples"
+            }
+        }
+
+        with open("ddl/migration-2012-07-07.json", 'w') as ddl_file:
+            json.dump({"change": {"simple": change}}, ddl_file)
+
+        os.makedirs("ddl/sourced", exist_ok=True)
+
+        source.migration("ddl/migration-2012-07-07.json", "ddl/sourced")
+
+        with open("ddl/sourced/migration-2012-07-07.sql", 'r') as ddl_file:
+            self.assertEqual(ddl_file.read(), "")
+
+        with open("ddl/sourced/online-2012-07-07.json", 'r') as online_file:
+            self.assertEqual(json.load(online_file), {"simple": change})
+
+    def test_onlineable(self):
+
+        self.assertTrue(self.source.onlineable({"definition": {"id": "id"}, "migration": {}}))
+        self.assertFalse(self.source.onlineable({"definition": {"id": None}, "migration": {}}))
+        self.assertFalse(self.source.onlineable({"definition": {"id": "id"}, "migration": {"schema": "other"}}))
+
+    def test_migrate_online(self):
+
+        source = self.configured(online_chunk=10)
+
+        source.execute(Unit.define())
+
+        units = Unit.bulk()
+
+        for index in range(25):
+            units.add(f"unit-{index}")
+
+        units.create()
+
+        definition = Unit.thy().define()
+        migration = {
+            "fields": {
+                "add": [{"name": "size", "store": "size", "kind": "int", "none": False, "default": 0}],
+                "change": {"name": {"store": "label"}}
+            }
+        }
+
+        reports = []
+
+        def progress(report):
+
+            reports.append(report)
+
+            # Writes during the copy should make it through the triggers
+
+            if len(reports) == 1:
+                cursor = source.connection.cursor()
+                cursor.execute("INSERT INTO `test_source`.`unit` (`name`) VALUES ('during')")
+                cursor.execute("UPDATE `test_source`.`unit` SET `name`='changed' WHERE `name`='unit-0'")
+                cursor.execute("DELETE FROM `test_source`.`unit` WHERE `name`='unit-24'")
+                source.commit()
+
+        migrated = source.migrate_online(migration, definition, progress=progress)
+
+        self.assertEqual(migrated["table"], "unit")
+        self.assertEqual(migrated["chunks"], 3)
+
+        self.assertEqual([report["chunks"] for report in reports], [1, 2, 3])
+        self.assertEqual(reports[-1]["eta"], 0.0)
+
+        cursor = source.connection.cursor()
+
+        cursor.execute("SELECT `label`, `size` FROM `test_source`.`unit` ORDER BY `id`")
+        rows = cursor.fetchall()
+
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[0], {"label": "changed", "size": 0})
+        self.assertEqual(rows[-1], {"label": "during", "size": 0})
+        self.assertNotIn({"label": "unit-24", "size": 0}, rows)
+
+        cursor.execute("SHOW TABLES FROM `test_source`")
+        self.assertEqual([list(row.values())[0] for row in cursor.fetchall()], ["unit"])
+
+        cursor.execute("SHOW TRIGGERS FROM `test_source`")
+        self.assertEqual(cursor.fetchall(), ())
+
+        cursor.close()
+
+        self.assertRaisesRegex(
+            relations.MigrationsError, "can't change unit online",
+            source.migrate_online, {"schema": "other"}, definition
+        )
+
     def test_load(self):
 
         self.source.ids = {}
@@ -1314,6 +3945,20 @@ RENAME TABLE `test_source`.`simple` TO `test_source`.`simples`;
 
         self.assertEqual(cursor.fetchone()["total"], 0)
 
+    def test_load_progress(self):
+
+        migrations = relations.Migrations()
+
+        migrations.generate([Unit])
+        migrations.convert(self.source.name)
+
+        events = []
+
+        self.source.load(f"ddl/{self.source.name}/{self.source.KIND}/definition.sql", events.append)
+
+        self.assertEqual(events[0]["statement"], 1)
+        self.assertIn("CREATE TABLE", events[0]["sql"])
+
     def test_list(self):
 
         os.makedirs(f"ddl/{self.source.name}/{self.source.KIND}")
@@ -1335,6 +3980,19 @@ RENAME TABLE `test_source`.`simple` TO `test_source`.`simples`;
             }
         })
 
+    def test_migrate_table(self):
+
+        cursor = self.source.connection.cursor()
+
+        table = self.source.migrate_table(cursor, "test_source")
+        table.generate()
+        self.assertEqual(table.sql, "`test_source`.`_relations_migration`")
+
+        cursor.execute("SHOW COLUMNS FROM `test_source`.`_relations_migration`")
+        self.assertEqual([row["Field"] for row in cursor.fetchall()], ["stamp", "seconds"])
+
+        cursor.close()
+
     def test_migrate(self):
 
         migrations = relations.Migrations()
@@ -1358,3 +4016,359 @@ RENAME TABLE `test_source`.`simple` TO `test_source`.`simples`;
         self.assertEqual(Case.many().count(), 0)
 
         self.assertFalse(self.source.migrate(f"ddl/{self.source.name}/{self.source.KIND}"))
+
+    def test_migrate_progress(self):
+
+        migrations = relations.Migrations()
+
+        migrations.generate([Unit, Test, Case])
+        migrations.convert(self.source.name)
+
+        self.assertTrue(self.source.migrate(f"ddl/{self.source.name}/{self.source.KIND}"))
+
+        cursor = self.source.connection.cursor()
+        cursor.execute("SELECT * FROM `test_source`.`_relations_migration` WHERE `stamp`='definition'")
+        self.assertIsInstance(cursor.fetchone()["seconds"], float)
+        cursor.close()
+
+        reports = []
+
+        migrations.generate([Unit, Test, Case, Meta])
+        migrations.convert(self.source.name)
+
+        self.assertTrue(self.source.migrate(f"ddl/{self.source.name}/{self.source.KIND}", reports.append))
+
+        self.assertEqual(Meta.many().count(), 0)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]["schema"], "test_source")
+        self.assertEqual(reports[0]["migration"], 1)
+        self.assertEqual(reports[0]["migrations"], 1)
+        self.assertGreaterEqual(reports[0]["seconds"], 0)
+
+        self.assertFalse(self.source.migrate(f"ddl/{self.source.name}/{self.source.KIND}", reports.append))
+        self.assertEqual(len(reports), 1)
+
+    def test_reschema(self):
+
+        commands = ["CREATE TABLE `test_source`.`unit` (`id` INT)"]
+
+        self.assertIs(self.source.reschema(commands, "test_source"), commands)
+        self.assertEqual(list(self.source.reschema(commands, "test_other")), ["CREATE TABLE `test_other`.`unit` (`id` INT)"])
+
+    def test_migrate_schemas(self):
+
+        migrations = relations.Migrations()
+
+        migrations.generate([Unit])
+        migrations.generate([Unit, Test])
+        migrations.convert(self.source.name)
+
+        schemas = ["test_source_1", "test_source_2", "test_source_3"]
+        reports = []
+
+        try:
+
+            self.assertEqual(
+                self.source.migrate_schemas(f"ddl/{self.source.name}/{self.source.KIND}", schemas, 2, reports.append),
+                {"test_source_1": True, "test_source_2": True, "test_source_3": True}
+            )
+
+            self.assertEqual(sorted(report["schema"] for report in reports), schemas)
+
+            cursor = self.source.connection.cursor()
+
+            for schema in schemas:
+                cursor.execute(f"SELECT COUNT(*) AS `total` FROM `{schema}`.`test`")
+                self.assertEqual(cursor.fetchone()["total"], 0)
+                cursor.execute(f"SELECT COUNT(*) AS `total` FROM `{schema}`.`_relations_migration`")
+                self.assertEqual(cursor.fetchone()["total"], 2)
+
+            cursor.close()
+
+            self.assertEqual(
+                self.source.migrate_schemas(f"ddl/{self.source.name}/{self.source.KIND}", schemas),
+                {"test_source_1": False, "test_source_2": False, "test_source_3": False}
+            )
+
+        finally:
+
+            cursor = self.source.connection.cursor()
+
+            for schema in schemas:
+                cursor.execute(f"DROP DATABASE IF EXISTS `{schema}`")
+
+            cursor.close()
+
+
+class TestShardedSource(unittest.TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+
+        self.shards = [
+            relations_pymysql.Source(f"PyMySQLShard{index}", f"test_source_{index}", host=os.environ["MYSQL_HOST"], port=int(os.environ["MYSQL_PORT"]))
+            for index in range(2)
+        ]
+
+        for shard in self.shards:
+            shard.connection.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{shard.schema}`")
+
+        self.source = relations_pymysql.ShardedSource("PyMySQLSharded", self.shards)
+        self.source.execute(Part.define())
+
+    def tearDown(self):
+
+        for shard in self.shards:
+            shard.connection.cursor().execute(f"DROP DATABASE IF EXISTS `{shard.schema}`")
+
+        self.source.close()
+
+    def test___init__(self):
+
+        self.assertEqual(self.source.sources, self.shards)
+        self.assertIsNone(self.source.key)
+        self.assertRaisesRegex(ValueError, "need a range start for every shard after the first", relations_pymysql.ShardedSource, "PyMySQLRanged", self.shards, ranges=[])
+
+    def test_init(self):
+
+        part = Part()
+
+        self.assertIsNone(part.SCHEMA)
+        self.assertEqual(part.STORE, "part")
+
+    def test_shard_key(self):
+
+        self.assertEqual(self.source.shard_key(Part()), "name")
+        self.assertEqual(self.source.shard_key(Unit()), "id")
+
+    def test_shard_index(self):
+
+        self.assertEqual(self.source.shard_index(3), 1)
+        self.assertEqual(self.source.shard_index("abc"), self.source.shard_index("abc"))
+        self.assertIn(self.source.shard_index("abc"), [0, 1])
+
+        ranged = relations_pymysql.ShardedSource("PyMySQLRanged", self.shards, ranges=["m"])
+        self.assertEqual(ranged.shard_index("a"), 0)
+        self.assertEqual(ranged.shard_index("m"), 1)
+        self.assertEqual(ranged.shard_index("z"), 1)
+
+    def test_shard(self):
+
+        self.assertEqual(self.source.shard(Part("abc")), self.shards[self.source.shard_index("abc")])
+        self.assertRaisesRegex(relations.ModelError, "part: no name to shard by", self.source.shard, Part())
+
+        part = Part("abc").create()
+        part.name = "xyz"
+
+        self.assertEqual(self.source.shard(part), self.shards[self.source.shard_index("xyz")])
+        self.assertEqual(self.source.shard(part, original=True), self.shards[self.source.shard_index("abc")])
+
+    def test_targets(self):
+
+        self.assertEqual(self.source.targets(Part.many()), self.shards)
+        self.assertEqual(self.source.targets(Part.many(rank=1)), self.shards)
+        self.assertEqual(self.source.targets(Part.many(name="abc")), [self.shards[self.source.shard_index("abc")]])
+        self.assertEqual(self.source.targets(Part.many(name__in=["abc", "abc"])), [self.shards[self.source.shard_index("abc")]])
+
+    def test_clone(self):
+
+        parts = Part.many(rank=1).limit(5)
+        cloned = self.source.clone(parts)
+        cloned._limit = 10
+
+        self.assertEqual(parts._limit, 5)
+        self.assertIsNot(cloned._record, parts._record)
+        self.assertEqual(cloned._record._names["rank"].criteria, {"eq": 1})
+
+    def test_queries(self):
+
+        queries = self.source.queries(Part.many(name="abc"), lambda source, copied: source.schema)
+
+        self.assertEqual(queries, {self.source.shard_index("abc"): f"test_source_{self.source.shard_index('abc')}"})
+        self.assertEqual(self.source.queries(Part.many(), lambda source, copied: source.schema), {0: "test_source_0", 1: "test_source_1"})
+
+    def test_count_query(self):
+
+        queries = self.source.count_query(Part.many(rank=1))
+
+        for index, query in queries.items():
+            query.generate()
+            self.assertEqual(query.sql, f"SELECT COUNT(*) AS `total` FROM `test_source_{index}`.`part` WHERE `rank`=%s")
+            self.assertEqual(query.args, [1])
+
+        self.assertEqual(list(queries), [0, 1])
+
+    def test_retrieve_query(self):
+
+        queries = self.source.retrieve_query(Part.many(name="abc"))
+        index = self.source.shard_index("abc")
+
+        self.assertEqual(list(queries), [index])
+
+        queries[index].generate()
+        self.assertEqual(queries[index].sql, f"SELECT * FROM `test_source_{index}`.`part` WHERE `name`=%s ORDER BY `name` ASC")
+
+    def test_titles_query(self):
+
+        queries = self.source.titles_query(Part.many())
+
+        for index, query in queries.items():
+            query.generate()
+            self.assertEqual(query.sql, f"SELECT `id`,`name` FROM `test_source_{index}`.`part` ORDER BY `name` ASC")
+
+    def test_define(self):
+
+        ddl = Part.define()
+
+        self.assertIn("CREATE TABLE IF NOT EXISTS `test_source_0`.`part`", ddl[0])
+        self.assertIn("CREATE TABLE IF NOT EXISTS `test_source_1`.`part`", ddl[1])
+
+    def test_create(self):
+
+        names = [f"part-{index}" for index in range(10)]
+
+        for name in names[:5]:
+            Part(name, rank=1).create()
+
+        parts = Part.bulk()
+
+        for name in names[5:]:
+            parts.add(name, rank=2)
+
+        parts.create()
+
+        for shard in self.shards:
+            cursor = shard.connection.cursor()
+            cursor.execute(f"SELECT `name` FROM `{shard.schema}`.`part`")
+            self.assertEqual(
+                sorted(row["name"] for row in cursor.fetchall()),
+                [name for name in names if self.shards[self.source.shard_index(name)] is shard]
+            )
+            cursor.close()
+
+    def test_count(self):
+
+        parts = Part.bulk()
+
+        for index in range(10):
+            parts.add(f"part-{index}", rank=index % 2)
+
+        parts.create()
+
+        self.assertEqual(Part.many().count(), 10)
+        self.assertEqual(Part.many(rank=1).count(), 5)
+        self.assertEqual(Part.many(name="part-3").count(), 1)
+
+    def test_merge(self):
+
+        parts = [Part("b", rank=1), Part("a", rank=None), Part("c", rank=1)]
+
+        self.assertEqual([part.name for part in self.source.merge(Part.many(), list(parts))], ["a", "b", "c"])
+        self.assertEqual([part.name for part in self.source.merge(Part.many().sort("-name"), list(parts))], ["c", "b", "a"])
+        self.assertEqual([part.name for part in self.source.merge(Part.many().sort("+rank", "-name"), list(parts))], ["a", "c", "b"])
+
+        # extracted paths sort by the value at the path
+
+        metas = [Meta("a", things={"for": [{"1": "y"}]}), Meta("b", things={}), Meta("c", things={"for": [{"1": "x"}]})]
+
+        self.assertEqual([meta.name for meta in self.source.merge(Meta.many().sort("things__for__0____1"), list(metas))], ["b", "c", "a"])
+
+    def test_sorting(self):
+
+        self.assertEqual(self.source.sorting(Part("abc"), "name"), "abc")
+        self.assertEqual(self.source.sorting(Meta("a", things={"for": [{"1": "y"}]}), "things__for__0____1"), "y")
+        self.assertIsNone(self.source.sorting(Meta("a", things={}), "things__for__0____1"))
+
+    def test_retrieve(self):
+
+        parts = Part.bulk()
+
+        for index in range(10):
+            parts.add(f"part-{index}", rank=index % 3)
+
+        parts.create()
+
+        self.assertEqual(Part.one(name="part-3").rank, 0)
+        self.assertIsNone(Part.one(name="nope").retrieve(False))
+        self.assertRaisesRegex(relations.ModelError, "part: none retrieved", Part.one(name="nope").retrieve)
+
+        self.assertEqual(Part.many().name, [f"part-{index}" for index in range(10)])
+        self.assertEqual(Part.many(rank=1).name, ["part-1", "part-4", "part-7"])
+        self.assertEqual(Part.many().sort("-name").name, [f"part-{index}" for index in reversed(range(10))])
+
+        limited = Part.many().sort("-name").limit(3, 2).retrieve()
+        self.assertEqual(limited.name, ["part-7", "part-6", "part-5"])
+        self.assertTrue(limited.overflow)
+
+        limited = Part.many().limit(20).retrieve()
+        self.assertEqual(len(limited), 10)
+        self.assertFalse(limited.overflow)
+
+    def test_update(self):
+
+        parts = Part.bulk()
+
+        for index in range(10):
+            parts.add(f"part-{index}", rank=0)
+
+        parts.create()
+
+        self.assertEqual(Part.many(name__in=["part-1", "part-2"]).set(rank=1).update(), 2)
+        self.assertEqual(Part.many(rank=1).name, ["part-1", "part-2"])
+
+        part = Part.one(name="part-3")
+        part.rank = 3
+        self.assertEqual(part.update(), 1)
+        self.assertEqual(Part.one(name="part-3").rank, 3)
+
+        parts = Part.many(rank=0).retrieve()
+        parts.rank = 4
+        self.assertEqual(parts.update(), 7)
+        self.assertEqual(Part.many(rank=4).count(), 7)
+
+        # rows can't move to another shard
+
+        names = [name for name in (f"part-{index}" for index in range(10)) if self.source.shard_index(name) != self.source.shard_index("part-3")]
+
+        part = Part.one(name="part-3")
+        part.name = names[0]
+        self.assertRaisesRegex(relations.ModelError, "part: can't change name to move rows to another shard", part.update)
+
+        self.assertRaisesRegex(
+            relations.ModelError, "part: can't change name to move rows to another shard",
+            Part.many(rank=4).set(name="moved").update
+        )
+
+        self.assertEqual(Part.many(name="part-3").set(name="part-3").update(), 1)
+
+    def test_titles(self):
+
+        parts = Part.bulk()
+
+        for index in range(10):
+            parts.add(f"part-{index}", rank=index % 2)
+
+        parts.create()
+
+        # ids repeat across shards, so title one shard's worth
+
+        names = [name for name in (f"part-{index}" for index in range(10)) if self.source.shard_index(name) == 0]
+
+        titles = Part.many(name__in=names).sort("-name").limit(2).titles()
+
+        self.assertEqual([titles[id] for id in titles.ids], [[name] for name in sorted(names, reverse=True)[:2]])
+
+    def test_delete(self):
+
+        parts = Part.bulk()
+
+        for index in range(10):
+            parts.add(f"part-{index}", rank=index % 2)
+
+        parts.create()
+
+        self.assertEqual(Part.many(rank=1).delete(), 5)
+        self.assertEqual(Part.one(name="part-0").delete(), 1)
+        self.assertEqual(Part.many(name__in=["part-2", "part-4"]).retrieve().delete(), 2)
+        self.assertEqual(Part.many().name, ["part-6", "part-8"])